@@ -0,0 +1,696 @@
+"""
+Carvera firmware simulator.
+
+Serves the console protocol the controller speaks, on TCP (like the WiFi
+module, port 2222 by default) or on a pseudo terminal (like the USB serial
+port), so Controller, WIFIStream/USBStream and XMODEM can be exercised and
+benchmarked without a machine:
+
+    ?                   status report <Idle|MPos:...|WPos:...|...>
+    ! ~ ctrl-x          feed hold, cycle start, reset
+    diagnose            {S:...|L:...|...}
+    ls -e -s DIR        name size date, EOT terminated
+    cat / rm / mv / mkdir / md5sum  ... -e
+    config-get-all -e   the lines of config.txt
+    upload / download   XMODEM (windowed and resumable, as XMODEM.py)
+    play / abort / suspend / resume, with P: progress in the status
+    time / version / model / ftype
+    anything else       G-code, answered with ok
+
+The remote /sd is a local directory (--root). The link adds a one way
+latency with jitter, a bandwidth limit and, during file transfers only,
+errors on the data direction: packets the simulator sends are lost whole,
+packets it receives arrive with a damaged byte (a TCP link never loses
+command bytes, and the classic XMODEM receiver stalls for good on lost
+ACKs; the retries of the data packets are what the error model exercises).
+
+    python benchmarks/firmware_sim.py [--port 2222 | --pty] [--root DIR]
+                                      [--latency MS] [--jitter MS] [--loss P]
+                                      [--rate KB/S] [--window N] [--beacon]
+"""
+import os
+import re
+import sys
+import time
+import heapq
+import random
+import socket
+import hashlib
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from carveracontroller.XMODEM import XMODEM, SOH, STX, EOT, CAN
+from carveracontroller.TransferJournal import TransferJournal
+
+try:
+    from carveracontroller import LzCodec
+except ImportError:
+    LzCodec = None
+
+UDP_PORT = 3333
+BEACON_INTERVAL = 1.0       # s
+READ_SIZE = 4096
+UNESCAPE = {'\x01': ' ', '\x02': '?', '\x03': '&', '\x04': '!', '\x05': '~'}
+FRAMING = SOH + STX + EOT + CAN
+WORDPAT = re.compile(r'([XYZAF])\s*([-+]?\d*\.?\d+)', re.IGNORECASE)
+DIAGNOSE = '{S:0,5000|L:0,0|F:0,0|V:0,0|G:0|T:0|E:0,0,0,0,0,0|P:0,0|A:1,0}'
+DEFAULT_CONFIG = 'sd_ok true\nalpha_steps_per_mm 320\nbeta_steps_per_mm 320\ngamma_steps_per_mm 320\n'
+
+
+# ==============================================================================
+# Latency, jitter, bandwidth and loss of the simulated link
+# ==============================================================================
+class LinkModel:
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, rate=0, seed=1):
+        self.latency = latency      # s, one way
+        self.jitter = jitter        # s, uniform extra delay
+        self.loss = loss            # probability a write is dropped during a transfer
+        self.rate = rate            # bytes/s, 0 for unlimited
+        self.rng = random.Random(seed)
+
+    def delay(self):
+        return self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def lost(self):
+        return bool(self.loss) and self.rng.random() < self.loss
+
+
+# ==============================================================================
+# One client connection: both directions go through a LinkModel. raw_read
+# and raw_write move bytes on the real transport (socket or pty).
+# ==============================================================================
+class Link:
+
+    def __init__(self, raw_read, raw_write, model):
+        self.raw_read = raw_read
+        self.raw_write = raw_write
+        self.model = model
+        self.lossy = None           # 'in' or 'out', the data direction of a running transfer
+        self.closed = False
+        self.cond = threading.Condition()
+        self.inbound = bytearray()
+        self.arriving = []          # heap of (time, order, data)
+        self.leaving = []
+        self.order = 0
+        self.in_free = 0.0          # when the link is free again, per direction
+        self.out_free = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0            # outbound writes lost
+        self.damaged = 0            # inbound writes damaged
+        threading.Thread(target=self._reader, daemon=True).start()
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    # ----------------------------------------------------------------------
+    def _schedule(self, heap, data, free):
+        # delivery keeps the byte order whatever the jitter
+        now = time.perf_counter()
+        start = max(now, free)
+        done = start + (len(data) / self.model.rate if self.model.rate else 0.0)
+        last = max((item[0] for item in heap), default=0.0)
+        self.order += 1
+        heapq.heappush(heap, (max(done + self.model.delay(), last), self.order, bytes(data)))
+        return done
+
+    # ----------------------------------------------------------------------
+    def _damage(self, data):
+        # the client's write boundaries are unknown here, so a lost inbound
+        # write becomes a damaged byte: the CRC fails and the packet is sent
+        # again. Framing bytes are left alone, a dropped header would leave
+        # the receiver hunting for the next one through the payload
+        data = bytearray(data)
+        i = self.model.rng.randrange(len(data))
+        if data[i] not in FRAMING:
+            data[i] = 0x55 if data[i] != 0x55 else 0xaa
+            self.damaged += 1
+        return bytes(data)
+
+    # ----------------------------------------------------------------------
+    def _reader(self):
+        while not self.closed:
+            try:
+                data = self.raw_read(READ_SIZE)
+            except OSError:
+                data = b''
+            with self.cond:
+                if not data:
+                    self.closed = True
+                else:
+                    if self.lossy == 'in' and self.model.lost():
+                        data = self._damage(data)
+                    self.bytes_in += len(data)
+                    self.in_free = self._schedule(self.arriving, data, self.in_free)
+                self.cond.notify_all()
+
+    # ----------------------------------------------------------------------
+    def _writer(self):
+        while True:
+            with self.cond:
+                while not self.leaving or self.leaving[0][0] > time.perf_counter():
+                    if self.closed:
+                        return
+                    self.cond.wait(max(self.leaving[0][0] - time.perf_counter(), 0.0001) if self.leaving else 0.5)
+                data = heapq.heappop(self.leaving)[2]
+            try:
+                self.raw_write(data)
+            except OSError:
+                with self.cond:
+                    self.closed = True
+                    self.cond.notify_all()
+                return
+
+    # ----------------------------------------------------------------------
+    def _arrived(self):
+        now = time.perf_counter()
+        while self.arriving and self.arriving[0][0] <= now:
+            self.inbound.extend(heapq.heappop(self.arriving)[2])
+
+    # ----------------------------------------------------------------------
+    def _wait(self, deadline):
+        wait = deadline - time.perf_counter()
+        if self.arriving:
+            wait = min(wait, max(self.arriving[0][0] - time.perf_counter(), 0.0001))
+        if wait > 0:
+            self.cond.wait(wait)
+
+    # ----------------------------------------------------------------------
+    def read(self, size, timeout=1):
+        """Exactly size bytes, None on timeout (XMODEM getc)"""
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while True:
+                self._arrived()
+                if len(self.inbound) >= size:
+                    data = bytes(self.inbound[:size])
+                    del self.inbound[:size]
+                    return data
+                if self.closed or time.perf_counter() >= deadline:
+                    return None
+                self._wait(deadline)
+
+    # ----------------------------------------------------------------------
+    def read_some(self, timeout=0.5):
+        """Whatever arrived, b'' on timeout, None once the client is gone"""
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while True:
+                self._arrived()
+                if self.inbound:
+                    data = bytes(self.inbound)
+                    self.inbound.clear()
+                    return data
+                if self.closed:
+                    return None
+                if time.perf_counter() >= deadline:
+                    return b''
+                self._wait(deadline)
+
+    # ----------------------------------------------------------------------
+    def write(self, data, timeout=1):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.cond:
+            if self.closed:
+                return None
+            if self.lossy == 'out' and self.model.lost():
+                self.dropped += 1
+            else:
+                self.bytes_out += len(data)
+                self.out_free = self._schedule(self.leaving, data, self.out_free)
+                self.cond.notify_all()
+        return len(data)
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+# ==============================================================================
+# Motion and job state, enough for the status report
+# ==============================================================================
+class Machine:
+
+    def __init__(self, play_rate=200.0):
+        self.play_rate = play_rate  # lines per second while playing
+        self.state = 'Idle'
+        self.pos = [0.0, 0.0, 0.0, 0.0]
+        self.wco = [0.0, 0.0, 0.0, 0.0]
+        self.feed = 0.0
+        self.relative = False
+        self.tool = -1
+        self.lock = threading.Lock()
+        self.job = None             # {'lines', 'started', 'held', 'held_at'}
+
+    # ----------------------------------------------------------------------
+    def _progress(self, now):
+        job = self.job
+        held = job['held'] + (now - job['held_at'] if job['held_at'] else 0.0)
+        elapsed = max(now - job['started'] - held, 0.0)
+        played = min(int(elapsed * self.play_rate), job['lines'])
+        if played >= job['lines'] and not job['held_at']:
+            self.job = None
+            self.state = 'Idle'
+            return None
+        return played, int(played * 100 / max(job['lines'], 1)), int(elapsed)
+
+    # ----------------------------------------------------------------------
+    def status(self):
+        with self.lock:
+            progress = self._progress(time.time()) if self.job else None
+            w = [m - o for m, o in zip(self.pos, self.wco)]
+            report = '<%s|MPos:%.4f,%.4f,%.4f,%.4f|WPos:%.4f,%.4f,%.4f,%.4f|F:%.1f,%.1f,100.0|S:0.0,0.0,100.0,0,25.0' % (
+                self.state, self.pos[0], self.pos[1], self.pos[2], self.pos[3], w[0], w[1], w[2], w[3],
+                self.feed, self.feed)
+            if self.tool >= 0:
+                report += '|T:%d,0.000,%d' % (self.tool, self.tool)
+            if progress:
+                report += '|P:%d,%d,%d' % progress
+            return report + '>'
+
+    # ----------------------------------------------------------------------
+    def play(self, lines):
+        with self.lock:
+            self.job = {'lines': lines, 'started': time.time(), 'held': 0.0, 'held_at': 0.0}
+            self.state = 'Run'
+
+    # ----------------------------------------------------------------------
+    def hold(self):
+        with self.lock:
+            if self.job and not self.job['held_at']:
+                self.job['held_at'] = time.time()
+                self.state = 'Pause'
+
+    # ----------------------------------------------------------------------
+    def resume(self):
+        with self.lock:
+            if self.job and self.job['held_at']:
+                self.job['held'] += time.time() - self.job['held_at']
+                self.job['held_at'] = 0.0
+                self.state = 'Run'
+
+    # ----------------------------------------------------------------------
+    def abort(self):
+        with self.lock:
+            self.job = None
+            self.state = 'Idle'
+
+    # ----------------------------------------------------------------------
+    def gcode(self, line):
+        """Moves happen at once, only the end position is tracked"""
+        upper = line.upper()
+        with self.lock:
+            if 'G91' in upper:
+                self.relative = True
+            elif 'G90' in upper:
+                self.relative = False
+            tool = re.search(r'M6\s*T\s*(-?\d+)', upper)
+            if tool:
+                self.tool = int(tool.group(1))
+            if not re.match(r'^(G0|G1|G91|G90|G53)', upper.replace(' ', '')):
+                return
+            for axis, value in WORDPAT.findall(upper):
+                value = float(value)
+                if axis == 'F':
+                    self.feed = value
+                    continue
+                i = 'XYZA'.index(axis)
+                self.pos[i] = self.pos[i] + value if self.relative else value + self.wco[i]
+            if 'G91' in upper:
+                # jogs are sent as one G91 line, the mode does not stick
+                self.relative = False
+
+
+# ==============================================================================
+# The firmware: console commands, files under root, one client at a time
+# ==============================================================================
+class Simulator:
+
+    def __init__(self, root=None, model=None, window=0, play_rate=200.0, decompress_rate=300 * 1024,
+                 lz=True, name='Simulator', log=None):
+        self.root = os.path.abspath(root or tempfile.mkdtemp(prefix='carvera-sim-'))
+        os.makedirs(os.path.join(self.root, 'gcodes'), exist_ok=True)
+        self.model = model or LinkModel()
+        self.window = window        # packets offered to uploads, 0 for classic XMODEM
+        self.decompress_rate = decompress_rate
+        self.lz = lz and LzCodec is not None
+        self.name = name
+        self.log = log or (lambda text: None)
+        self.machine = Machine(play_rate)
+        self.link = None
+        self.server = None
+        self.port = None
+        self.stopped = threading.Event()
+        self.commands = {
+            'ls': self.cmd_ls, 'cat': self.cmd_cat, 'rm': self.cmd_rm, 'mv': self.cmd_mv,
+            'mkdir': self.cmd_mkdir, 'md5sum': self.cmd_md5sum, 'upload': self.cmd_upload,
+            'download': self.cmd_download, 'play': self.cmd_play, 'abort': self.cmd_abort,
+            'suspend': self.cmd_suspend, 'resume': self.cmd_resume, 'diagnose': self.cmd_diagnose,
+            'config-get-all': self.cmd_config, 'time': self.cmd_time, 'version': self.cmd_version,
+            'model': self.cmd_model, 'ftype': self.cmd_ftype, 'wlan': self.cmd_wlan,
+        }
+
+    # ----------------------------------------------------------------------
+    # Transports
+    # ----------------------------------------------------------------------
+    def serve_tcp(self, host='0.0.0.0', port=2222):
+        """Listen in the background, returns the port (pass 0 for any free one)"""
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(2)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self.port
+
+    def _accept(self):
+        while not self.stopped.is_set():
+            try:
+                conn, addr = self.server.accept()
+            except OSError:
+                return
+            if self.link is not None and not self.link.closed:
+                # the machine only talks to one client
+                conn.close()
+                continue
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.log('client %s:%d connected' % addr)
+            self.link = Link(conn.recv, conn.sendall, self.model)
+            threading.Thread(target=self.session, args=(self.link, conn.close), daemon=True).start()
+
+    # ----------------------------------------------------------------------
+    def serve_pty(self):
+        """Open a pseudo terminal and serve it, returns the device name to connect to"""
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self.link = Link(lambda size: os.read(master, size), lambda data: os.write(master, data), self.model)
+        threading.Thread(target=self.session, args=(self.link, lambda: os.close(master)), daemon=True).start()
+        return os.ttyname(slave)
+
+    # ----------------------------------------------------------------------
+    def beacon(self, address='255.255.255.255'):
+        """Announce the machine on UDP_PORT the way the WiFi module does"""
+        def run():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            while not self.stopped.wait(BEACON_INTERVAL):
+                busy = self.link is not None and not self.link.closed
+                ip = socket.gethostbyname(socket.gethostname())
+                try:
+                    sock.sendto(('%s,%s,%d,%d' % (self.name, ip, self.port or 2222, busy)).encode(),
+                                (address, UDP_PORT))
+                except OSError:
+                    pass
+        threading.Thread(target=run, daemon=True).start()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            try:
+                # wake the accept() thread, close() alone keeps the port listening
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+        if self.link is not None:
+            self.link.close()
+
+    # ----------------------------------------------------------------------
+    # Console
+    # ----------------------------------------------------------------------
+    def session(self, link, close):
+        line = bytearray()
+        try:
+            while not self.stopped.is_set():
+                data = link.read_some(0.5)
+                if data is None:
+                    break
+                for i, c in enumerate(data):
+                    if c == ord('?'):
+                        link.write(self.machine.status() + '\n')
+                    elif c == ord('!'):
+                        self.machine.hold()
+                    elif c == ord('~'):
+                        self.machine.resume()
+                    elif c == 0x18:
+                        self.machine.abort()
+                    elif c == ord('\n'):
+                        text = ''.join(UNESCAPE.get(ch, ch) for ch in line.decode(errors='ignore')).strip()
+                        line.clear()
+                        if text:
+                            # an XMODEM transfer reads the rest of the input itself
+                            with link.cond:
+                                link.inbound[0:0] = data[i + 1:]
+                            self.execute(link, text)
+                            break
+                    elif c != ord('\r'):
+                        line.append(c)
+        finally:
+            link.close()
+            close()
+            self.log('client gone')
+
+    # ----------------------------------------------------------------------
+    def execute(self, link, text):
+        words = text.split()
+        handler = self.commands.get(words[0])
+        self.log('> ' + text)
+        if handler is None:
+            self.machine.gcode(text)
+            link.write('ok\n')
+            return
+        args = [w.replace('\x01', ' ') for w in words[1:]]
+        echo = '-e' in args
+        args = [a for a in args if a not in ('-e', '-s')]
+        try:
+            ok = handler(link, args)
+        except Exception as e:
+            link.write('error: %s\n' % e)
+            ok = False
+        if echo:
+            link.write(EOT if ok is not False else CAN)
+
+    # ----------------------------------------------------------------------
+    def path(self, remote):
+        """Local file for a remote path, never outside root"""
+        remote = remote.replace('\\', '/')
+        if remote.startswith('/sd'):
+            remote = remote[3:]
+        local = os.path.normpath(os.path.join(self.root, remote.lstrip('/')))
+        if local != self.root and not local.startswith(self.root + os.sep):
+            raise ValueError('bad path')
+        return local
+
+    # ----------------------------------------------------------------------
+    def cmd_ls(self, link, args):
+        directory = self.path(args[0] if args else '/sd')
+        if not os.path.isdir(directory):
+            return False
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.name.startswith('.'):
+                continue
+            st = entry.stat()
+            date = datetime.fromtimestamp(st.st_mtime).strftime('%Y%m%d%H%M%S')
+            if entry.is_dir():
+                link.write('%s/ 0 %s\n' % (entry.name.replace(' ', '\x01'), date))
+            else:
+                link.write('%s %d %s\n' % (entry.name.replace(' ', '\x01'), st.st_size, date))
+        return True
+
+    def cmd_cat(self, link, args):
+        with open(self.path(args[0]), 'rb') as f:
+            link.write(f.read().replace(b'\x04', b'').replace(b'\x18', b''))
+        return True
+
+    def cmd_rm(self, link, args):
+        target = self.path(args[0])
+        if os.path.isdir(target):
+            os.rmdir(target)
+        else:
+            os.remove(target)
+        return True
+
+    def cmd_mv(self, link, args):
+        os.replace(self.path(args[0]), self.path(args[1]))
+        return True
+
+    def cmd_mkdir(self, link, args):
+        os.makedirs(self.path(args[0]), exist_ok=True)
+        return True
+
+    def md5(self, filename):
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def cmd_md5sum(self, link, args):
+        link.write('%s  %s\n' % (self.md5(self.path(args[0])), args[0]))
+        return True
+
+    def cmd_config(self, link, args):
+        config = os.path.join(self.root, 'config.txt')
+        text = DEFAULT_CONFIG
+        if os.path.exists(config):
+            with open(config, 'r', errors='ignore') as f:
+                text = f.read()
+        for line in text.splitlines():
+            if line.strip() and not line.startswith('#'):
+                link.write(line + '\n')
+        return True
+
+    # ----------------------------------------------------------------------
+    def _modem(self, link):
+        return XMODEM(lambda size, timeout=1: link.read(size, timeout),
+                      lambda data, timeout=1: link.write(data), 'xmodem8k')
+
+    def cmd_upload(self, link, args):
+        target = self.path(args[0])
+        tmp = os.path.join(os.path.dirname(target), '.' + os.path.basename(target) + '.part')
+        journal = TransferJournal(tmp)
+        resumable = journal.chunks and os.path.exists(tmp)
+        md5 = self.md5(target) if os.path.exists(target) else ''
+        link.lossy = 'in'
+        try:
+            with open(tmp, 'r+b' if resumable else 'wb') as stream:
+                result = self._modem(link).recv(stream, md5, retry=10, window=self.window, journal=journal)
+        finally:
+            link.lossy = None
+        self.log('upload %s: %r' % (args[0], result))
+        if result is None:
+            # keep what arrived for a resumed upload
+            return None
+        journal.finish()
+        if result <= 0:
+            # canceled, or the file is already there (md5 equal)
+            os.remove(tmp)
+            return True if result == 0 else None
+        os.replace(tmp, target)
+        if target.endswith('.lz') and self.lz:
+            threading.Thread(target=self.decompress, args=(link, target), daemon=True).start()
+        return True
+
+    def decompress(self, link, filename):
+        output = filename[:-3]
+        LzCodec.decompress_file(filename, output)
+        os.remove(filename)
+        size = os.path.getsize(output)
+        blocks = (size + LzCodec.BLOCK_SIZE - 1) // LzCodec.BLOCK_SIZE
+        # report progress as slowly as the real controller unpacks
+        started = time.time()
+        duration = size / self.decompress_rate if self.decompress_rate else 0.0
+        done = -1
+        while done < blocks and not link.closed:
+            fraction = min((time.time() - started) / duration, 1.0) if duration else 1.0
+            now = int(blocks * fraction)
+            if now != done:
+                done = now
+                link.write('decompart = %d\n' % done)
+            time.sleep(0.2)
+
+    def cmd_download(self, link, args):
+        source = self.path(args[0])
+        md5 = self.md5(source)
+        link.lossy = 'out'
+        try:
+            with open(source, 'rb') as stream:
+                result = self._modem(link).send(stream, md5, retry=10, quiet=True)
+        finally:
+            link.lossy = None
+        self.log('download %s: %r' % (args[0], result))
+        return result
+
+    # ----------------------------------------------------------------------
+    def cmd_play(self, link, args):
+        with open(self.path(args[0]), 'rb') as f:
+            lines = sum(1 for _ in f)
+        self.machine.play(lines)
+        link.write('Playing %s\n' % args[0])
+        return True
+
+    def cmd_abort(self, link, args):
+        self.machine.abort()
+        return True
+
+    def cmd_suspend(self, link, args):
+        self.machine.hold()
+        return True
+
+    def cmd_resume(self, link, args):
+        self.machine.resume()
+        return True
+
+    def cmd_diagnose(self, link, args):
+        link.write(DIAGNOSE + '\n')
+        return True
+
+    def cmd_time(self, link, args):
+        link.write('time = %d\n' % time.time())
+        return True
+
+    def cmd_version(self, link, args):
+        link.write('version = 1.0.0\n')
+        return True
+
+    def cmd_model(self, link, args):
+        link.write('model = C1\n')
+        return True
+
+    def cmd_ftype(self, link, args):
+        link.write('ftype = %s\n' % ('lz' if self.lz else 'nc'))
+        return True
+
+    def cmd_wlan(self, link, args):
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Carvera firmware simulator')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--pty', action='store_true', help='serve a pseudo terminal instead of TCP')
+    parser.add_argument('--root', help='directory served as /sd, default a temp dir')
+    parser.add_argument('--latency', type=float, default=0.0, help='one way latency in ms')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency in ms')
+    parser.add_argument('--loss', type=float, default=0.0, help='write loss probability during transfers')
+    parser.add_argument('--rate', type=float, default=0.0, help='link bandwidth in KB/s, 0 unlimited')
+    parser.add_argument('--window', type=int, default=0, help='XMODEM window offered to uploads')
+    parser.add_argument('--play-rate', type=float, default=200.0, help='lines per second while playing')
+    parser.add_argument('--decompress-rate', type=float, default=300.0, help='.lz unpacking in KB/s')
+    parser.add_argument('--no-lz', action='store_true', help='report ftype nc')
+    parser.add_argument('--name', default='Simulator')
+    parser.add_argument('--beacon', action='store_true', help='announce on UDP 3333')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    options = parser.parse_args()
+
+    model = LinkModel(options.latency / 1000, options.jitter / 1000, options.loss, options.rate * 1024, options.seed)
+    sim = Simulator(options.root, model, options.window, options.play_rate, options.decompress_rate * 1024,
+                    not options.no_lz, options.name, log=print if options.verbose else None)
+    if options.pty:
+        print('serving %s on %s' % (sim.root, sim.serve_pty()))
+    else:
+        print('serving %s on %s:%d' % (sim.root, options.host, sim.serve_tcp(options.host, options.port)))
+        if options.beacon:
+            sim.beacon()
+    try:
+        while not sim.stopped.wait(1):
+            if options.pty and sim.link.closed:
+                break
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
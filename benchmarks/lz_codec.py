@@ -0,0 +1,132 @@
+"""
+Sequential vs parallel .lz compression and decompression.
+
+Writes a G-code like test file of the given size, encodes it with the
+original one block at a time loop (as Makera.compress_file used to) and
+with LzCodec on thread and process pools, checks every output is bit
+identical and reports the throughput of each.
+
+    python benchmarks/lz_codec.py [--size MB] [--workers N] [--keep DIR]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import struct
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import quicklz
+from carveracontroller import LzCodec
+
+
+def make_gcode(path, size, seed=1):
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        written = 0
+        while written < size:
+            lines = ['G1 X%.3f Y%.3f Z%.3f F%d\n' % (rng.uniform(0, 360), rng.uniform(0, 240),
+                                                     rng.uniform(-10, 0), rng.choice((800, 1200, 2000)))
+                     for _ in range(10000)]
+            chunk = ''.join(lines)
+            f.write(chunk)
+            written += len(chunk)
+
+
+# ------------------------------------------------------------------------------
+# Reference: the sequential encoder and decoder
+# ------------------------------------------------------------------------------
+def legacy_compress(input_filename, output_filename, block_size=LzCodec.BLOCK_SIZE):
+    total = 0
+    with open(input_filename, 'rb') as f_in, open(output_filename, 'wb') as f_out:
+        while True:
+            block = f_in.read(block_size)
+            if not block:
+                break
+            for byte in block:
+                total += byte
+            compressed = quicklz.compress(block)
+            f_out.write(struct.pack('>I', len(compressed)))
+            f_out.write(compressed)
+        f_out.write(struct.pack('>H', total & 0xffff))
+
+
+def legacy_decompress(input_filename, output_filename):
+    total = 0
+    read_size = 0
+    file_size = os.path.getsize(input_filename)
+    with open(input_filename, 'rb') as f_in, open(output_filename, 'wb') as f_out:
+        while read_size != file_size - 2:
+            size = struct.unpack('>I', f_in.read(4))[0]
+            read_size += 4 + size
+            block = quicklz.decompress(f_in.read(size))
+            for byte in block:
+                total += byte
+            f_out.write(block)
+
+
+def same(a, b):
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        while True:
+            x = fa.read(1 << 20)
+            if x != fb.read(1 << 20):
+                return False
+            if not x:
+                return True
+
+
+def timed(fn, *args, **kwargs):
+    t = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=256, help='test file size in MB')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--keep', help='directory for the test files (kept), default a temp dir')
+    options = parser.parse_args()
+
+    directory = options.keep or tempfile.mkdtemp()
+    os.makedirs(directory, exist_ok=True)
+    source = os.path.join(directory, 'test.nc')
+    if not os.path.exists(source) or os.path.getsize(source) < options.size * 1024 * 1024:
+        make_gcode(source, options.size * 1024 * 1024)
+    size = os.path.getsize(source) / 1e6
+    reference = source + '.ref.lz'
+
+    ok = True
+    try:
+        t = timed(legacy_compress, source, reference)
+        print('compress    sequential          %8.1f MB/s' % (size / t))
+        for processes in (False, True):
+            for workers in sorted({1, options.workers}):
+                out = source + '.lz'
+                t = timed(LzCodec.compress_file, source, out, workers=workers, processes=processes)
+                good = same(out, reference)
+                ok = ok and good
+                print('compress    %-9s x%-3d       %8.1f MB/s  identical=%s' % (
+                    'processes' if processes else 'threads', workers, size / t, good))
+
+        t = timed(legacy_decompress, reference, source + '.ref.out')
+        print('decompress  sequential          %8.1f MB/s' % (size / t))
+        for processes in (False, True):
+            for workers in sorted({1, options.workers}):
+                out = source + '.out'
+                t = timed(LzCodec.decompress_file, reference, out, workers=workers, processes=processes)
+                good = same(out, source)
+                ok = ok and good
+                print('decompress  %-9s x%-3d       %8.1f MB/s  identical=%s' % (
+                    'processes' if processes else 'threads', workers, size / t, good))
+    finally:
+        if not options.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""
+End to end benchmarks of the client stack, with JSON results to compare
+between releases.
+
+Runs over every file in carveracontroller/gcodes/Examples plus synthetic
+files of the given line counts:
+
+    parse     CNC.parseLine, lines/s
+    mesh      MyMeshManager.add_data_arrs + generate_meshes, s and peak MB
+              (no window or GL context, needs kivy for its Matrix)
+    lz        LzCodec.compress_file / decompress_file, MB/s (needs quicklz)
+    xmodem    XMODEM.send / recv over an in-memory pipe, classic and
+              windowed, MB/s
+    status    StatusReport parse + diff + apply as Controller does, reports/s
+
+    python benchmarks/suite.py [--output FILE] [--synthetic N,N] [--only parse,lz]
+    python benchmarks/suite.py --compare BASE.json [NEW.json] [--threshold 0.1]
+
+Without NEW.json the suite runs first and the fresh results are compared
+against BASE.json. The exit status is 1 if a metric got worse by more than
+the threshold.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from carveracontroller.CNC import CNC
+from carveracontroller.XMODEM import XMODEM
+from carveracontroller.StatusReport import StatusReport
+from carveracontroller.__version__ import __version__
+from xmodem_window import Pipe
+
+EXAMPLES = os.path.join(ROOT, 'carveracontroller', 'gcodes', 'Examples')
+BENCHMARKS = ('parse', 'mesh', 'lz', 'xmodem', 'status')
+OPTIONAL = {'mesh': 'carveracontroller.MeshManager', 'lz': 'carveracontroller.LzCodec'}
+SYNTHETIC = '1000000,5000000'
+LOAD_INTERVAL = 10000       # lines per batch handed to the viewer, as Makera.load
+XMODEM_LIMIT = 4            # MB of each input sent over XMODEM
+XMODEM_WINDOW = 16
+STATUS_REPORTS = 100000
+MIN_TIME = 1.0              # s spent per measurement at least, best run counts
+THRESHOLD = 0.1
+MB = 1024 * 1024
+
+
+# ------------------------------------------------------------------------------
+# Inputs
+# ------------------------------------------------------------------------------
+def examples():
+    files = []
+    for path, dirs, names in os.walk(EXAMPLES):
+        dirs.sort()
+        files.extend(os.path.join(path, name) for name in sorted(names) if not name.startswith('.'))
+    return files
+
+
+def make_gcode(path, lines, seed=1):
+    """Short roughing like G1 steps (CNC.motionPath splits moves every 0.5 mm,
+    so the step size sets the point count) with a rapid and a tool change
+    now and then"""
+    rng = random.Random(seed)
+    x, y, z = 180.0, 120.0, -1.0
+    with open(path, 'w') as f:
+        f.write('G21 G90 G94\nM6 T1\nM3 S12000\nG0 X%.3f Y%.3f Z5\n' % (x, y))
+        for i in range(4, lines):
+            if i % 50000 == 0:
+                f.write('M6 T%d\n' % (i // 50000 % 6 + 1))
+            elif i % 100 == 0:
+                f.write('G0 Z5\n')
+            else:
+                x = min(max(x + rng.uniform(-2, 2), 0), 360)
+                y = min(max(y + rng.uniform(-2, 2), 0), 240)
+                z = min(max(z + rng.uniform(-0.2, 0.2), -10), 0)
+                f.write('G1 X%.3f Y%.3f Z%.3f F%d\n' % (x, y, z, rng.choice((800, 1200, 2000))))
+
+
+def status_lines(count, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        x, y, z = rng.uniform(0, 360), rng.uniform(0, 240), rng.uniform(-10, 0)
+        lines.append('<Run|MPos:%.4f,%.4f,%.4f,0.0000|WPos:%.4f,%.4f,%.4f,0.0000|F:%.1f,1500.0,100.0'
+                     '|S:12000.0,12000.0,100.0,0,25.0|T:1,-12.345,1|W:0.00|L:0,0,0,0.0,100.0|P:%d,%d,%d>'
+                     % (x, y, z, x - 10, y - 10, z + 40, rng.uniform(0, 1500), i, i * 100 // count, i // 100))
+    return lines
+
+
+# ------------------------------------------------------------------------------
+# Benchmarks, each returns a dict of metrics
+# ------------------------------------------------------------------------------
+def parse_file(path):
+    """Parse like Makera.load: batches of coordinates every LOAD_INTERVAL lines"""
+    cnc = CNC()
+    cnc.init()
+    batches = []
+    line_no = 0
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line_no, line in enumerate(f, 1):
+            cnc.parseLine(line, line_no)
+            if line_no % LOAD_INTERVAL == 0:
+                batches.append(cnc.coordinates)
+                cnc.coordinates = []
+    if cnc.coordinates:
+        batches.append(cnc.coordinates)
+    return line_no, batches
+
+
+def timed(fn, *args):
+    """Best time of fn(*args), repeated until MIN_TIME is spent so small
+    inputs do not compare noise. Returns (seconds, last result)"""
+    best = None
+    spent = 0.0
+    while spent < MIN_TIME:
+        t = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+        spent += elapsed
+    return best, result
+
+
+def bench_parse(path):
+    elapsed, (lines, batches) = timed(parse_file, path)
+    return {'lines_per_s': lines / elapsed, 'lines': lines,
+            'points': sum(len(batch) for batch in batches)}, batches
+
+
+def build_meshes(batches):
+    from carveracontroller.MeshManager import MyMeshManager
+    manager = MyMeshManager()
+    for i, batch in enumerate(batches):
+        manager.add_data_arrs(batch, i == len(batches) - 1)
+    return manager
+
+
+def bench_mesh(batches):
+    t = time.perf_counter()
+    manager = build_meshes(batches)
+    elapsed = time.perf_counter() - t
+    meshes = len(manager.meshes)
+    del manager
+    # a second run under tracemalloc for the peak, it slows the first down too much
+    tracemalloc.start()
+    try:
+        manager = build_meshes(batches)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del manager
+    return {'build_seconds': elapsed, 'peak_mb': peak / MB, 'meshes': meshes}
+
+
+def bench_lz(path, work):
+    from carveracontroller import LzCodec
+    size = os.path.getsize(path) / MB
+    lz = os.path.join(work, 'bench.lz')
+    out = os.path.join(work, 'bench.out')
+    t = time.perf_counter()
+    LzCodec.compress_file(path, lz)
+    compress = time.perf_counter() - t
+    t = time.perf_counter()
+    LzCodec.decompress_file(lz, out)
+    decompress = time.perf_counter() - t
+    ratio = os.path.getsize(lz) / max(os.path.getsize(path), 1)
+    os.remove(lz)
+    os.remove(out)
+    return {'compress_mb_per_s': size / compress, 'decompress_mb_per_s': size / decompress, 'ratio': ratio}
+
+
+def transfer(payload, window):
+    rng = random.Random(1)
+    down = Pipe(0.0, float('inf'), 0.0, rng)
+    up = Pipe(0.0, float('inf'), 0.0, rng)
+    sender = XMODEM(lambda size, timeout=1: up.read(size, timeout), lambda data, timeout=1: down.write(data))
+    receiver = XMODEM(lambda size, timeout=1: down.read(size, timeout), lambda data, timeout=1: up.write(data))
+    out = io.BytesIO()
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(
+        received=receiver.recv(out, md5='0' * 32, retry=30, timeout=1, window=window)))
+    thread.start()
+    sent = sender.send(io.BytesIO(payload), '1' * 32, retry=30, timeout=1)
+    thread.join()
+    if not sent or out.getvalue() != payload:
+        raise RuntimeError('XMODEM transfer failed')
+
+
+def bench_xmodem(path):
+    with open(path, 'rb') as f:
+        payload = f.read(XMODEM_LIMIT * MB)
+    size = len(payload) / MB
+    return {'classic_mb_per_s': size / timed(transfer, payload, 0)[0],
+            'windowed_mb_per_s': size / timed(transfer, payload, XMODEM_WINDOW)[0]}
+
+
+def bench_status(count=STATUS_REPORTS):
+    lines = status_lines(count)
+
+    def parse():
+        vars = dict(CNC.vars)
+        prev = None
+        for line in lines:
+            status = StatusReport.parse(line, prev)
+            status.apply(vars, status.diff(prev))
+            prev = status
+
+    elapsed = timed(parse)[0]
+    return {'reports_per_s': count / elapsed}
+
+
+# ------------------------------------------------------------------------------
+# Which direction is better, by metric name
+# ------------------------------------------------------------------------------
+def higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+
+def lower_is_better(metric):
+    return metric in ('build_seconds', 'peak_mb')
+
+
+def run(options):
+    only = set(options.only.split(',')) if options.only else set(BENCHMARKS)
+    work = tempfile.mkdtemp(prefix='carvera-bench-')
+    results = {}
+
+    def record(name, metrics):
+        results[name] = metrics
+        print('%-48s %s' % (name, '  '.join('%s %.4g' % item for item in sorted(metrics.items()))))
+        sys.stdout.flush()
+
+    for name, module in OPTIONAL.items():
+        if name in only:
+            try:
+                __import__(module)
+            except ImportError as e:
+                print('%s skipped: %s' % (name, e))
+                only.discard(name)
+
+    try:
+        inputs = [(os.path.relpath(path, EXAMPLES).replace(os.sep, '/'), path) for path in examples()]
+        for lines in [int(n) for n in options.synthetic.split(',') if n.strip()]:
+            path = os.path.join(work, 'synthetic_%d.nc' % lines)
+            make_gcode(path, lines)
+            inputs.append(('synthetic/%d' % lines, path))
+
+        for name, path in inputs:
+            batches = None
+            if only & {'parse', 'mesh'}:
+                metrics, batches = bench_parse(path)
+                if 'parse' in only:
+                    record('parse:' + name, metrics)
+            if 'mesh' in only and batches:
+                record('mesh:' + name, bench_mesh(batches))
+            batches = None
+            if 'lz' in only:
+                record('lz:' + name, bench_lz(path, work))
+            if 'xmodem' in only:
+                record('xmodem:' + name, bench_xmodem(path))
+        if 'status' in only:
+            record('status', bench_status())
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    return {'meta': meta(), 'results': results}
+
+
+def meta():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    return {'version': __version__, 'commit': commit, 'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+# ------------------------------------------------------------------------------
+# Compare two result sets, return the regressions
+# ------------------------------------------------------------------------------
+def compare(base, new, threshold=THRESHOLD):
+    regressions = []
+    print('%-48s %-20s %12s %12s %8s' % ('benchmark', 'metric', 'base', 'new', 'change'))
+    for name in sorted(set(base['results']) & set(new['results'])):
+        old_metrics, new_metrics = base['results'][name], new['results'][name]
+        for metric in sorted(set(old_metrics) & set(new_metrics)):
+            if not (higher_is_better(metric) or lower_is_better(metric)):
+                continue
+            old, value = old_metrics[metric], new_metrics[metric]
+            if not old:
+                continue
+            change = (value - old) / old
+            worse = -change if higher_is_better(metric) else change
+            flag = ''
+            if worse > threshold:
+                flag = '  REGRESSION'
+                regressions.append((name, metric, change))
+            print('%-48s %-20s %12.4g %12.4g %+7.1f%%%s' % (name, metric, old, value, change * 100, flag))
+    for name in sorted(set(base['results']) ^ set(new['results'])):
+        print('%-48s only in %s' % (name, 'base' if name in base['results'] else 'new'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client stack benchmarks')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--synthetic', default=SYNTHETIC, help='line counts of synthetic files, "" for none')
+    parser.add_argument('--only', help='comma separated subset of ' + ','.join(BENCHMARKS))
+    parser.add_argument('--compare', nargs='+', metavar='JSON', help='BASE.json [NEW.json]')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative change counted as regression')
+    options = parser.parse_args()
+
+    if options.compare and len(options.compare) > 1:
+        with open(options.compare[1], 'r') as f:
+            new = json.load(f)
+    else:
+        new = run(options)
+        if options.output:
+            with open(options.output, 'w') as f:
+                json.dump(new, f, indent=1, sort_keys=True)
+    if not options.compare:
+        return 0
+
+    with open(options.compare[0], 'r') as f:
+        base = json.load(f)
+    print()
+    regressions = compare(base, new, options.threshold)
+    print('\n%d regression(s) over %.0f%%' % (len(regressions), options.threshold * 100))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
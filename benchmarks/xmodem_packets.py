@@ -0,0 +1,108 @@
+"""
+Compare XMODEM packet assembly against the original implementation.
+
+Builds every packet of a random file both ways, checks they are byte
+identical (CRC and checksum modes, 128 and 8k packets) and reports the
+packet rate of each.
+
+    python benchmarks/xmodem_packets.py [size_in_kb]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from carveracontroller.XMODEM import XMODEM, SOH, STX
+
+
+# ------------------------------------------------------------------------------
+# Reference: packet assembly and CRC as XMODEM.send used to do it
+# ------------------------------------------------------------------------------
+def legacy_crc(data, crc=0):
+    for char in bytearray(data):
+        crctbl_idx = ((crc >> 8) ^ char) & 0xff
+        crc = ((crc << 8) ^ XMODEM.crctable[crctbl_idx]) & 0xffff
+    return crc & 0xffff
+
+
+def legacy_packets(stream, md5, packet_size, crc_mode, pad=b'\x1a'):
+    is_stx = 1 if packet_size > 255 else 0
+    sequence = 0
+    md5_sent = False
+    while True:
+        if not md5_sent:
+            data = md5.encode()
+            md5_sent = True
+        else:
+            data = stream.read(packet_size)
+        if not data:
+            return
+        header = bytearray([ord(STX) if is_stx else ord(SOH), sequence, 0xff - sequence])
+        if is_stx == 0:
+            data = b''.join([bytes([len(data) & 0xff]), data.ljust(packet_size, pad)])
+        else:
+            data = b''.join([bytes([len(data) >> 8, len(data) & 0xff]), data.ljust(packet_size, pad)])
+        if crc_mode:
+            crc = legacy_crc(data)
+            checksum = bytearray([crc >> 8, crc & 0xff])
+        else:
+            checksum = bytearray([sum(data) % 256])
+        yield bytes(header + data + checksum)
+        sequence = (sequence + 1) % 0x100
+
+
+def current_packets(stream, md5, packet_size, crc_mode, pad=b'\x1a'):
+    modem = XMODEM(None, None)
+    packet = modem._make_packet_buffer(packet_size, crc_mode)
+    pad = pad * packet_size
+    sequence = 0
+    length = modem._fill_packet(packet, packet_size, crc_mode, sequence, pad, data=md5.encode())
+    while length:
+        yield packet
+        sequence = (sequence + 1) % 0x100
+        length = modem._fill_packet(packet, packet_size, crc_mode, sequence, pad, stream=stream)
+
+
+def run(payload, packet_size, crc_mode):
+    md5 = '0123456789abcdef0123456789abcdef'
+    legacy = [p for p in legacy_packets(io.BytesIO(payload), md5, packet_size, crc_mode)]
+
+    identical = True
+    for i, packet in enumerate(current_packets(io.BytesIO(payload), md5, packet_size, crc_mode)):
+        if i >= len(legacy) or bytes(packet) != legacy[i]:
+            identical = False
+            break
+    identical = identical and i == len(legacy) - 1
+
+    t = time.perf_counter()
+    for _ in legacy_packets(io.BytesIO(payload), md5, packet_size, crc_mode):
+        pass
+    legacy_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for _ in current_packets(io.BytesIO(payload), md5, packet_size, crc_mode):
+        pass
+    current_time = time.perf_counter() - t
+
+    return identical, len(legacy), legacy_time, current_time
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 4 * 1024 * 1024
+    # odd length so the last packet is padded
+    payload = os.urandom(size + 77)
+    ok = True
+    for packet_size in (128, 8192):
+        for crc_mode in (1, 0):
+            identical, packets, legacy_time, current_time = run(payload, packet_size, crc_mode)
+            ok = ok and identical
+            print('packet %5d %-8s %6d packets  identical=%-5s  legacy %8.1f MB/s  current %8.1f MB/s  x%.1f' % (
+                packet_size, 'crc' if crc_mode else 'checksum', packets, identical,
+                size / legacy_time / 1e6, size / current_time / 1e6, legacy_time / current_time))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
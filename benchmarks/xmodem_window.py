@@ -0,0 +1,117 @@
+"""
+Classic vs windowed XMODEM over a simulated link.
+
+The link delivers bytes after a one way latency, serialises them at a
+fixed bandwidth and drops whole sender writes with the given probability
+(losses are only injected on the data direction; the classic receiver NAKs
+a resent packet it already has, so lost ACKs stall it for good).
+
+    python benchmarks/xmodem_window.py [--size KB] [--latency MS,MS] [--loss P,P]
+                                       [--rate KB/S] [--window N]
+"""
+import io
+import os
+import sys
+import time
+import heapq
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from carveracontroller.XMODEM import XMODEM
+
+
+# ==============================================================================
+# One direction of a link with latency, bandwidth and loss
+# ==============================================================================
+class Pipe:
+
+    def __init__(self, latency, rate, loss, rng):
+        self.latency = latency
+        self.rate = rate
+        self.loss = loss
+        self.rng = rng
+        self.cond = threading.Condition()
+        self.buffer = bytearray()
+        self.in_flight = []         # heap of (deliver_time, order, data)
+        self.order = 0
+        self.link_free = 0.0
+
+    def write(self, data):
+        now = time.perf_counter()
+        with self.cond:
+            start = max(now, self.link_free)
+            self.link_free = start + len(data) / self.rate
+            if self.loss and self.rng.random() < self.loss:
+                return len(data)
+            self.order += 1
+            heapq.heappush(self.in_flight, (self.link_free + self.latency, self.order, bytes(data)))
+            self.cond.notify_all()
+        return len(data)
+
+    def read(self, size, timeout):
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while True:
+                now = time.perf_counter()
+                while self.in_flight and self.in_flight[0][0] <= now:
+                    self.buffer.extend(heapq.heappop(self.in_flight)[2])
+                if len(self.buffer) >= size:
+                    data = bytes(self.buffer[:size])
+                    del self.buffer[:size]
+                    return data
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self.in_flight:
+                    wait = min(wait, max(self.in_flight[0][0] - now, 0.0001))
+                self.cond.wait(wait)
+
+
+def transfer(payload, latency, rate, loss, window, seed=1):
+    rng = random.Random(seed)
+    down = Pipe(latency, rate, loss, rng)       # sender -> receiver
+    up = Pipe(latency, rate, 0.0, rng)          # receiver -> sender
+
+    sender = XMODEM(lambda size, timeout=1: up.read(size, timeout), lambda data, timeout=1: down.write(data))
+    receiver = XMODEM(lambda size, timeout=1: down.read(size, timeout), lambda data, timeout=1: up.write(data))
+    out = io.BytesIO()
+    result = {}
+
+    t = time.perf_counter()
+    thread = threading.Thread(target=lambda: result.update(
+        received=receiver.recv(out, md5='0' * 32, retry=30, timeout=1, window=window)))
+    thread.start()
+    sent = sender.send(io.BytesIO(payload), '1' * 32, retry=30, timeout=1)
+    thread.join()
+    elapsed = time.perf_counter() - t
+    return sent and out.getvalue() == payload, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=1024, help='file size in KB')
+    parser.add_argument('--latency', default='0,20,40', help='one way latency list in ms')
+    parser.add_argument('--loss', default='0,0.01', help='packet loss probability list')
+    parser.add_argument('--rate', type=int, default=2048, help='link rate in KB/s')
+    parser.add_argument('--window', type=int, default=16)
+    options = parser.parse_args()
+
+    payload = os.urandom(options.size * 1024)
+    ok = True
+    for latency in [float(x) / 1000.0 for x in options.latency.split(',')]:
+        for loss in [float(x) for x in options.loss.split(',')]:
+            row = []
+            for window in (0, options.window):
+                good, elapsed = transfer(payload, latency, options.rate * 1024, loss, window)
+                ok = ok and good
+                row.append('%s %7.1f KB/s%s' % ('window %-2d' % window if window else 'classic  ',
+                                                 options.size / elapsed, '' if good else ' FAILED'))
+            print('latency %3.0f ms  loss %4.1f%%   %s' % (latency * 1000, loss * 100, '   '.join(row)))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
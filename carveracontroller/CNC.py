@@ -169,16 +169,20 @@ class CNC:
     # FIXME will not be needed after Grbl v1.0
 
     #----------------------------------------------------------------------
-    def __init__(self):
+    # vars defaults to the class wide CNC.vars the UI reads; a CNC with its
+    # own dict (e.g. CNC(dict(CNC.vars))) keeps a second machine apart
+    #----------------------------------------------------------------------
+    def __init__(self, vars=None):
+        self.vars = CNC.vars if vars is None else vars
         self.init()
 
     #----------------------------------------------------------------------
     def __getitem__(self, name):
-        return CNC.vars[name]
+        return self.vars[name]
 
     #----------------------------------------------------------------------
     def __setitem__(self, name, value):
-        CNC.vars[name] = value
+        self.vars[name] = value
 
     #----------------------------------------------------------------------
     def initPath(self, x=None, y=None, z=None, a=None):
@@ -212,8 +216,8 @@ class CNC:
 
     #----------------------------------------------------------------------
     def resetMargins(self):
-        CNC.vars["xmin"]  = CNC.vars["ymin"]  = CNC.vars["zmin"]  = 1000000.0
-        CNC.vars["xmax"]  = CNC.vars["ymax"]  = CNC.vars["zmax"]  = -1000000.0
+        self.vars["xmin"]  = self.vars["ymin"]  = self.vars["zmin"]  = 1000000.0
+        self.vars["xmax"]  = self.vars["ymax"]  = self.vars["zmax"]  = -1000000.0
 
     #----------------------------------------------------------------------
     # @return line in broken a list of commands, None if empty or comment
@@ -317,12 +321,12 @@ class CNC:
                 elif gcode == 19:
                     self.plane = YZ
                 elif gcode == 20:	# Switch to inches
-                    if CNC.inch:
+                    if self.inch:
                         self.unit = 1.0
                     else:
                         self.unit = 25.4
                 elif gcode == 21:	# Switch to mm
-                    if CNC.inch:
+                    if self.inch:
                         self.unit = 1.0 / 25.4
                     else:
                         self.unit = 1.0
@@ -342,7 +346,7 @@ class CNC:
                     elif decimal == 1:
                         self.arcabsolute = False
                 elif gcode in (93, 94, 95):
-                    CNC.vars["feedmode"] = gcode
+                    self.vars["feedmode"] = gcode
                 elif gcode == 98:
                     self.retractz = True
                 elif gcode == 99:
@@ -645,12 +649,12 @@ class CNC:
     #----------------------------------------------------------------------
     def pathMargins(self, xyzs):
         for xyz in xyzs:
-            CNC.vars["xmin"] = min(CNC.vars["xmin"], xyz[0])
-            CNC.vars["xmax"] = max(CNC.vars["xmax"], xyz[0])
-            CNC.vars["ymin"] = min(CNC.vars["ymin"], xyz[1])
-            CNC.vars["ymax"] = max(CNC.vars["ymax"], xyz[1])
-            CNC.vars["zmin"] = min(CNC.vars["zmin"], xyz[2])
-            CNC.vars["zmax"] = max(CNC.vars["zmax"], xyz[2])
+            self.vars["xmin"] = min(self.vars["xmin"], xyz[0])
+            self.vars["xmax"] = max(self.vars["xmax"], xyz[0])
+            self.vars["ymin"] = min(self.vars["ymin"], xyz[1])
+            self.vars["ymax"] = max(self.vars["ymax"], xyz[1])
+            self.vars["zmin"] = min(self.vars["zmin"], xyz[2])
+            self.vars["zmax"] = max(self.vars["zmax"], xyz[2])
 
     #----------------------------------------------------------------------
     # init CNC
@@ -0,0 +1,251 @@
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+CONSOLE_CAPACITY = 2000          # lines kept in memory / shown in the MDI console
+SPILL_MAX_BYTES = 1024 * 1024    # size of one on-disk spill file before rotation
+SPILL_BACKUP_COUNT = 4           # rotated spill files kept besides the active one
+INDEX_GRAM = 3                   # n-gram length of the substring index
+SEARCH_MAX_RESULTS = 500
+
+
+# =============================================================================
+# Fixed capacity console history
+#
+# The newest CONSOLE_CAPACITY lines live in a ring buffer. Lines pushed out of
+# the ring are appended to a rotating spill log on disk, so memory use stays
+# flat no matter how long the machine runs. Every line (in memory or spilled)
+# is added to an n-gram index when it arrives, which keeps substring search
+# proportional to the number of candidate lines instead of the whole history.
+# =============================================================================
+class ConsoleBuffer:
+
+    def __init__(self, spill_dir=None, capacity=CONSOLE_CAPACITY,
+                 max_bytes=SPILL_MAX_BYTES, backup_count=SPILL_BACKUP_COUNT):
+        self.capacity = capacity
+        self.spill_dir = spill_dir
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self.lock = threading.RLock()
+        self.lines = deque()         # (seq, text, color)
+        self.next_seq = 0
+        self.first_seq = 0           # oldest seq still searchable
+        self.index = {}              # n-gram -> array of seq (ascending)
+
+        # spill bookkeeping: seq -> (file number, byte offset)
+        self.spill_file = None
+        self.spill_no = 0
+        self.spill_seqs = array('Q')
+        self.spill_files = array('L')
+        self.spill_offsets = array('Q')
+        self.spill_first_seq = {}    # file number -> first seq written to it
+
+        if spill_dir:
+            try:
+                os.makedirs(spill_dir, exist_ok=True)
+            except:
+                self.spill_dir = None
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.lines)
+
+    # ----------------------------------------------------------------------
+    def append(self, text, color):
+        """Add one line, returns the line dropped from memory (or None)"""
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.lines.append((seq, text, color))
+            self._index_line(seq, text)
+            if len(self.lines) > self.capacity:
+                dropped = self.lines.popleft()
+                self._spill(dropped)
+                return dropped
+        return None
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        """Forget the in-memory lines; spilled history stays searchable"""
+        with self.lock:
+            while self.lines:
+                self._spill(self.lines.popleft())
+
+    # ----------------------------------------------------------------------
+    def visible(self):
+        with self.lock:
+            return [(text, color) for seq, text, color in self.lines]
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            if self.spill_file is not None:
+                try:
+                    self.spill_file.close()
+                except:
+                    pass
+                self.spill_file = None
+
+    # ----------------------------------------------------------------------
+    def _grams(self, text):
+        text = text.lower()
+        n = INDEX_GRAM
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    # ----------------------------------------------------------------------
+    def _index_line(self, seq, text):
+        index = self.index
+        for gram in self._grams(text):
+            postings = index.get(gram)
+            if postings is None:
+                postings = index[gram] = array('Q')
+            postings.append(seq)
+
+    # ----------------------------------------------------------------------
+    def _prune_index(self):
+        # drop postings that only point at rotated-away lines
+        first = self.first_seq
+        for gram in list(self.index.keys()):
+            postings = self.index[gram]
+            cut = bisect_left(postings, first)
+            if cut == len(postings):
+                del self.index[gram]
+            elif cut > 0:
+                del postings[:cut]
+
+    # ----------------------------------------------------------------------
+    def _spill(self, entry):
+        seq, text, color = entry
+        if not self.spill_dir:
+            # nowhere to keep it, it leaves the searchable history as well
+            self.first_seq = seq + 1
+            if seq % self.capacity == 0:
+                self._prune_index()
+            return
+        try:
+            if self.spill_file is None:
+                self._open_spill()
+            offset = self.spill_file.tell()
+            self.spill_file.write(('%s\t%s\n' % (self._color_key(color),
+                                   text.replace('\n', ' '))).encode('utf-8'))
+            self.spill_seqs.append(seq)
+            self.spill_files.append(self.spill_no)
+            self.spill_offsets.append(offset)
+            self.spill_first_seq.setdefault(self.spill_no, seq)
+            if self.spill_file.tell() >= self.max_bytes:
+                self._rotate()
+        except:
+            self.spill_dir = None
+            self.first_seq = seq + 1
+
+    # ----------------------------------------------------------------------
+    def _spill_path(self, no):
+        return os.path.join(self.spill_dir, 'console.%d.log' % no)
+
+    # ----------------------------------------------------------------------
+    def _open_spill(self):
+        self.spill_file = open(self._spill_path(self.spill_no), 'w+b')
+
+    # ----------------------------------------------------------------------
+    def _rotate(self):
+        self.spill_file.close()
+        self.spill_no += 1
+        self._open_spill()
+        expired = self.spill_no - self.backup_count - 1
+        if expired in self.spill_first_seq:
+            try:
+                os.remove(self._spill_path(expired))
+            except OSError:
+                pass
+            del self.spill_first_seq[expired]
+            oldest = min(self.spill_first_seq.values()) if self.spill_first_seq \
+                else (self.lines[0][0] if self.lines else self.next_seq)
+            cut = bisect_left(self.spill_seqs, oldest)
+            del self.spill_seqs[:cut]
+            del self.spill_files[:cut]
+            del self.spill_offsets[:cut]
+            self.first_seq = oldest
+            self._prune_index()
+
+    # ----------------------------------------------------------------------
+    def _color_key(self, color):
+        return ','.join('%.3f' % c for c in color)
+
+    # ----------------------------------------------------------------------
+    def _locate(self, seq):
+        """(text, color) of a line in memory, (file number, offset) of a
+        spilled one, None when it is gone; called with the lock held"""
+        if self.lines and seq >= self.lines[0][0]:
+            entry = self.lines[seq - self.lines[0][0]]
+            return entry[1], entry[2]
+        i = bisect_left(self.spill_seqs, seq)
+        if i == len(self.spill_seqs) or self.spill_seqs[i] != seq:
+            return None
+        return self.spill_files[i], self.spill_offsets[i]
+
+    # ----------------------------------------------------------------------
+    def _read_spilled(self, files, no, offset):
+        f = files.get(no)
+        try:
+            if f is None:
+                f = files[no] = open(self._spill_path(no), 'rb')
+            f.seek(offset)
+            raw = f.readline().decode('utf-8', 'replace').rstrip('\n')
+        except OSError:
+            return None
+        color, _, text = raw.partition('\t')
+        return text, tuple(float(c) for c in color.split(','))
+
+    # ----------------------------------------------------------------------
+    def _candidates(self, needle):
+        grams = self._grams(needle)
+        if not grams:
+            # too short for the index, only scan what is still in memory
+            first = self.lines[0][0] if self.lines else self.next_seq
+            return range(self.next_seq - 1, first - 1, -1)
+        lists = []
+        for gram in grams:
+            postings = self.index.get(gram)
+            if not postings:
+                return []
+            lists.append(postings)
+        lists.sort(key=len)
+        result = set(lists[0][bisect_left(lists[0], self.first_seq):])
+        for postings in lists[1:]:
+            result.intersection_update(postings)
+            if not result:
+                break
+        return sorted(result, reverse=True)
+
+    # ----------------------------------------------------------------------
+    def search(self, needle, max_results=SEARCH_MAX_RESULTS):
+        """Return [(text, color)] containing needle (case insensitive),
+        oldest first, limited to the newest max_results matches"""
+        needle = needle.lower()
+        found = []
+        if not needle:
+            return found
+        # only the lookup holds the lock, the spill files are read after it
+        # so appending lines never waits for a search of the disk history
+        with self.lock:
+            if self.spill_file is not None:
+                self.spill_file.flush()
+            located = [self._locate(seq) for seq in self._candidates(needle)]
+        files = {}
+        try:
+            for entry in located:
+                if entry is not None and isinstance(entry[0], int):
+                    entry = self._read_spilled(files, *entry)
+                if entry is None or needle not in entry[0].lower():
+                    continue
+                found.append(entry)
+                if len(found) >= max_results:
+                    break
+        finally:
+            for f in files.values():
+                f.close()
+        found.reverse()
+        return found
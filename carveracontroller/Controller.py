@@ -8,7 +8,6 @@ import sys
 import time
 import threading
 import webbrowser
-import math
 
 from datetime import datetime
 
@@ -17,14 +16,28 @@ try:
 except ImportError:
     from queue import *
 
-from .CNC import CNC
 from .USBStream import USBStream
 from .WIFIStream import WIFIStream
 from .XMODEM import EOT, CAN
+from .StatusReport import StatusReport
+from .GcodeStreamer import GcodeStreamer
+from .SendScheduler import SendScheduler, LANE_NAMES
+from .JogEngine import JogEngine
+from .MachineSnapshot import MachineSnapshot
 
 STREAM_POLL = 0.2 # s
+STREAM_POLL_JOG = 0.1  # s, while jogging
+STREAM_POLL_IDLE = 0.5  # s, idle machine with the window visible
+STREAM_POLL_HIDDEN = 2.0  # s, window minimised
+STREAM_POLL_TRANSFER = 1.0  # s, while loading a file list/file content
+JOG_ACTIVE_TIME = 1.0  # s, a jog keeps the fast rate this long
+IDLE_AFTER = 10.0  # s, idle time before dropping to the idle rate
 DIAGNOSE_POLL = 0.5  # s
-RX_BUFFER_SIZE = 128
+LINK_TIMEOUT = 6.0  # s without a byte from the machine while polling
+RECONNECT_DELAY = 0.5  # s before the first retry, doubled after each failure
+RECONNECT_MAX_DELAY = 16.0  # s
+RECONNECT_TIMEOUT = 300.0  # s of retrying before the connection is given up
+CLOSE_TIMEOUT = 2.0  # s close() waits for the stream thread to stop
 
 GPAT = re.compile(r"[A-Za-z]\s*[-+]?\d+.*")
 FEEDPAT = re.compile(r"^(.*)[fF](\d+\.?\d+)(.*)$")
@@ -63,12 +76,90 @@ LOAD_MV    = 3
 LOAD_MKDIR = 4
 LOAD_WIFI  = 7
 LOAD_CONN_WIFI = 8
+LOAD_MD5   = 9
 
 SEND_FILE = 1
 
 CONN_USB = 0
 CONN_WIFI = 1
 
+# ==============================================================================
+# Status poll scheduler: picks the '?' interval from machine activity and
+# measures the round trip of every status report
+# ==============================================================================
+class StatusPoller:
+    RTT_ALPHA = 0.2
+
+    def __init__(self):
+        self.visible = True
+        self.jog_time = 0.0
+        self.active_time = 0.0
+        self.sent_time = None
+        self.rtt = None  # last round trip, s
+        self.rtt_avg = None  # smoothed round trip, s
+        self.rtt_max = 0.0
+        self.lost = 0  # reports that never came back
+
+    # ----------------------------------------------------------------------
+    def jogged(self):
+        self.jog_time = self.active_time = time.time()
+
+    # ----------------------------------------------------------------------
+    def interval(self, state, transferring, now):
+        if state not in ("Idle", "N/A", "Wait", "Sleep"):
+            self.active_time = now
+        if transferring:
+            return STREAM_POLL_TRANSFER
+        if now - self.jog_time < JOG_ACTIVE_TIME:
+            return STREAM_POLL_JOG
+        if not self.visible:
+            return STREAM_POLL_HIDDEN
+        if now - self.active_time > IDLE_AFTER:
+            return STREAM_POLL_IDLE
+        return STREAM_POLL
+
+    # ----------------------------------------------------------------------
+    def sent(self, now):
+        if self.sent_time is not None:
+            self.lost += 1
+        self.sent_time = now
+
+    # ----------------------------------------------------------------------
+    def received(self, now):
+        if self.sent_time is None:
+            return
+        self.rtt = now - self.sent_time
+        self.sent_time = None
+        self.rtt_max = max(self.rtt_max, self.rtt)
+        if self.rtt_avg is None:
+            self.rtt_avg = self.rtt
+        else:
+            self.rtt_avg += (self.rtt - self.rtt_avg) * self.RTT_ALPHA
+
+    # ----------------------------------------------------------------------
+    def reset(self):
+        self.sent_time = None
+        self.rtt = self.rtt_avg = None
+        self.rtt_max = 0.0
+        self.lost = 0
+
+
+# ------------------------------------------------------------------------------
+# After a reconnect: True when the first status report shows the firmware kept
+# running through the outage (no reboot), so config and version are still valid
+# ------------------------------------------------------------------------------
+def same_session(prev, status):
+    if prev is None or status is None:
+        return False
+    if status.state in ("Alarm", "Sleep") and prev.state != status.state:
+        return False
+    if prev.state not in ("Idle", "Alarm", "Sleep", "Wait", ""):
+        # a job was running: it goes on, or ended while the link was down
+        return status.playedlines >= prev.playedlines or status.state == "Idle"
+    return prev.tool == status.tool and \
+        all(abs(getattr(prev, a) - getattr(status, a)) < 0.001 for a in ("mx", "my", "mz", "ma"))
+
+
 # ==============================================================================
 # Controller class
 # ==============================================================================
@@ -77,16 +168,16 @@ class Controller:
     MSG_ERROR = 1
     MSG_INTERIOR = 2
 
-    stop = threading.Event()
-    usb_stream = None
-    wifi_stream = None
-    stream = None
-    modem = None
     connection_type = CONN_WIFI
 
     def __init__(self, cnc, callback):
+        # everything about the machine lives in the instance, so several
+        # controllers can run side by side (see MachineSession)
+        self.stop = threading.Event()
         self.usb_stream = USBStream()
         self.wifi_stream = WIFIStream()
+        self.stream = None
+        self.modem = None
 
         # Global variables
         self.history = []
@@ -94,6 +185,7 @@ class Controller:
 
         # CNC.loadConfig(Utils.config)
         self.cnc = cnc
+        self.vars = cnc.vars    # machine state, CNC.vars unless cnc has its own
 
         self.execCallback = callback
 
@@ -114,8 +206,21 @@ class Controller:
         self.sendCANCEL = False
 
         self.thread = None
+        self.link_lock = threading.Lock()  # stream reopen (relink) against close
 
         self.posUpdate = False  # Update position
+        self.poller = StatusPoller()
+        self.sender = SendScheduler(self.write, self.sendError, self.streaming)
+        self.jogger = JogEngine(self.sendJog)
+        self.conn_type = None  # last opened connection, for reopen()
+        self.address = None
+        self.recorder = None  # TelemetryRecorder fed with every status report
+        self.streamer = None  # GcodeStreamer while a program is streamed directly
+        self.status = None  # Last parsed StatusReport
+        self.snapshot = MachineSnapshot.of(self.vars)  # replaced, never changed, by every report
+        self.snapshot_lock = threading.Lock()  # between writers only, readers take self.snapshot
+        self.status_changed = set()  # Fields changed since the UI last looked
+        self.status_lock = threading.Lock()
         self.diagnoseUpdate = False
         self._probeUpdate = False  # Update probe
         self._gUpdate = False  # Update $G
@@ -137,6 +242,10 @@ class Controller:
 
         self.paused = False
         self.pausing = False
+        self.rx_time = 0.0  # last byte from the machine
+        self.reconnecting = False  # link lost, relink() is retrying
+        self.resume_from = None  # last status before the link was lost
+        self.session_changed = False  # set when the machine rebooted during a reconnect
 
         self.diagnosing = False
 
@@ -174,7 +283,10 @@ class Controller:
             try:
                 if line[-1] != '\n':
                     line += "\n"
-                self.stream.send(line.encode())
+                if not self.sender.send(line.encode()):
+                    reason = 'Streaming G-code' if self.streaming() else 'Command queue full'
+                    self.log.put((Controller.MSG_ERROR, reason + ', dropped: ' + line.strip()))
+                    return
                 if self.execCallback:
                     # 检查文件名是否以 ".lz" 结尾
                     if line.endswith(".lz\n"):
@@ -187,27 +299,51 @@ class Controller:
             except:
                 self.log.put((Controller.MSG_ERROR, str(sys.exc_info()[1])))
 
+    # ----------------------------------------------------------------------
+    # Raw write for the SendScheduler, which orders everything sent
+    # ----------------------------------------------------------------------
+    def write(self, data):
+        self.stream.send(data)
+
+    def sendError(self, error):
+        self.log.put((Controller.MSG_ERROR, str(error)))
+
+    # ----------------------------------------------------------------------
+    # Per-lane send latency, for the console's 'lanes' command
+    # ----------------------------------------------------------------------
+    def laneReport(self):
+        stats = self.sender.stats()
+        lines = []
+        for name in LANE_NAMES:
+            lane = stats[name]
+            line = '%-11s %s' % (name, lane['histogram'].summary())
+            if lane['queued'] or lane['dropped']:
+                line += ', %d queued, %d dropped' % (lane['queued'], lane['dropped'])
+            lines.append(line)
+        lines.append('%-11s %s' % ('jog start', self.jogger.histogram.summary()))
+        return lines
+
     # ----------------------------------------------------------------------
     def autoCommand(self, margin=False, zprobe=False, zprobe_abs=False, leveling=False, goto_origin=False, z_probe_offset_x=0, z_probe_offset_y=0, i=3, j=3, h=5, buffer=False, auto_level_offsets = [0,0,0,0]):
         if not (margin or zprobe or leveling or goto_origin):
             return
-        if abs(CNC.vars['xmin']) > CNC.vars['worksize_x'] or abs(CNC.vars['ymin']) > CNC.vars['worksize_y']:
+        if abs(self.vars['xmin']) > self.vars['worksize_x'] or abs(self.vars['ymin']) > self.vars['worksize_y']:
             return
-        cmd = "M495 X%gY%g" % (CNC.vars['xmin'], CNC.vars['ymin'])
+        cmd = "M495 X%gY%g" % (self.vars['xmin'], self.vars['ymin'])
         if margin:
-            cmd = cmd + "C%gD%g" % (CNC.vars['xmax'], CNC.vars['ymax'])
+            cmd = cmd + "C%gD%g" % (self.vars['xmax'], self.vars['ymax'])
             if buffer:
                 cmd = "buffer " + cmd
             self.executeCommand(cmd) #run margin command. Has to be two seperate commands to offset the start of the autolevel process
-        cmd = "M495 X%gY%g" % (CNC.vars['xmin'] + auto_level_offsets[0], CNC.vars['ymin'] + auto_level_offsets[2]) #reinitialize command with any autolevel offsets
+        cmd = "M495 X%gY%g" % (self.vars['xmin'] + auto_level_offsets[0], self.vars['ymin'] + auto_level_offsets[2]) #reinitialize command with any autolevel offsets
         if zprobe: 
             if zprobe_abs: 
-                cmd = "M495 X%gY%g" % (CNC.vars['xmin'], CNC.vars['ymin']) #reset command for 4th axis
+                cmd = "M495 X%gY%g" % (self.vars['xmin'], self.vars['ymin']) #reset command for 4th axis
                 cmd = cmd + "O0"
             else: 
                 cmd = cmd + "O%gF%g" % (z_probe_offset_x, z_probe_offset_y)
         if leveling:
-            cmd = cmd + "A%gB%gI%dJ%dH%d" % (CNC.vars['xmax'] - (CNC.vars['xmin']+auto_level_offsets[1]+ auto_level_offsets[0]) , CNC.vars['ymax'] - (CNC.vars['ymin']+auto_level_offsets[3] + auto_level_offsets[2]), i, j, h)
+            cmd = cmd + "A%gB%gI%dJ%dH%d" % (self.vars['xmax'] - (self.vars['xmin']+auto_level_offsets[1]+ auto_level_offsets[0]) , self.vars['ymax'] - (self.vars['ymin']+auto_level_offsets[3] + auto_level_offsets[2]), i, j, h)
         if goto_origin:
             cmd = cmd + "P1"
         cmd = cmd + "\n"
@@ -242,19 +378,19 @@ class Controller:
 
     # # ----------------------------------------------------------------------
     # def zProbeCommand(self, c=0, d=0, buffer=False):
-    #     cmd = "M494 X%gY%gC%gD%g\n" % (CNC.vars['xmin'], CNC.vars['ymin'], c, d)
+    #     cmd = "M494 X%gY%gC%gD%g\n" % (self.vars['xmin'], self.vars['ymin'], c, d)
     #     if buffer:
     #         cmd = "buffer " + cmd
     #     self.executeCommand(cmd)
 
     # def autoLevelCommand(self, i=3, j=3, buffer=False):
-    #     cmd = "M495 X%gY%gA%gB%gI%dJ%d\n" % (CNC.vars['xmin'], CNC.vars['ymin'], CNC.vars['xmax'] - CNC.vars['xmin'], CNC.vars['ymax'] - CNC.vars['ymin'], i, j)
+    #     cmd = "M495 X%gY%gA%gB%gI%dJ%d\n" % (self.vars['xmin'], self.vars['ymin'], self.vars['xmax'] - self.vars['xmin'], self.vars['ymax'] - self.vars['ymin'], i, j)
     #     if buffer:
     #         cmd = "buffer " + cmd
     #     self.executeCommand(cmd)
 
     # def probeLevelCommand(self, i=3, j=3, buffer=False):
-    #     cmd = "M496 X%gY%gA%gB%gI%dJ%d\n" % (CNC.vars['xmin'], CNC.vars['ymin'], CNC.vars['xmax'] - CNC.vars['xmin'], CNC.vars['ymax'] - CNC.vars['ymin'], i, j)
+    #     cmd = "M496 X%gY%gA%gB%gI%dJ%d\n" % (self.vars['xmin'], self.vars['ymin'], self.vars['xmax'] - self.vars['xmin'], self.vars['ymax'] - self.vars['ymin'], i, j)
     #     if buffer:
     #         cmd = "buffer " + cmd
     #     self.executeCommand(cmd)
@@ -272,8 +408,8 @@ class Controller:
         elif position == "Anchor2":
             cmd = "M496.4\n"
         elif position == "Path Origin":
-            if abs(CNC.vars['xmin']) <= CNC.vars['worksize_x'] and abs(CNC.vars['ymin']) <= CNC.vars['worksize_y']:
-                cmd = "M496.5 X%gY%g\n" % (CNC.vars['xmin'], CNC.vars['ymin'])
+            if abs(self.vars['xmin']) <= self.vars['worksize_x'] and abs(self.vars['ymin']) <= self.vars['worksize_y']:
+                cmd = "M496.5 X%gY%g\n" % (self.vars['xmin'], self.vars['ymin'])
         if buffer:
             cmd = "buffer " + cmd
         self.executeCommand(cmd)
@@ -478,12 +614,24 @@ class Controller:
         if '\\' in filename:
             upload_command = "upload %s\n" % '/'.join(filename.split('\\')).replace(' ', '\x01')
         self.executeCommand(self.escape(upload_command))
+        self.drainCommands()
 
     def downloadCommand(self, filename):
         download_command = "download %s\n" % filename.replace(' ', '\x01')
         if '\\' in filename:
             download_command = "download %s\n" % '/'.join(filename.split('\\')).replace(' ', '\x01')
         self.executeCommand(self.escape(download_command))
+        self.drainCommands()
+
+    # ----------------------------------------------------------------------
+    # The transfer takes the stream over once the queued commands are out;
+    # if they are stuck, drop them and fail the transfer instead of sending
+    # them into the middle of it
+    # ----------------------------------------------------------------------
+    def drainCommands(self):
+        if not self.sender.drain():
+            self.sender.clear()
+            raise IOError('Command queue did not drain, transfer aborted')
 
     def suspendCommand(self):
         self.executeCommand("suspend\n")
@@ -500,28 +648,62 @@ class Controller:
     def abortCommand(self):
         self.executeCommand("abort\n")
 
+    # ----------------------------------------------------------------------
+    # Stream G-code lines directly instead of uploading and playing a file.
+    # source is a local file name or any iterable of lines. Every ok is
+    # credited to the streamer, so other commands are refused meanwhile
+    # (see streaming()); realtime bytes have no ok and still go out
+    # ----------------------------------------------------------------------
+    def streamGcode(self, source, callback=None):
+        if self.stream is None or (self.streamer and self.streamer.is_active()):
+            return None
+        self.streamer = GcodeStreamer(self.sender.direct, callback=callback)
+        self.streamer.start(source)
+        return self.streamer
+
+    def streaming(self):
+        return self.streamer is not None and self.streamer.is_active()
+
+    def pauseStreamGcode(self):
+        if self.streamer:
+            self.streamer.pause()
+
+    def resumeStreamGcode(self):
+        if self.streamer:
+            self.streamer.resume()
+
+    def abortStreamGcode(self):
+        if self.streamer and self.streamer.is_active():
+            self.streamer.abort()
+            self.feedholdCommand()
+            self.abortCommand()
+
     def feedholdCommand(self):
         if self.stream:
-            self.stream.send('!'.encode())
+            self.jogger.cancel()
+            self.sender.send('!'.encode())
 
     def toggleFeedholdCommand(self, holding):
         if self.stream:
             if holding:
-                self.stream.send('~'.encode())
+                self.sender.send('~'.encode())
             else:
-                self.stream.send('!'.encode())
+                self.sender.send('!'.encode())
 
     def cyclestartCommand(self):
         if self.stream:
-            self.stream.send('~'.encode())
+            self.sender.send('~'.encode())
 
     def estopCommand(self):
         if self.stream:
-            self.stream.send(b'\x18')
+            self.jogger.cancel()
+            self.sender.clear()
+            self.sender.send(b'\x18')
 
     # ----------------------------------------------------------------------
     def hardResetPre(self):
-        self.stream.send(b"reset\n")
+        self.sender.send(b"reset\n")
+        self.sender.drain()
 
     def hardResetAfter(self):
         time.sleep(6)
@@ -530,92 +712,55 @@ class Controller:
         # R: Rotation Angle; G: active Coord System;
         # <Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000,5.3|R:0.0|G:0|F:12345.12,100.0|S:1.2,100.0|T:1|L:0>
         # F: Feed, overide | S: Spindle RPM
-        ln = line[1:-1]  # strip off < .. >
-
-        # split fields
-        l = ln.split('|')
-
-        # strip off status
-        CNC.vars["state"] = l[0]
-
-        # strip of rest into a dict of name: [values,...,]
-        d = {a: [float(y) for y in b.split(',')] for a, b in [x.split(':') for x in l[1:]]}
-        if 'R' in d:
-            CNC.vars["rotation_angle"] = float(d['R'][0])
-        else:
-            CNC.vars["rotation_angle"] = 0.0
-        if 'G' in d:
-            CNC.vars["active_coord_system"] = int(d['G'][0])
-        else:
-            CNC.vars["active_coord_system"] = 0
-        CNC.vars["mx"] = float(d['MPos'][0])
-        CNC.vars["my"] = float(d['MPos'][1])
-        CNC.vars["mz"] = float(d['MPos'][2])
-        if len(d['MPos']) > 3:
-            CNC.vars["ma"] = float(d['MPos'][3])
-        else:
-            CNC.vars["ma"] = 0.0
-        CNC.vars["wx"] = float(d['WPos'][0])
-        CNC.vars["wy"] = float(d['WPos'][1])
-        CNC.vars["wz"] = float(d['WPos'][2])
-        CNC.vars["wa"] = 0.0
-        CNC.vars["wcox"] = round(CNC.vars["mx"] - (math.cos(CNC.vars["rotation_angle"] * math.pi / 180) * CNC.vars["wx"] - math.sin(CNC.vars["rotation_angle"] * math.pi / 180) * CNC.vars["wy"]), 3)
-        CNC.vars["wcoy"] = round(CNC.vars["my"] - (math.sin(CNC.vars["rotation_angle"] * math.pi / 180) * CNC.vars["wx"] + math.cos(CNC.vars["rotation_angle"] * math.pi / 180) * CNC.vars["wy"]), 3)
-        CNC.vars["wcoz"] = round(CNC.vars["mz"] - CNC.vars["wz"], 3)
-        CNC.vars["wcoa"] = round(CNC.vars["mz"] - CNC.vars["wz"], 3)
-        if 'F' in d:
-           CNC.vars["curfeed"] = float(d['F'][0])
-           CNC.vars["tarfeed"] = float(d['F'][1])
-           CNC.vars["OvFeed"]  = int(d['F'][2])
-        if 'S' in d:
-            CNC.vars["curspindle"]  = float(d['S'][0])
-            CNC.vars["tarspindle"]  = float(d['S'][1])
-            CNC.vars["OvSpindle"]   = float(d['S'][2])
-            if len(d['S']) > 3:
-                CNC.vars["vacuummode"] = int(d['S'][3])
-            if len(d['S']) > 4:
-                CNC.vars["spindletemp"] = float(d['S'][4])
-        if 'T' in d:
-            CNC.vars["tool"] = int(d['T'][0])
-            CNC.vars["tlo"] = float(d['T'][1])
-            if len(d['T']) > 2:
-                CNC.vars["target_tool"] = int(d['T'][2])
-            else:
-                CNC.vars["target_tool"] = -1
-        else:
-            CNC.vars["tool"] = -1
-            CNC.vars["tlo"] = 0.0
-            CNC.vars["target_tool"] = -1
-        if 'W' in d:
-            CNC.vars["wpvoltage"] = float(d['W'][0])
-        if 'L' in d:
-            CNC.vars["lasermode"]  = int(d['L'][0])
-            CNC.vars["laserstate"] = int(d['L'][1])
-            CNC.vars["lasertesting"] = int(d['L'][2])
-            CNC.vars["laserpower"] = float(d['L'][3])
-            CNC.vars["laserscale"] = float(d['L'][4])
-        if 'P' in d:
-            CNC.vars["playedlines"] = int(d['P'][0])
-            CNC.vars["playedpercent"] = int(d['P'][1])
-            CNC.vars["playedseconds"] = int(d['P'][2])
-        else:
-            # not playing file
-            CNC.vars["playedlines"] = -1
+        prev = self.status
+        if self.resume_from is not None and prev is None:
+            resumed = self.resume_from
+            self.resume_from = None
+            if not same_session(resumed, StatusReport.parse(line, resumed)):
+                self.session_changed = True
+                self.log.put((self.MSG_NORMAL, 'Machine was restarted, reloading its settings'))
+        if prev is None:
+            # carry the not always reported fields over from vars
+            prev = StatusReport(self.vars)
+            prev.state = ""
+        status = StatusReport.parse(line, prev)
+        changed = status.diff(self.status)
+        status.apply(self.vars, changed)
+        self.status = status
+        self.publish({name: getattr(status, name) for name in changed})
+        self.jogger.status(status)
+        if self.recorder is not None:
+            try:
+                self.recorder.record(status)
+            except:
+                self.recorder = None
+                self.log.put((self.MSG_ERROR, 'Telemetry recorder error: ' + str(sys.exc_info()[1])))
 
-        if 'A' in d:
-            CNC.vars["atc_state"] = int(d['A'][0])
-        else:
-            CNC.vars["atc_state"] = 0
+        with self.status_lock:
+            self.status_changed |= changed
+        self.posUpdate = True
 
-        if 'O' in d:
-            CNC.vars["max_delta"] = float(d['O'][0])
-        else:
-            CNC.vars["max_delta"] = 0.0
+    # ----------------------------------------------------------------------
+    # Replace the snapshot by one with changes, readers keep the one they took
+    # ----------------------------------------------------------------------
+    def publish(self, changes):
+        with self.snapshot_lock:
+            self.snapshot = self.snapshot.replace(changes)
 
-        if 'H' in d:
-            CNC.vars["halt_reason"] = int(d['H'][0])
+    # ----------------------------------------------------------------------
+    def setState(self, state):
+        self.vars["state"] = state
+        self.vars["color"] = STATECOLOR[state]
+        self.publish({"state": state})
 
-        self.posUpdate = True
+    # ----------------------------------------------------------------------
+    # Return the status fields changed since the last call
+    # ----------------------------------------------------------------------
+    def takeStatusChanges(self):
+        with self.status_lock:
+            changed = self.status_changed
+            self.status_changed = set()
+        return changed
 
     def parseBigParentheses(self, line):
         # {S:0,5000|L:0,0|F:1,0|V:0,1|G:0|T:0|E:0,0,0,0,0,0|P:0,0|A:1,0}
@@ -626,43 +771,45 @@ class Controller:
 
         # strip of rest into a dict of name: [values,...,]
         d = {a: [int(y) for y in b.split(',')] for a, b in [x.split(':') for x in l]}
+        diag = {}
         if 'S' in d:
-            CNC.vars["sw_spindle"] = int(d['S'][0])
-            CNC.vars["sl_spindle"] = int(d['S'][1])
+            diag["sw_spindle"] = int(d['S'][0])
+            diag["sl_spindle"] = int(d['S'][1])
         if 'L' in d:
-            CNC.vars["sw_laser"]  = int(d['L'][0])
-            CNC.vars["sl_laser"]  = int(d['L'][1])
+            diag["sw_laser"]  = int(d['L'][0])
+            diag["sl_laser"]  = int(d['L'][1])
         if 'F' in d:
-            CNC.vars["sw_spindlefan"] = int(d['F'][0])
-            CNC.vars["sl_spindlefan"] = int(d['F'][1])
+            diag["sw_spindlefan"] = int(d['F'][0])
+            diag["sl_spindlefan"] = int(d['F'][1])
         if 'V' in d:
-            CNC.vars["sw_vacuum"] = int(d['V'][0])
-            CNC.vars["sl_vacuum"] = int(d['V'][1])
+            diag["sw_vacuum"] = int(d['V'][0])
+            diag["sl_vacuum"] = int(d['V'][1])
         if 'G' in d:
-            CNC.vars["sw_light"] = int(d['G'][0])
+            diag["sw_light"] = int(d['G'][0])
         if 'T' in d:
-            CNC.vars["sw_tool_sensor_pwr"] = int(d['T'][0])
+            diag["sw_tool_sensor_pwr"] = int(d['T'][0])
         if 'R' in d:
-            CNC.vars["sw_air"] = int(d['R'][0])
+            diag["sw_air"] = int(d['R'][0])
         if 'C' in d:
-            CNC.vars["sw_wp_charge_pwr"] = int(d['C'][0])
+            diag["sw_wp_charge_pwr"] = int(d['C'][0])
 
         if 'E' in d:
-            CNC.vars["st_x_min"] = int(d['E'][0])
-            CNC.vars["st_x_max"] = int(d['E'][1])
-            CNC.vars["st_y_min"] = int(d['E'][2])
-            CNC.vars["st_y_max"] = int(d['E'][3])
-            CNC.vars["st_z_max"] = int(d['E'][4])
-            CNC.vars["st_cover"] = int(d['E'][5])
+            diag["st_x_min"] = int(d['E'][0])
+            diag["st_x_max"] = int(d['E'][1])
+            diag["st_y_min"] = int(d['E'][2])
+            diag["st_y_max"] = int(d['E'][3])
+            diag["st_z_max"] = int(d['E'][4])
+            diag["st_cover"] = int(d['E'][5])
         if 'P' in d:
-            CNC.vars["st_probe"] = int(d['P'][0])
-            CNC.vars["st_calibrate"] = int(d['P'][1])
+            diag["st_probe"] = int(d['P'][0])
+            diag["st_calibrate"] = int(d['P'][1])
         if 'A' in d:
-            CNC.vars["st_atc_home"] = int(d['A'][0])
-            CNC.vars["st_tool_sensor"] = int(d['A'][1])
+            diag["st_atc_home"] = int(d['A'][0])
+            diag["st_tool_sensor"] = int(d['A'][1])
         if 'I' in d:
-            CNC.vars["st_e_stop"] = int(d['I'][0])
-
+            diag["st_e_stop"] = int(d['I'][0])
+        self.vars.update(diag)
+        self.publish(diag)
 
         self.diagnoseUpdate = True
 
@@ -681,8 +828,14 @@ class Controller:
             self.stream = self.wifi_stream
 
         if self.stream.open(address):
-            CNC.vars["state"] = CONNECTED
-            CNC.vars["color"] = STATECOLOR[CNC.vars["state"]]
+            self.conn_type = conn_type
+            self.address = address
+            self.status = None
+            self.poller.reset()
+            self.rx_time = time.time()
+            self.resume_from = None
+            self.session_changed = False
+            self.setState(CONNECTED)
             self.log.put((self.MSG_NORMAL, 'Connected to machine!'))
             #self.stream.send(b"\n")
             self._gcount = 0
@@ -707,15 +860,80 @@ class Controller:
         except:
             self.log.put((self.MSG_ERROR, 'Controller stop thread error!'))
         self._runLines = 0
-        time.sleep(0.5)
-        self.thread = None
+        self.jogger.cancel()
+        self.sender.clear()
+        thread, self.thread = self.thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(CLOSE_TIMEOUT)
         try:
-            self.stream.close()
+            # waits for a relink reopening the stream, see relink()
+            with self.link_lock:
+                self.stream.close()
         except:
             self.log.put((self.MSG_ERROR, 'Controller close stream error!'))
         self.stream = None
-        CNC.vars["state"] = NOT_CONNECTED
-        CNC.vars["color"] = STATECOLOR[CNC.vars["state"]]
+        self.setState(NOT_CONNECTED)
+
+    # ----------------------------------------------------------------------
+    # Drop and open again the last connection, used to continue an
+    # interrupted file transfer
+    # ----------------------------------------------------------------------
+    def reopen(self):
+        if self.conn_type is None:
+            return False
+        self.close()
+        time.sleep(1)
+        return bool(self.open(self.conn_type, self.address))
+
+    # ----------------------------------------------------------------------
+    # Link lost (socket or port error, or the machine went silent): open the
+    # same address again with growing delays, from the streamIO thread. The
+    # fast path skips the USB DTR reset, and the first status report decides
+    # whether the machine kept its session (see same_session). Returns False
+    # when given up or closed meanwhile. Reopening holds link_lock, as
+    # close() does, so a close never runs halfway through a reopen and a
+    # stream reopened after stop was set is closed again.
+    # ----------------------------------------------------------------------
+    def relink(self):
+        stream = self.stream
+        if stream is None or self.address is None:
+            return False
+        self.reconnecting = True
+        self.jogger.cancel()
+        self.sender.clear()
+        self.resume_from = self.status or self.resume_from
+        self.setState(CONNECTED)
+        self.log.put((self.MSG_ERROR, 'Connection lost, reconnecting...'))
+        delay = RECONNECT_DELAY
+        deadline = time.time() + RECONNECT_TIMEOUT
+        try:
+            while not self.stop.is_set():
+                try:
+                    with self.link_lock:
+                        if self.stop.is_set():
+                            break
+                        reopened = stream.reopen(self.address)
+                        if reopened and self.stop.is_set():
+                            stream.close()
+                            break
+                    if reopened:
+                        self.status = None
+                        self.poller.reset()
+                        self.rx_time = time.time()
+                        self.log.put((self.MSG_NORMAL, 'Reconnected to machine!'))
+                        return True
+                except:
+                    pass
+                if time.time() + delay > deadline:
+                    break
+                self.stop.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        finally:
+            self.reconnecting = False
+        if not self.stop.is_set():
+            self.log.put((self.MSG_ERROR, 'Reconnect failed, connection lost!'))
+            self.setState(NOT_CONNECTED)
+        return False
 
     # ----------------------------------------------------------------------
     def stopRun(self):
@@ -735,17 +953,17 @@ class Controller:
     # ----------------------------------------------------------------------
     def sendHex(self, hexcode):
         if self.stream is None: return
-        self.stream.send(chr(int(hexcode, 16)))
-        self.stream.flush()
+        self.sender.send(bytes([int(hexcode, 16)]))
 
     def viewStatusReport(self, sio_status):
-        if self.loadNUM == 0 and self.sendNUM == 0:
-            self.stream.send(b"?")
-            self.sio_status = sio_status
+        self.poller.sent(time.time())
+        self.sender.send(b"?")
+        self.sio_status = sio_status
 
     def viewDiagnoseReport(self, sio_diagnose):
-        if self.loadNUM == 0 and self.sendNUM == 0:
-            self.stream.send(b"diagnose\n")
+        if self.loadNUM == 0 and self.sendNUM == 0 and not self.streaming():
+            # a poll like '?': not queued behind rate limited bulk commands
+            self.sender.direct(b"diagnose\n")
             self.sio_diagnose = sio_diagnose
 
     # ----------------------------------------------------------------------
@@ -758,15 +976,17 @@ class Controller:
         self.openClose()
         self.stopProbe()
         self._alarm = False
-        CNC.vars["_OvChanged"] = True  # force a feed change if any
+        self.vars["_OvChanged"] = True  # force a feed change if any
         self.notBusy()
 
     def softReset(self, clearAlarm=True):
         if self.stream:
-            self.stream.send(b"\030")
+            self.jogger.cancel()
+            self.sender.clear()
+            self.sender.send(b"\030")
         self.stopProbe()
         if clearAlarm: self._alarm = False
-        CNC.vars["_OvChanged"] = True  # force a feed change if any
+        self.vars["_OvChanged"] = True  # force a feed change if any
 
     def unlock(self, clearAlarm=True):
         if clearAlarm: self._alarm = False
@@ -785,7 +1005,7 @@ class Controller:
         self.sendGCode("$G")
 
     def viewBuild(self):
-        self.stream.send(b"version\n")
+        self.sender.send(b"version\n")
         self.sendGCode("$I")
 
     def viewStartup(self):
@@ -795,7 +1015,7 @@ class Controller:
         pass
 
     def grblHelp(self):
-        self.stream.send(b"help\n")
+        self.sender.send(b"help\n")
 
     def grblRestoreSettings(self):
         pass
@@ -807,14 +1027,16 @@ class Controller:
         pass
 
     # ----------------------------------------------------------------------
+    # Jogs go through the JogEngine, which coalesces quick repeats
     def jog(self, _dir):
-        self.executeCommand("G91G0{}".format(_dir))
-    
+        self.jogger.step(_dir)
+
     def jog_with_speed(self, _dir, speed):
-        if speed > 0:
-            self.executeCommand(f"G91G0{_dir} F{speed}")
-        else:
-            self.executeCommand(f"G91G0{_dir}")
+        self.jogger.step(_dir, speed)
+
+    def sendJog(self, line):
+        self.poller.jogged()
+        self.executeCommand(line)
 
     # ----------------------------------------------------------------------
 
@@ -854,7 +1076,7 @@ class Controller:
         self.sendGCode(cmd)
 
     def wcsSetM(self, x = None, y = None, z = None, a = None):
-        # p = WCS.index(CNC.vars["WCS"])
+        # p = WCS.index(self.vars["WCS"])
         cmd = "G10L2P0"
 
         pos = ""
@@ -869,15 +1091,14 @@ class Controller:
     def feedHold(self, event=None):
         if event is not None and not self.acceptKey(True): return
         if self.stream is None: return
-        self.stream.send(b"!")
-        self.stream.flush()
+        self.jogger.cancel()
+        self.sender.send(b"!")
         self._pause = True
 
     def resume(self, event=None):
         if event is not None and not self.acceptKey(True): return
         if self.stream is None: return
-        self.stream.send(b"~")
-        self.stream.flush()
+        self.sender.send(b"~")
         self._alarm = False
         self._pause = False
 
@@ -893,6 +1114,7 @@ class Controller:
         if not line:
             return True
         elif line[0] == "<":
+            self.poller.received(time.time())
             self.parseBracketAngle(line)
             self.sio_status = False
         elif line[0] == "{":
@@ -903,6 +1125,9 @@ class Controller:
                 self.sio_diagnose = False
         elif line[0] == "#":
             self.log.put((self.MSG_INTERIOR, line))
+        elif self.streamer is not None and self.streamer.response(line) and line.strip() == 'ok':
+            # acknowledged streamed line, keep the console quiet
+            pass
         elif "error" in line.lower() or "alarm" in line.lower():
             self.log.put((self.MSG_ERROR, line))
         else:
@@ -930,6 +1155,7 @@ class Controller:
         self.pausing = False
 
     def resumeStream(self):
+        self.rx_time = time.time()
         self.paused = False
         self.pausing = False
 
@@ -946,25 +1172,33 @@ class Controller:
 
         while not self.stop.is_set():
             if not self.stream or self.paused:
-                time.sleep(1)
+                self.stop.wait(1)
                 continue
             t = time.time()
             # refresh machine position?
-            running = self.sendNUM > 0 or self.loadNUM > 0 or self.pausing
+            transferring = self.sendNUM > 0 or self.loadNUM > 0
             try:
-                if not running:
-                    if t - tr > STREAM_POLL:
+                if self.pausing:
+                    tr = t
+                    td = t
+                else:
+                    if t - tr > self.poller.interval(self.vars["state"], transferring, t):
                         self.viewStatusReport(True)
                         tr = t
-                    if self.diagnosing and t - td > DIAGNOSE_POLL:
+                    if transferring:
+                        td = t
+                    elif self.diagnosing and t - td > DIAGNOSE_POLL:
                         self.viewDiagnoseReport(True)
                         td = t
-                else:
-                    tr = t
-                    td = t
+                    if t - self.rx_time > LINK_TIMEOUT:
+                        line = b''
+                        if not self.relink():
+                            break
+                        continue
 
                 if self.stream.waiting_for_recv():
                     received = [bytes([b]) for b in self.stream.recv()]
+                    self.rx_time = t
                     for c in received:
                         if c == EOT or c == CAN:
                             # Ctrl + Z means transmission complete, Ctrl + D means transmission cancel or error
@@ -1002,6 +1236,12 @@ class Controller:
                     else:
                         dynamic_delay = 0
 
+            except OSError:
+                # socket closed or serial port gone (SerialException is an OSError)
+                line = b''
+                if not self.relink():
+                    break
+                continue
             except:
                 line = b''
                 if last_error != str(sys.exc_info()[1]) :
@@ -1009,4 +1249,4 @@ class Controller:
                     last_error = str(sys.exc_info()[1])
 
             if dynamic_delay > 0:
-                time.sleep(dynamic_delay)
\ No newline at end of file
+                self.stop.wait(dynamic_delay)
\ No newline at end of file
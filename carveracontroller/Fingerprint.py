@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from .LzCodec import BLOCK_SIZE, CHECKSUM, compress_block, open_output
+
+READ_SIZE = 256 * BLOCK_SIZE    # 1 MB reads, a whole number of .lz blocks
+CAPACITY = 1024                 # files remembered
+
+Fingerprint = namedtuple('Fingerprint', 'md5 size mtime checksum')
+
+
+# ------------------------------------------------------------------------------
+# Fill buffer from f, short only at the end of the file (block boundaries
+# must not depend on how the file system splits reads)
+# ------------------------------------------------------------------------------
+def read_full(f, view):
+    n = 0
+    while n < len(view):
+        got = f.readinto(view[n:])
+        if not got:
+            break
+        n += got
+    return n
+
+
+# ==============================================================================
+# md5 and .lz checksum of local files, cached by (path, size, mtime) so a
+# file is only read again after it changed. scan() does everything an
+# upload needs in a single read: hash, byte sum and the compressed .lz file.
+# ==============================================================================
+class FingerprintService:
+
+    def __init__(self, path=None, capacity=CAPACITY):
+        self.path = path        # json file the cache is kept in, None for memory only
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.load()
+
+    # ----------------------------------------------------------------------
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                for filename, size, mtime, md5, checksum in json.load(f):
+                    self.entries[filename] = Fingerprint(md5, size, mtime, checksum)
+        except (OSError, ValueError, TypeError):
+            self.entries.clear()
+
+    # ----------------------------------------------------------------------
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump([[filename, fp.size, fp.mtime, fp.md5, fp.checksum]
+                           for filename, fp in self.entries.items()], f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    # ----------------------------------------------------------------------
+    def lookup(self, filename):
+        """Cached fingerprint of filename, None when unknown or changed"""
+        filename = os.path.abspath(filename)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        with self.lock:
+            fp = self.entries.get(filename)
+            if fp is None or fp.size != st.st_size or fp.mtime != st.st_mtime_ns:
+                return None
+            self.entries.move_to_end(filename)
+            return fp
+
+    # ----------------------------------------------------------------------
+    def md5(self, filename):
+        fp = self.lookup(filename) or self.scan(filename)
+        return fp.md5
+
+    # ----------------------------------------------------------------------
+    def scan(self, filename, compress_to=None, block_size=BLOCK_SIZE):
+        """Read filename once, returning its Fingerprint. With compress_to the
+        .lz encoding is written there as well"""
+        filename = os.path.abspath(filename)
+        read_size = max(READ_SIZE // block_size, 1) * block_size
+        hash_md5 = hashlib.md5()
+        total = 0
+        f_lz = None
+        try:
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if compress_to:
+                    f_lz = open_output(compress_to)
+                view = memoryview(bytearray(read_size))
+                while True:
+                    n = read_full(f, view)
+                    if not n:
+                        break
+                    data = view[:n]
+                    hash_md5.update(data)
+                    total += sum(data)
+                    if f_lz:
+                        f_lz.write(b''.join(compress_block(bytes(data[i:i + block_size]))
+                                            for i in range(0, n, block_size)))
+                if f_lz:
+                    f_lz.write(CHECKSUM.pack(total & 0xffff))
+        finally:
+            if f_lz:
+                f_lz.close()
+        fp = Fingerprint(hash_md5.hexdigest(), st.st_size, st.st_mtime_ns, total & 0xffff)
+        with self.lock:
+            self.entries[filename] = fp
+            self.entries.move_to_end(filename)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            self.save()
+        return fp
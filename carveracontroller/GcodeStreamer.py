@@ -0,0 +1,218 @@
+import re
+import time
+import threading
+from collections import deque
+
+RX_BUFFER_SIZE = 128
+RESPONSE_TIMEOUT = 30.0  # s without any ok while lines are in flight
+
+COMMENTPAT = re.compile(r"\(.*?\)|;.*")
+
+
+# ------------------------------------------------------------------------------
+# Strip comments and blanks, returns '' for lines that need not be sent
+# ------------------------------------------------------------------------------
+def clean_line(line):
+    if isinstance(line, bytes):
+        line = line.decode(errors='ignore')
+    line = COMMENTPAT.sub('', line).strip()
+    if line.startswith('%'):
+        return ''
+    return line
+
+
+# ==============================================================================
+# Stream G-code lines straight to the controller, keeping the bytes in
+# flight within the controller's receive buffer (character counting):
+# every sent line is remembered and its length released again when the
+# controller acknowledges it with ok or error.
+#
+# The sender only needs a write(bytes) callable; responses are pushed in
+# with response(line) from whatever thread reads the link, so it can be
+# driven by the real Controller or by a simulated one.
+# ==============================================================================
+class GcodeStreamer:
+    IDLE = 'Idle'
+    RUNNING = 'Running'
+    PAUSED = 'Paused'
+    DONE = 'Done'
+    ABORTED = 'Aborted'
+    FAILED = 'Failed'
+
+    def __init__(self, write, rx_buffer_size=RX_BUFFER_SIZE, stop_on_error=True,
+                 response_timeout=RESPONSE_TIMEOUT, callback=None):
+        self.write = write
+        self.rx_buffer_size = rx_buffer_size
+        self.stop_on_error = stop_on_error
+        self.response_timeout = response_timeout
+        self.callback = callback  # callback(streamer) after every acknowledged line
+
+        self.cond = threading.Condition()
+        self.inflight = deque()  # (line_no, length, send_time)
+        self.inflight_bytes = 0
+        self.state = self.IDLE
+        self.error = None
+        self.thread = None
+
+        # metrics
+        self.start_time = 0.0
+        self.end_time = 0.0
+        self.lines_sent = 0
+        self.lines_acked = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.max_inflight = 0
+        self.ack_latency = 0.0  # sum of send -> ok times
+        self.last_line_no = 0
+
+    # ----------------------------------------------------------------------
+    def start(self, source):
+        """Start streaming from an iterable of lines, a generator or a file name"""
+        if self.thread is not None and self.thread.is_alive():
+            return False
+        self.state = self.RUNNING
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(source,), daemon=True)
+        self.thread.start()
+        return True
+
+    # ----------------------------------------------------------------------
+    def run(self, source):
+        f = None
+        self.start_time = time.time()
+        try:
+            if isinstance(source, str):
+                f = open(source, 'r', encoding='utf-8', errors='ignore')
+                source = f
+            for line_no, raw in enumerate(source, start=1):
+                line = clean_line(raw)
+                if not line:
+                    continue
+                data = (line + '\n').encode()
+                if not self._wait_room(len(data)):
+                    break
+                with self.cond:
+                    self.inflight.append((line_no, len(data), time.time()))
+                    self.inflight_bytes += len(data)
+                    self.max_inflight = max(self.max_inflight, self.inflight_bytes)
+                    self.lines_sent += 1
+                    self.bytes_sent += len(data)
+                    self.last_line_no = line_no
+                self.write(data)
+            self._wait_drained()
+        except Exception as e:
+            with self.cond:
+                self.error = str(e)
+                self.state = self.FAILED
+        finally:
+            if f is not None:
+                f.close()
+            self.end_time = time.time()
+            with self.cond:
+                if self.state in (self.RUNNING, self.PAUSED):
+                    self.state = self.DONE
+                self.cond.notify_all()
+
+    # ----------------------------------------------------------------------
+    def _wait_room(self, length):
+        # a line longer than the buffer is sent once everything else is acknowledged
+        need = min(length, self.rx_buffer_size)
+        with self.cond:
+            while True:
+                if self.state not in (self.RUNNING, self.PAUSED):
+                    return False
+                if self.state == self.RUNNING and self.inflight_bytes + need <= self.rx_buffer_size:
+                    return True
+                self._wait()
+
+    # ----------------------------------------------------------------------
+    def _wait_drained(self):
+        with self.cond:
+            while self.inflight and self.state in (self.RUNNING, self.PAUSED):
+                self._wait()
+
+    # ----------------------------------------------------------------------
+    def _wait(self):
+        # called with cond held
+        if not self.cond.wait(self.response_timeout) and self.inflight and self.state == self.RUNNING:
+            self.error = 'No response for line %d' % self.inflight[0][0]
+            self.state = self.FAILED
+
+    # ----------------------------------------------------------------------
+    def response(self, line):
+        """Feed a line read from the controller, returns True if it was an acknowledgement"""
+        lower = line.strip().lower()
+        is_ok = lower == 'ok' or lower.startswith('ok ')
+        is_error = lower.startswith('error')
+        if not is_ok and not is_error:
+            return False
+        with self.cond:
+            if not self.inflight:
+                return False
+            line_no, length, sent = self.inflight.popleft()
+            self.inflight_bytes -= length
+            self.lines_acked += 1
+            self.ack_latency += time.time() - sent
+            if is_error:
+                self.errors += 1
+                if self.stop_on_error and self.state in (self.RUNNING, self.PAUSED):
+                    self.error = 'Line %d: %s' % (line_no, line.strip())
+                    self.state = self.FAILED
+            self.cond.notify_all()
+        if self.callback:
+            self.callback(self)
+        return True
+
+    # ----------------------------------------------------------------------
+    def pause(self):
+        """Stop feeding new lines, lines already in the buffer keep running"""
+        with self.cond:
+            if self.state == self.RUNNING:
+                self.state = self.PAUSED
+                self.cond.notify_all()
+
+    # ----------------------------------------------------------------------
+    def resume(self):
+        with self.cond:
+            if self.state == self.PAUSED:
+                self.state = self.RUNNING
+                self.cond.notify_all()
+
+    # ----------------------------------------------------------------------
+    def abort(self):
+        """Stop feeding and forget what is in flight; the caller is expected
+        to stop the machine itself (feed hold / reset)"""
+        with self.cond:
+            if self.state in (self.RUNNING, self.PAUSED, self.IDLE):
+                self.state = self.ABORTED
+            self.inflight.clear()
+            self.inflight_bytes = 0
+            self.cond.notify_all()
+
+    # ----------------------------------------------------------------------
+    def is_active(self):
+        return self.state in (self.RUNNING, self.PAUSED)
+
+    # ----------------------------------------------------------------------
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    # ----------------------------------------------------------------------
+    def metrics(self):
+        end = self.end_time if self.end_time >= self.start_time and not self.is_active() else time.time()
+        elapsed = max(end - self.start_time, 1e-6)
+        return {
+            'state': self.state,
+            'elapsed': elapsed,
+            'lines_sent': self.lines_sent,
+            'lines_acked': self.lines_acked,
+            'bytes_sent': self.bytes_sent,
+            'errors': self.errors,
+            'lines_per_second': self.lines_acked / elapsed,
+            'bytes_per_second': self.bytes_sent / elapsed,
+            'max_inflight': self.max_inflight,
+            'avg_ack_latency': self.ack_latency / self.lines_acked if self.lines_acked else 0.0,
+            'last_line': self.last_line_no,
+            'error': self.error,
+        }
@@ -0,0 +1,217 @@
+import re
+import time
+import threading
+
+from .SendScheduler import LatencyHistogram
+
+COALESCE_WINDOW = 0.08  # s, steps requested within it go out as one move
+HOLD_DELAY = 0.4  # s a key is held before the jog turns continuous
+SEGMENT_TIME = 0.1  # s of motion per continuous jog segment
+LOOKAHEAD = 3  # continuous segments queued ahead of the machine
+RAPID_FEED = 3000  # mm/min assumed for G0 until a jog speed was sent
+HOLD_TIMEOUT = 1.0  # s without a key repeat before a continuous jog stops by itself
+MOVED = 0.0005  # mm, position change that counts as motion
+MOTION_TIMEOUT = 5.0  # s, a press that moved nothing by then is not counted
+
+MOVEPAT = re.compile(r"([XYZA])\s*([-+]?\d*\.?\d+)", re.IGNORECASE)
+AXES = "XYZA"
+
+
+# ------------------------------------------------------------------------------
+# 'X-1' or 'X1Y2' into {'X': -1.0, 'Y': 2.0}
+# ------------------------------------------------------------------------------
+def parse_moves(text):
+    moves = {}
+    for axis, value in MOVEPAT.findall(text):
+        axis = axis.upper()
+        moves[axis] = moves.get(axis, 0.0) + float(value)
+    return moves
+
+
+def jog_line(moves, speed):
+    line = "G91G0" + "".join("%s%s" % (axis, round(moves[axis], 4)) for axis in AXES if moves.get(axis))
+    if speed > 0:
+        line += " F%g" % speed
+    return line
+
+
+# ==============================================================================
+# Jog engine between the jog buttons/keys and the controller.
+#
+# Steps: the first one goes out at once, steps requested within the next
+# COALESCE_WINDOW are summed into one relative move, so key repeat or fast
+# clicking no longer floods the planner with tiny moves.
+#
+# Continuous: press() followed by a hold of HOLD_DELAY streams short moves
+# of SEGMENT_TIME worth of travel, keeping at most LOOKAHEAD of them ahead
+# of the reported position; release() stops the stream, so the machine
+# stops within the lookahead instead of working off every queued key
+# repeat. The key repeats keep the hold alive through repeat(); when they
+# stop for HOLD_TIMEOUT (a missed key up) the stream stops as well.
+#
+# The delay from a press to the first status report showing motion is kept
+# in a LatencyHistogram.
+# ==============================================================================
+class JogEngine:
+
+    def __init__(self, send):
+        self.send = send  # send(line) for a G-code line
+        self.cond = threading.Condition()
+        self.pending = {}  # coalesced step not sent yet
+        self.pending_speed = 0
+        self.sent_time = 0.0  # last step sent
+        self.held = None  # (axis, sign, speed, since) of the pressed key
+        self.alive_time = 0.0  # last press or key repeat of the held key
+        self.feed = RAPID_FEED  # last F sent, the G0 rate of the machine
+        self.hold_start = None  # (time, position) when the jog turned continuous
+        self.hold_sent = 0.0  # continuous travel sent so far
+        self.pressed = None  # time of the press waiting for motion
+        self.press_pos = None
+        self.position = None  # last reported machine position
+        self.histogram = LatencyHistogram()
+        self.thread = None
+
+    # ----------------------------------------------------------------------
+    def step(self, moves, speed=0):
+        """Relative move, 'X-1' style, coalesced with steps just before"""
+        moves = parse_moves(moves) if isinstance(moves, str) else moves
+        if not moves:
+            return
+        with self.cond:
+            now = time.time()
+            self.mark(now)
+            if self.pending and speed != self.pending_speed:
+                self.flush(now)
+            for axis, value in moves.items():
+                self.pending[axis] = self.pending.get(axis, 0.0) + value
+            self.pending_speed = speed
+            if now - self.sent_time >= COALESCE_WINDOW:
+                self.flush(now)
+            else:
+                self.wake()
+
+    # ----------------------------------------------------------------------
+    def press(self, moves, speed=0):
+        """Key went down: one step, continuous jog if held past HOLD_DELAY"""
+        moves = parse_moves(moves) if isinstance(moves, str) else moves
+        self.step(moves, speed)
+        if len(moves) != 1:
+            return
+        axis, value = next(iter(moves.items()))
+        with self.cond:
+            self.held = (axis, 1 if value > 0 else -1, speed, time.time())
+            self.alive_time = self.held[3]
+            self.wake()
+
+    # ----------------------------------------------------------------------
+    def repeat(self):
+        """Key repeat of the held key: it is still down"""
+        with self.cond:
+            self.alive_time = time.time()
+
+    # ----------------------------------------------------------------------
+    def release(self):
+        """Key went up: stop feeding continuous segments"""
+        with self.cond:
+            self.held = None
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """Forget unsent steps and any held key, e.g. on e-stop or disconnect"""
+        with self.cond:
+            self.pending.clear()
+            self.held = None
+            self.pressed = None
+
+    # ----------------------------------------------------------------------
+    # Feed from the status reports, for the press to motion delay
+    # ----------------------------------------------------------------------
+    def status(self, status):
+        position = (status.mx, status.my, status.mz, status.ma)
+        with self.cond:
+            self.position = position
+            if self.pressed is None:
+                return
+            if time.time() - self.pressed > MOTION_TIMEOUT:
+                self.pressed = None
+            elif self.press_pos is None:
+                self.press_pos = position
+            elif max(abs(a - b) for a, b in zip(position, self.press_pos)) > MOVED:
+                self.histogram.add(time.time() - self.pressed)
+                self.pressed = None
+
+    # ----------------------------------------------------------------------
+    def mark(self, now):
+        if self.pressed is None:
+            self.pressed = now
+            self.press_pos = self.position
+
+    # ----------------------------------------------------------------------
+    def flush(self, now):
+        moves = self.pending
+        self.pending = {}
+        if any(moves.values()):
+            self.sent_time = now
+            self.jog(moves, self.pending_speed)
+
+    # ----------------------------------------------------------------------
+    def jog(self, moves, speed):
+        if speed > 0:
+            self.feed = speed
+        self.send(jog_line(moves, speed))
+
+    # ----------------------------------------------------------------------
+    # Continuous travel sent but not done yet: at most what the feed allows
+    # in the elapsed time, less when the reported position lags behind
+    # ----------------------------------------------------------------------
+    def ahead(self, axis, feed, now):
+        start_time, start_pos = self.hold_start
+        done = (now - start_time) * feed / 60.0
+        if start_pos is not None and self.position is not None:
+            i = AXES.index(axis)
+            done = min(done, abs(self.position[i] - start_pos[i]))
+        return self.hold_sent - done
+
+    # ----------------------------------------------------------------------
+    def wake(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.cond.notify()
+
+    # ----------------------------------------------------------------------
+    def run(self):
+        with self.cond:
+            while True:
+                now = time.time()
+                wait = None
+                if self.pending:
+                    due = self.sent_time + COALESCE_WINDOW
+                    if now >= due:
+                        self.flush(now)
+                    else:
+                        wait = due - now
+                if self.held is not None and now - self.alive_time > HOLD_TIMEOUT:
+                    self.held = None
+                if self.held is None:
+                    self.hold_start = None
+                else:
+                    axis, sign, speed, since = self.held
+                    start = since + HOLD_DELAY
+                    if now < start:
+                        self.hold_start = None
+                        wait = min(wait or start - now, start - now)
+                    else:
+                        if self.hold_start is None:
+                            self.hold_start = (now, self.position)
+                            self.hold_sent = 0.0
+                        feed = speed if speed > 0 else self.feed
+                        length = feed / 60.0 * SEGMENT_TIME
+                        while self.ahead(axis, feed, now) + length <= LOOKAHEAD * length:
+                            self.hold_sent += length
+                            self.jog({axis: sign * length}, speed)
+                        wait = min(wait or SEGMENT_TIME, SEGMENT_TIME)
+                if self.held is not None:
+                    left = self.alive_time + HOLD_TIMEOUT - now
+                    wait = min(wait or left, left)
+                self.cond.wait(wait)
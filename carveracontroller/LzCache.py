@@ -0,0 +1,109 @@
+import os
+import threading
+
+LZ_CACHE_BYTES = 1024 * 1024 * 1024    # 1 GB of compressed files
+LZ_SUFFIX = '.lz'
+
+
+# ------------------------------------------------------------------------------
+# Hard link src to dst, copy when the file system can not link
+# ------------------------------------------------------------------------------
+def link_or_copy(src, dst):
+    tmp = dst + '.part'
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+    try:
+        os.link(src, tmp)
+    except (OSError, AttributeError):
+        with open(src, 'rb') as f_in, open(tmp, 'wb') as f_out:
+            while True:
+                data = f_in.read(1 << 20)
+                if not data:
+                    break
+                f_out.write(data)
+    os.replace(tmp, dst)
+
+
+# ==============================================================================
+# Content addressed cache of compressed upload files, keyed by the md5 of
+# the source and the block size. Entries are evicted least recently used
+# first once the cache grows beyond max_bytes; a hit refreshes the entry's
+# modification time, which is what the eviction order goes by.
+# ==============================================================================
+class LzCache:
+
+    def __init__(self, directory, max_bytes=LZ_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # ----------------------------------------------------------------------
+    def path(self, md5, block_size):
+        return os.path.join(self.directory, '%s-%d%s' % (md5, block_size, LZ_SUFFIX))
+
+    # ----------------------------------------------------------------------
+    def contains(self, md5, block_size):
+        return bool(md5) and os.path.exists(self.path(md5, block_size))
+
+    # ----------------------------------------------------------------------
+    def fetch(self, md5, block_size, target):
+        """Place the cached file for md5 at target, returns False on a miss"""
+        if not md5:
+            return False
+        path = self.path(md5, block_size)
+        with self.lock:
+            try:
+                os.utime(path)
+                link_or_copy(path, target)
+            except OSError:
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    # ----------------------------------------------------------------------
+    def store(self, md5, block_size, filename):
+        """Add a finished compressed file to the cache"""
+        if not md5:
+            return False
+        with self.lock:
+            try:
+                link_or_copy(filename, self.path(md5, block_size))
+            except OSError:
+                return False
+            self._trim()
+        return True
+
+    # ----------------------------------------------------------------------
+    def _trim(self):
+        entries = []
+        total = 0
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(LZ_SUFFIX):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        except OSError:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        with self.lock:
+            max_bytes, self.max_bytes = self.max_bytes, -1
+            self._trim()
+            self.max_bytes = max_bytes
@@ -0,0 +1,314 @@
+import os
+import mmap
+import time
+import queue
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import quicklz
+
+# .lz upload format: independent quicklz blocks of BLOCK_SIZE input bytes,
+# each prefixed with its compressed length (big endian), followed by the
+# 16 bit sum of all input bytes
+BLOCK_SIZE = 4096
+BLOCK_HEADER_SIZE = 4
+QUEUE_BYTES = 4 * 1024 * 1024   # compressed data buffered ahead of the sender
+BATCH_BLOCKS = 256              # blocks per pool task (1 MB of input)
+
+BLOCK_HEADER = struct.Struct('>I')
+CHECKSUM = struct.Struct('>H')
+
+
+# ------------------------------------------------------------------------------
+# Open an output file on a new inode, so a hard linked copy of an older
+# output (see LzCache) is left alone
+# ------------------------------------------------------------------------------
+def open_output(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+    return open(filename, 'wb')
+
+
+# ------------------------------------------------------------------------------
+# Compress one block, returns header + compressed data
+# ------------------------------------------------------------------------------
+def compress_block(block):
+    compressed = quicklz.compress(block)
+    return BLOCK_HEADER.pack(len(compressed)) + compressed
+
+
+# ==============================================================================
+# Read-only file object returning the .lz encoding of a file while it is
+# being compressed. A worker thread compresses block by block, writes every
+# block to the output file and hands it over through a bounded queue, so the
+# transfer can start with the first block instead of after the last one.
+# close() detaches the reader: the worker stops queueing but still finishes
+# the output file (a retry or the cache reads it); cancel() stops it.
+# ==============================================================================
+class CompressingReader:
+
+    def __init__(self, input_filename, output_filename, block_size=BLOCK_SIZE, queue_bytes=QUEUE_BYTES):
+        self.input_filename = input_filename
+        self.output_filename = output_filename
+        self.block_size = block_size
+        self.input_size = os.path.getsize(input_filename)
+        self.queue = queue.Queue(max(queue_bytes // block_size, 1))
+        self.buffer = memoryview(b'')
+        self.eof = False
+        self.closed = False
+        self.canceled = False
+        self.error = None
+        self.done = threading.Event()
+
+        # updated by the worker
+        self.blocks = 0
+        self.read_in = 0
+        self.written = 0
+        self.checksum = 0
+        self.busy = 0.0     # s spent compressing, waits for the reader excluded
+
+        self.thread = threading.Thread(target=self._compress, daemon=True)
+        self.thread.start()
+
+    # ----------------------------------------------------------------------
+    def _compress(self):
+        try:
+            total = 0
+            with open(self.input_filename, 'rb') as f_in, open_output(self.output_filename) as f_out:
+                while True:
+                    if self.canceled:
+                        raise OSError('canceled')
+                    block = f_in.read(self.block_size)
+                    if not block:
+                        break
+                    t = time.perf_counter()
+                    total += sum(block)
+                    data = compress_block(block)
+                    self.busy += time.perf_counter() - t
+                    f_out.write(data)
+                    self.blocks += 1
+                    self.read_in += len(block)
+                    self.written += len(data)
+                    self._put(data)
+                data = CHECKSUM.pack(total & 0xffff)
+                f_out.write(data)
+                self.checksum = total & 0xffff
+                self.written += len(data)
+                self._put(data)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+            self._put(None)
+
+    # ----------------------------------------------------------------------
+    def _put(self, data):
+        # a closed reader is not drained any more, do not block on it, the
+        # output file is written all the same
+        while not self.closed:
+            try:
+                self.queue.put(data, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    # ----------------------------------------------------------------------
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        n = 0
+        while n < len(view):
+            if not self.buffer:
+                if self.eof:
+                    break
+                data = self.queue.get()
+                if data is None:
+                    self.eof = True
+                    if self.error is not None:
+                        raise OSError('Compression failed: %s' % self.error)
+                    break
+                self.buffer = memoryview(data)
+            part = min(len(self.buffer), len(view) - n)
+            view[n:n + part] = self.buffer[:part]
+            self.buffer = self.buffer[part:]
+            n += part
+        return n
+
+    # ----------------------------------------------------------------------
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            chunk = self.read(1 << 20)
+            while chunk:
+                chunks.append(chunk)
+                chunk = self.read(1 << 20)
+            return b''.join(chunks)
+        b = bytearray(size)
+        return bytes(b[:self.readinto(b)])
+
+    # ----------------------------------------------------------------------
+    def size_hint(self):
+        """Size of the .lz file, estimated from the ratio so far until done"""
+        if self.done.is_set() or not self.read_in:
+            return self.written if self.done.is_set() else self.input_size
+        return int(self.written * self.input_size / self.read_in) + CHECKSUM.size
+
+    # ----------------------------------------------------------------------
+    def wait(self, timeout=None):
+        """Wait until the output file is complete, returns it or None on error"""
+        self.done.wait(timeout)
+        if not self.done.is_set() or self.error is not None:
+            return None
+        return self.output_filename
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        """Stop reading, the worker goes on writing the output file"""
+        self.closed = True
+        # unblock the worker if it waits for room
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """Stop reading and compressing, the output file is incomplete"""
+        self.canceled = True
+        self.close()
+
+
+# ------------------------------------------------------------------------------
+# Pool workers. Input files are memory mapped; thread workers share the
+# caller's map, process workers map the file once in their initializer.
+# ------------------------------------------------------------------------------
+_worker_map = None
+
+
+def _init_worker(path):
+    global _worker_map
+    with open(path, 'rb') as f:
+        _worker_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _compress_span(start, end, block_size, data=None):
+    data = _worker_map if data is None else data
+    out = []
+    total = 0
+    for offset in range(start, end, block_size):
+        block = data[offset:min(offset + block_size, end)]
+        total += sum(block)
+        out.append(compress_block(block))
+    return b''.join(out), total
+
+
+def _decompress_span(spans, data=None):
+    data = _worker_map if data is None else data
+    out = []
+    total = 0
+    for offset, size in spans:
+        block = quicklz.decompress(data[offset:offset + size])
+        total += sum(block)
+        out.append(block)
+    return b''.join(out), total
+
+
+def _map_ordered(executor, fn, tasks, depth):
+    # like executor.map, but with at most depth tasks in flight
+    pending = deque()
+    for args in tasks:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _executor(path, workers, processes):
+    workers = workers or os.cpu_count() or 1
+    if processes:
+        return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(path,)), workers
+    return ThreadPoolExecutor(workers), workers
+
+
+# ------------------------------------------------------------------------------
+# Compress a file to .lz on a pool of workers, the output is identical to
+# the sequential encoder. Returns the number of blocks.
+# ------------------------------------------------------------------------------
+def compress_file(input_filename, output_filename, workers=None, processes=False,
+                  block_size=BLOCK_SIZE, batch_blocks=BATCH_BLOCKS):
+    size = os.path.getsize(input_filename)
+    span = block_size * batch_blocks
+    total = 0
+    with open(input_filename, 'rb') as f_in, open_output(output_filename) as f_out:
+        if size:
+            data = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+            executor, workers = _executor(input_filename, workers, processes)
+            try:
+                shared = () if processes else (data,)
+                tasks = ((start, min(start + span, size), block_size) + shared for start in range(0, size, span))
+                for chunk, chunk_sum in _map_ordered(executor, _compress_span, tasks, workers * 2):
+                    f_out.write(chunk)
+                    total += chunk_sum
+            finally:
+                executor.shutdown()
+                data.close()
+        f_out.write(CHECKSUM.pack(total & 0xffff))
+    return (size + block_size - 1) // block_size
+
+
+# ------------------------------------------------------------------------------
+# Decompress a .lz file on a pool of workers, raises ValueError when the
+# file is truncated or the checksum does not match. Returns the output size.
+# ------------------------------------------------------------------------------
+def decompress_file(input_filename, output_filename, workers=None, processes=False,
+                    batch_blocks=BATCH_BLOCKS):
+    size = os.path.getsize(input_filename)
+    if size < CHECKSUM.size:
+        raise ValueError('%s is not an .lz file' % input_filename)
+    total = 0
+    written = 0
+    with open(input_filename, 'rb') as f_in, open(output_filename, 'wb') as f_out:
+        data = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # block boundaries are only known from the headers, walk them first
+            end = size - CHECKSUM.size
+            batches = []
+            batch = []
+            offset = 0
+            while offset < end:
+                if offset + BLOCK_HEADER_SIZE > end:
+                    raise ValueError('truncated block header at %d' % offset)
+                length = BLOCK_HEADER.unpack_from(data, offset)[0]
+                offset += BLOCK_HEADER_SIZE
+                if offset + length > end:
+                    raise ValueError('truncated block at %d' % offset)
+                batch.append((offset, length))
+                offset += length
+                if len(batch) >= batch_blocks:
+                    batches.append(batch)
+                    batch = []
+            if batch:
+                batches.append(batch)
+            checksum = CHECKSUM.unpack_from(data, end)[0]
+
+            if batches:
+                executor, workers = _executor(input_filename, workers, processes)
+                try:
+                    shared = () if processes else (data,)
+                    tasks = ((spans,) + shared for spans in batches)
+                    for chunk, chunk_sum in _map_ordered(executor, _decompress_span, tasks, workers * 2):
+                        f_out.write(chunk)
+                        written += len(chunk)
+                        total += chunk_sum
+                finally:
+                    executor.shutdown()
+        finally:
+            data.close()
+    if total & 0xffff != checksum:
+        raise ValueError('sum checksum mismatch')
+    return written
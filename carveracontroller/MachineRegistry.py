@@ -0,0 +1,65 @@
+import os
+import json
+import time
+import threading
+
+FORGET_AFTER = 90 * 24 * 3600   # s, machines not seen for this long are dropped
+
+
+# ==============================================================================
+# Machines seen on the network before, by name, so the connect list can be
+# shown at once and confirmed while discovery runs. Kept in a json file.
+# ==============================================================================
+class MachineRegistry:
+
+    def __init__(self, path=None):
+        self.path = path        # json file the registry is kept in, None for memory only
+        self.lock = threading.Lock()
+        self.machines = {}      # name -> {'ip', 'port', 'last_seen'}
+        self.load()
+
+    # ----------------------------------------------------------------------
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.machines = json.load(f)
+        except (OSError, ValueError):
+            self.machines = {}
+        now = time.time()
+        for name in [name for name, machine in self.machines.items()
+                     if now - machine.get('last_seen', 0) > FORGET_AFTER]:
+            del self.machines[name]
+
+    # ----------------------------------------------------------------------
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.machines, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    # ----------------------------------------------------------------------
+    def seen(self, name, ip, port):
+        with self.lock:
+            self.machines[name] = {'ip': ip, 'port': port, 'last_seen': time.time()}
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def forget(self, name):
+        with self.lock:
+            if self.machines.pop(name, None) is not None:
+                self.save()
+
+    # ----------------------------------------------------------------------
+    def known(self):
+        """Known machines, most recently seen first, in MachineDetector's list format"""
+        with self.lock:
+            items = sorted(self.machines.items(), key=lambda item: -item[1].get('last_seen', 0))
+            return [{'machine': name, 'ip': machine['ip'], 'port': machine['port'], 'busy': False,
+                     'seen': False} for name, machine in items]
@@ -0,0 +1,178 @@
+import os
+import sys
+import copy
+import shutil
+import tempfile
+from queue import Empty
+
+from .CNC import CNC
+from .Controller import Controller, CONN_WIFI, SEND_FILE, NOT_CONNECTED
+from . import Utils
+from .TransferJournal import TransferJournal
+from .TransferQueue import TransferQueue, UPLOAD
+
+
+# ==============================================================================
+# One machine: its own CNC state, Controller, stream, last status report and
+# transfer queue. The Kivy app drives a single machine through CNC.vars;
+# sessions keep their state apart, so one process (e.g. a headless service)
+# can watch and feed several machines at once.
+# ==============================================================================
+class MachineSession:
+
+    def __init__(self, name, address, conn_type=CONN_WIFI, queue_path=None, callback=None):
+        self.name = name
+        self.address = address
+        self.conn_type = conn_type
+        self.cnc = CNC(copy.deepcopy(CNC.vars))
+        self.vars = self.cnc.vars
+        self.controller = Controller(self.cnc, callback)
+        self.transfer_queue = TransferQueue(queue_path, run=self.run_transfer, ready=self.ready,
+                                            cancel=self.cancel_transfer)
+        self.transfer_job = None
+        self.temp_dir = None  # this session's .lz files and their journals
+
+    # ----------------------------------------------------------------------
+    def open(self):
+        if not self.controller.open(self.conn_type, self.address):
+            return False
+        self.transfer_queue.start()
+        return True
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        self.transfer_queue.stop()
+        self.controller.close()
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
+    # ----------------------------------------------------------------------
+    @property
+    def connected(self):
+        # the controller gives up on its own after failed reconnects
+        return self.controller.stream is not None and self.state != NOT_CONNECTED
+
+    # ----------------------------------------------------------------------
+    @property
+    def state(self):
+        return self.vars.get('state', '')
+
+    # ----------------------------------------------------------------------
+    def status(self):
+        """Last StatusReport of this machine, None before the first one"""
+        return self.controller.status
+
+    # ----------------------------------------------------------------------
+    def snapshot(self):
+        """Latest MachineSnapshot, one consistent report to read without locks"""
+        return self.controller.snapshot
+
+    # ----------------------------------------------------------------------
+    def changes(self):
+        """Status fields changed since the last call"""
+        return self.controller.takeStatusChanges()
+
+    # ----------------------------------------------------------------------
+    def messages(self):
+        """Drain the controller log, a list of (Controller.MSG_*, text)"""
+        messages = []
+        while True:
+            try:
+                messages.append(self.controller.log.get_nowait())
+            except Empty:
+                return messages
+
+    # ----------------------------------------------------------------------
+    def send(self, line):
+        self.controller.executeCommand(line)
+
+    # ----------------------------------------------------------------------
+    # Transfers, worked off by the session's TransferQueue
+    # ----------------------------------------------------------------------
+    def ready(self, job):
+        return self.connected and self.state == 'Idle' and self.transfer_job is None \
+            and self.controller.loadNUM == 0 and self.controller.sendNUM == 0
+
+    # ----------------------------------------------------------------------
+    def run_transfer(self, job):
+        self.transfer_job = job
+        self.controller.sendNUM = SEND_FILE
+        try:
+            if job['kind'] == UPLOAD:
+                return self.upload(job['local'], job['remote'])
+            return self.download(job['remote'], job['local'])
+        finally:
+            self.controller.sendNUM = 0
+            self.transfer_job = None
+
+    # ----------------------------------------------------------------------
+    def cancel_transfer(self):
+        if self.controller.stream is not None:
+            self.controller.stream.cancel_process()
+
+    # ----------------------------------------------------------------------
+    def upload(self, local, remote, lz=False):
+        """Send local to remote, True when done, None if canceled. With lz the
+        file goes as remote + '.lz' and the machine unpacks it"""
+        md5 = Utils.md5(local)
+        filename = local
+        if lz:
+            from . import LzCodec
+            # per session: several sessions may push the same file at once
+            if self.temp_dir is None:
+                self.temp_dir = tempfile.mkdtemp(prefix='carvera-session-')
+            filename = os.path.join(self.temp_dir, os.path.basename(local) + '.lz')
+            LzCodec.compress_file(local, filename)
+            remote += '.lz'
+        journal = TransferJournal(filename)
+        size = os.path.getsize(filename)
+
+        def callback(packet_size, total_packets, success_count, error_count):
+            self.transfer_queue.progress(min(total_packets * packet_size, size))
+
+        result = False
+        self.controller.pauseStream(1)
+        try:
+            self.controller.uploadCommand(os.path.normpath(remote))
+            result = self.controller.stream.upload(filename, md5, callback, journal)
+        except:
+            print(sys.exc_info()[1])
+        finally:
+            self.controller.resumeStream()
+        if result:
+            journal.finish()
+            if lz:
+                os.remove(filename)
+        return result
+
+    # ----------------------------------------------------------------------
+    def download(self, remote, local):
+        """Fetch remote into local, True when done, None if canceled"""
+        md5 = Utils.md5(local) if os.path.exists(local) else ''
+        tmp = local + '.tmp'
+        journal = TransferJournal(tmp)
+
+        def callback(packet_size, success_count, error_count):
+            self.transfer_queue.progress(success_count * packet_size)
+
+        result = None
+        self.controller.pauseStream(0.2)
+        try:
+            self.controller.downloadCommand(remote)
+            result = self.controller.stream.download(tmp, md5, callback, journal)
+        except:
+            print(sys.exc_info()[1])
+        finally:
+            self.controller.resumeStream()
+        if result is None:
+            return False
+        if result < 0:
+            return None
+        journal.finish()
+        if result > 0:
+            os.replace(tmp, local)
+        elif os.path.exists(tmp):
+            # md5 equal, the local copy is already up to date
+            os.remove(tmp)
+        return True
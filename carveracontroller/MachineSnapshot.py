@@ -0,0 +1,67 @@
+from collections.abc import Mapping
+
+from .StatusReport import STATUS_FIELDS
+
+# written by the diagnose report {...}
+DIAGNOSE_FIELDS = (
+    "sw_spindle", "sl_spindle", "sw_laser", "sl_laser", "sw_spindlefan", "sl_spindlefan",
+    "sw_vacuum", "sl_vacuum", "sw_light", "sw_tool_sensor_pwr", "sw_air", "sw_wp_charge_pwr",
+    "st_x_min", "st_x_max", "st_y_min", "st_y_max", "st_z_max", "st_cover",
+    "st_probe", "st_calibrate", "st_atc_home", "st_tool_sensor", "st_e_stop",
+)
+SNAPSHOT_FIELDS = STATUS_FIELDS + DIAGNOSE_FIELDS
+
+
+# ==============================================================================
+# Read-only view of the machine reported state. The stream thread never
+# changes a published snapshot: every report replaces it with a new one
+# (copy on write), so a reader that took controller.snapshot once sees one
+# consistent report, never new mx with old wx, and needs no lock. A report
+# that changed nothing keeps the same object, readers can compare identity
+# to skip work.
+# ==============================================================================
+class MachineSnapshot(Mapping):
+    __slots__ = ("_values", "version")
+
+    def __init__(self, values=(), version=0):
+        object.__setattr__(self, "_values", dict(values))
+        object.__setattr__(self, "version", version)
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def of(cls, vars):
+        """First snapshot, from the machine fields of a vars dict"""
+        return cls({name: vars.get(name, 0) for name in SNAPSHOT_FIELDS})
+
+    # ----------------------------------------------------------------------
+    def replace(self, changes):
+        """Snapshot with changes applied, self when nothing differs"""
+        changes = {name: value for name, value in changes.items()
+                   if name not in self._values or self._values[name] != value}
+        if not changes:
+            return self
+        values = dict(self._values)
+        values.update(changes)
+        return MachineSnapshot(values, self.version + 1)
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MachineSnapshot is read-only")
+
+    def __repr__(self):
+        return "MachineSnapshot(v%d, %s)" % (self.version, self._values.get("state", ""))
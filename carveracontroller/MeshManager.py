@@ -0,0 +1,360 @@
+from kivy.graphics.transformation import Matrix
+from math import sqrt
+
+
+# Vertex data of the toolpath preview, kept apart from GcodeViewer so it can
+# be built and measured without a window or a GL context
+
+
+#rotate point around axis & angle
+#https://stackoverflow.com/questions/6721544/circular-rotation-around-an-arbitrary-axis
+#https://kivy.org/doc/stable/api-kivy.graphics.transformation.html
+def rotate_pt_by_x_axis_angle(pt_x,pt_y,pt_z,angle_in_degree):
+    axis = [1,0,0]
+    mat_rot_x = Matrix()
+    angle_in_radian = angle_in_degree * 3.1415926 / 180.0
+    mat_rot_x.rotate(angle_in_radian,axis[0],axis[1],axis[2])
+    rot_pt = mat_rot_x.transform_point(pt_x,pt_y,pt_z)
+    return rot_pt
+
+
+#####function
+def vec3_add(v1, v2):
+    return [v1[0] + v2[0], v1[1] + v2[1], v1[2] + v2[2]]
+
+
+def vec3_sub(v1, v2):
+    return [v1[0] - v2[0], v1[1] - v2[1], v1[2] - v2[2]]
+
+
+def vec3_mul_float(v1, f):
+    return [v1[0] * f, v1[1] * f, v1[2] * f]
+
+
+def vec3_divide(v1, ff):
+    f = 1.0 / ff
+    return [v1[0] * f, v1[1] * f, v1[2] * f]
+
+
+def vec3_len(v1):
+    return sqrt(v1[0] * v1[0] + v1[1] * v1[1] + v1[2] * v1[2])
+
+
+def vec3_max(v1, v2):
+    return [max(v1[0], v2[0]), max(v1[1], v2[1]), max(v1[2], v2[2])]
+
+
+def vec3_min(v1, v2):
+    return [min(v1[0], v2[0]), min(v1[1], v2[1]), min(v1[2], v2[2])]
+
+
+def vec3_distance(v1, v2):
+    v3 = vec3_sub(v1, v2)
+    return vec3_len(v3)
+
+
+class MyMeshManager():
+
+    def __init__(self):
+
+        ##data container
+
+        # all pts
+        self.positions = []
+        # all lengths
+        self.lengths = []
+        # vertex type
+        self.vertex_types = []
+        # raw numbers
+        self.raw_linenumbers = []
+        # angles of vertices [4 axis]
+        self.angles_of_vertices = []
+
+        # mesh container
+        self.meshes = []
+
+        # vertices
+        self.vertices = []
+        ##  bounding area
+
+        # record the max size of area
+        self.area_size = 0.0
+        # max pt
+        self.max_pt = [0, 0, 0]
+        # cetner of meshes
+        self.area_center_sum = [0, 0, 0]
+        self.area_center_sum_index = 0
+        self.position_scale = 1.0 #same to scale_invert
+
+        ## attributes
+        self.is_4_axis = None
+
+    def clear(self):
+        self.positions.clear()
+        # all lengths
+        self.lengths.clear()
+        # vertex type
+        self.vertex_types.clear()
+        # raw numbers
+        self.raw_linenumbers.clear()
+        # angles of vertices [4 axis]
+        self.angles_of_vertices.clear()
+        # mesh container
+        self.meshes.clear()
+        # vertices
+        self.vertices.clear()
+
+        #move to origin
+        self.area_size = 0.0
+        self.max_pt = [0, 0, 0]
+        self.area_center_sum = [0,0,0]
+        self.area_center_sum_index = 0
+        self.position_scale = 1.0  # same to scale_invert
+        self.is_4_axis = None
+
+    def get_pt_count(self):
+        return len(self.positions)
+
+    def map_color(self, color_str):
+        if color_str == 'Green':
+            return [0., 1., 0.]
+        elif color_str == 'Red':
+            return [1., 0., 0.]
+        return [1., 1., 1.]
+
+    # get center of meshes
+    def get_center(self):
+        if self.area_center_sum_index == 0:
+            return [0, 0, 0]
+
+        return vec3_divide(self.area_center_sum, self.area_center_sum_index)
+
+    def get_center_of_view(self):
+        return vec3_mul_float(self.get_center(), self.position_scale)
+
+    def get_vertex_position(self,idx):
+        return [self.vertices[idx*10],self.vertices[idx*10+1],self.vertices[idx*10+2]]
+    # parse single line
+    def parse_line(self, line):
+        arr_pt = line.split(' ')
+
+        # position
+        pos = [float(arr_pt[1]), float(arr_pt[3]), float(arr_pt[5])]
+        if self.is_4_axis:
+            angle = float(arr_pt[7])
+            pos = rotate_pt_by_x_axis_angle(pos[0], pos[1], pos[2], angle)
+
+        self.positions.append(pos[0])
+        self.positions.append(pos[1])
+        self.positions.append(pos[2])
+        self.max_pt = vec3_max(self.max_pt, pos)
+
+        # for center calculating
+        self.area_center_sum = vec3_add(self.area_center_sum, pos)
+        self.area_center_sum_index += 1
+
+        # get attributes of this point
+        vertex = [0] * 10
+        if self.is_4_axis:
+            # 1 position
+            vertex[0] = pos[0]
+            vertex[1] = pos[1]
+            vertex[2] = pos[2]
+
+            #angle
+            angle = float(arr_pt[7])
+
+            # 2 color
+            color = self.map_color(arr_pt[9])
+            vertex[3] = color[0]
+            vertex[4] = color[1]
+            vertex[5] = color[2]
+
+            # 3 line number in gcode
+            vertex[6] = float(arr_pt[11])
+
+
+            # 4 type id
+            vertex[7] = len(self.positions) - 1
+
+            # 5 distance attribute
+            vertex[8] = 0  # set after length is calculated
+
+            # 6 set tool knife id
+            vertex[9] = float(arr_pt[13])
+
+            # push this vertex to container
+            self.vertices.extend(vertex)
+            self.vertex_types.append(1.0 if arr_pt[9] == "Green" else 2.0)  # line type[red | green]
+            self.raw_linenumbers.append(vertex[6])
+            self.angles_of_vertices.append(angle)
+        else:
+            # 1 position
+            vertex[0] = pos[0]
+            vertex[1] = pos[1]
+            vertex[2] = pos[2]
+
+            # 2 color
+            color = self.map_color(arr_pt[7])
+            vertex[3] = color[0]
+            vertex[4] = color[1]
+            vertex[5] = color[2]
+
+            # 3 line number in gcode
+            vertex[6] = float(arr_pt[9])
+
+            # 4 type id
+            vertex[7] = len(self.positions) - 1
+
+            # 5 distance attribute
+            vertex[8] = 0  # set after length is calculated
+
+            # 6 set tool knife id
+            vertex[9] = float(arr_pt[11])
+
+            # push this vertex to container
+            self.vertices.extend(vertex)
+
+            self.vertex_types.append(1.0 if arr_pt[7] == "Green" else 2.0)  # line type[red | green]
+            self.raw_linenumbers.append(vertex[6])
+
+    def parse_line_data(self,linedata):
+
+        # position
+        pos = [linedata[0],linedata[1],linedata[2]]
+
+        #angle
+        angle = linedata[3]
+        pos = rotate_pt_by_x_axis_angle(pos[0], pos[1], pos[2], angle)
+
+        self.positions.extend(pos)
+        self.max_pt = vec3_max(self.max_pt, pos)
+
+        # for center calculating
+        self.area_center_sum = vec3_add(self.area_center_sum, pos)
+        self.area_center_sum_index += 1
+
+        # get attributes of this point
+        vertex = [0] * 10
+        # 1 position
+        vertex[0] = pos[0]
+        vertex[1] = pos[1]
+        vertex[2] = pos[2]
+
+        # angle
+        # angle = linedata[3]
+
+        # 2 color
+        color = [1.0,0.0,0.0] if linedata[4] == 0.0 else [0.0,1.0,0.0]
+        vertex[3] = color[0]
+        vertex[4] = color[1]
+        vertex[5] = color[2]
+
+        # 3 line number in gcode
+        vertex[6] = linedata[5]
+
+        # 4 type id
+        vertex[7] = len(self.positions) - 1
+
+        # 5 distance attribute
+        vertex[8] = 0  # set after length is calculated
+
+        # 6 set tool knife id
+        vertex[9] = linedata[6]
+
+        # push this vertex to container
+        self.vertices.extend(vertex)
+        self.vertex_types.append(1.0 if linedata[4] > 0.5 else 2.0)  # line type[red | green]
+        self.raw_linenumbers.append(vertex[6])
+        self.angles_of_vertices.append(angle)
+
+    def generate_meshes(self):
+        # 0 scale all points
+        max_point = (max(self.max_pt[0], max(self.max_pt[1], self.max_pt[2])))
+
+        vertex_count = len(self.positions) // 3
+        vertex_float_num = 10
+        self.position_scale = (2.0) if max_point == 0 else (2.0 / max_point)
+        for i in range(vertex_count):
+            self.vertices[vertex_float_num * i + 0] = self.positions[3 * i + 0] * self.position_scale
+            self.vertices[vertex_float_num * i + 1] = self.positions[3 * i + 1] * self.position_scale
+            self.vertices[vertex_float_num * i + 2] = self.positions[3 * i + 2] * self.position_scale
+
+            # if i % 1000 == 0:
+            #     print(f"{self.vertices[vertex_float_num * i + 0]} % {self.vertices[vertex_float_num * i + 1]} % {self.vertices[vertex_float_num * i + 0]}")
+
+        # 1 calculate lengths
+        self.lengths = [0] * vertex_count
+        for i in range(1, vertex_count):
+            pos1 = [self.vertices[vertex_float_num * (i - 1) + 0], self.vertices[vertex_float_num * (i - 1) + 1],
+                    self.vertices[vertex_float_num * (i - 1) + 2]]
+            pos2 = [self.vertices[vertex_float_num * (i) + 0], self.vertices[vertex_float_num * (i) + 1],
+                    self.vertices[vertex_float_num * (i) + 2]]
+
+            cur_line_len = vec3_distance(pos1, pos2)
+            self.lengths[i] = self.lengths[i - 1] + cur_line_len
+
+        # 2 set distance id
+        for i in range(vertex_count):
+            self.vertices[vertex_float_num * i + 8] = self.lengths[i]
+
+        self.seg_mesh_vertex_count = 65500
+        # 3 construct meshes
+        self.meshes.clear()
+        mesh_start_id = 0
+        mesh_end_id = min(self.seg_mesh_vertex_count, vertex_count)  # not included
+
+        while (True):
+            # process each mesh
+            indices = []
+            for i in range(mesh_end_id - mesh_start_id):
+                indices.append(i)
+            # print(f"vertix index:[{mesh_start_id}-{mesh_end_id}]  indices Index:{len(indices)}")
+            mesh = [self.vertices[vertex_float_num * mesh_start_id:vertex_float_num * mesh_end_id], indices]
+
+            self.meshes.append(mesh)
+
+            # debug
+            # print("start:", mesh_start_id, self.vertices[vertex_float_num * mesh_start_id])
+            # print("end:", mesh_end_id - 1, self.vertices[vertex_float_num * (mesh_end_id - 1)])
+
+            # skip to next mesh
+            if mesh_end_id == vertex_count:
+                break  # run to end
+
+            # resuse the last mesh vertex to make sure continous lines
+            mesh_start_id = mesh_end_id - 1
+            mesh_end_id = min(mesh_start_id + self.seg_mesh_vertex_count, vertex_count)
+
+    def add_lines(self, rawlines):
+        # parse line
+
+        # 1 check gcode type
+        is_4_axis = False
+        if (len(rawlines) > 0 and 'A:' in rawlines[0]):
+            is_4_axis = True
+
+        if self.is_4_axis is None:
+            self.is_4_axis = is_4_axis
+        elif self.is_4_axis != is_4_axis:
+            print("conflict line type!")
+
+        # 2 parse single line
+        for line in rawlines:
+            self.parse_line(line.strip())
+
+        self.generate_meshes()
+
+    def add_data_arrs(self, rawdata,is_end=True):
+        # parse line
+
+        # 1 check gcode type
+        self.is_4_axis = True
+
+        # 2 parse single line
+        for linedata in rawdata:
+            self.parse_line_data(linedata)
+
+        # get_elapsed("parse data")
+        if is_end:
+            self.generate_meshes()
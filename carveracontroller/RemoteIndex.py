@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import threading
+
+MD5PAT = re.compile(r'\b([0-9a-fA-F]{32})\b')
+
+
+# ------------------------------------------------------------------------------
+# Normalise a remote path, the machine uses '/' whatever the host does
+# ------------------------------------------------------------------------------
+def remote_key(path):
+    return '/'.join(path.replace('\\', '/').split('/')).rstrip('/')
+
+
+# ------------------------------------------------------------------------------
+# Return the md5 in an md5sum reply, None if there is none
+# ------------------------------------------------------------------------------
+def parse_md5_reply(lines):
+    if isinstance(lines, str):
+        lines = [lines]
+    for line in lines:
+        match = MD5PAT.search(line)
+        if match:
+            return match.group(1).lower()
+    return None
+
+
+# ==============================================================================
+# Local index of the files on each machine: path -> [size, mtime, md5].
+# Sizes and dates come from 'ls -e -s' listings, md5s from md5sum replies
+# and from files this client transferred itself. An md5 is only trusted
+# while the listed size and date stay the same.
+# ==============================================================================
+class RemoteIndex:
+
+    def __init__(self, path=None):
+        self.path = path        # json file the index is kept in, None for memory only
+        self.lock = threading.Lock()
+        self.machines = {}
+        self.load()
+
+    # ----------------------------------------------------------------------
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.machines = json.load(f)
+        except (OSError, ValueError):
+            self.machines = {}
+
+    # ----------------------------------------------------------------------
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.machines, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    # ----------------------------------------------------------------------
+    def _files(self, machine):
+        # an unidentified machine ('') is not indexed, changes go nowhere
+        return self.machines.setdefault(machine, {}) if machine else {}
+
+    # ----------------------------------------------------------------------
+    def update_dir(self, machine, directory, entries):
+        """Merge a directory listing, entries are (name, size, mtime) of files"""
+        directory = remote_key(directory)
+        with self.lock:
+            files = self._files(machine)
+            listed = set()
+            for name, size, mtime in entries:
+                path = directory + '/' + name
+                listed.add(path)
+                old = files.get(path)
+                md5 = old[2] if old and old[0] == size and old[1] in (mtime, None) else None
+                files[path] = [size, mtime, md5]
+            prefix = directory + '/'
+            for path in [p for p in files if p.startswith(prefix) and '/' not in p[len(prefix):]]:
+                if path not in listed:
+                    del files[path]
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def record(self, machine, path, size, md5):
+        """A file this client just wrote or read, the next listing adds its date"""
+        with self.lock:
+            files = self._files(machine)
+            old = files.get(remote_key(path))
+            mtime = old[1] if old and old[0] == size and old[2] == md5 else None
+            files[remote_key(path)] = [size, mtime, md5]
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def set_md5(self, machine, path, md5):
+        with self.lock:
+            entry = self._files(machine).get(remote_key(path))
+            if entry is not None:
+                entry[2] = md5
+                self.save()
+
+    # ----------------------------------------------------------------------
+    def remove(self, machine, path):
+        with self.lock:
+            files = self._files(machine)
+            key = remote_key(path)
+            for p in [p for p in files if p == key or p.startswith(key + '/')]:
+                del files[p]
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def rename(self, machine, path, new_path):
+        with self.lock:
+            files = self._files(machine)
+            key, new_key = remote_key(path), remote_key(new_path)
+            for p in [p for p in files if p == key or p.startswith(key + '/')]:
+                files[new_key + p[len(key):]] = files.pop(p)
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def lookup(self, machine, path):
+        """Return (size, mtime, md5) of a remote file, None if unknown"""
+        with self.lock:
+            entry = self.machines.get(machine, {}).get(remote_key(path))
+            return tuple(entry) if entry else None
+
+    # ----------------------------------------------------------------------
+    def md5(self, machine, path):
+        entry = self.lookup(machine, path)
+        return entry[2] if entry else None
+
+    # ----------------------------------------------------------------------
+    def find(self, machine, md5, size=None):
+        """Remote paths holding content with this md5"""
+        if not md5:
+            return []
+        with self.lock:
+            return sorted(path for path, (s, mtime, m) in self.machines.get(machine, {}).items()
+                          if m == md5 and (size is None or s == size))
+
+    # ----------------------------------------------------------------------
+    def same(self, machine, path, size, md5):
+        """True if the remote file is known to hold exactly this content"""
+        entry = self.lookup(machine, path)
+        return bool(entry and md5 and entry[0] == size and entry[2] == md5)
@@ -0,0 +1,233 @@
+import re
+import time
+import threading
+from collections import deque
+
+REALTIME = 0  # feed hold, resume, reset and status poll bytes, written at once
+INTERACTIVE = 1  # jogs and commands from the user, bounded queue
+BULK = 2  # listings and file reads with large replies, rate limited
+LANE_NAMES = ('realtime', 'interactive', 'bulk')
+
+REALTIME_BYTES = (b'!', b'~', b'?', b'\x18')
+BULK_COMMANDS = ('ls', 'cat', 'config-get-all', 'md5sum', 'diagnose', 'help')
+GCODE_LINE = re.compile(rb'\s*([$\[]|[A-Za-z]\s*[-+.\d])')  # G-code, $ and [ lines, not word commands
+
+INTERACTIVE_LIMIT = 64  # lines waiting, more are refused
+BULK_RATE = 2.0  # bulk commands per s
+BULK_BURST = 2  # bulk commands sent back to back before the rate applies
+DRAIN_TIMEOUT = 2.0  # s
+
+# upper bounds of the latency buckets, s; the last bucket takes the rest
+HISTOGRAM_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+
+# ------------------------------------------------------------------------------
+# Lane for a raw command
+# ------------------------------------------------------------------------------
+def lane_of(data):
+    if data in REALTIME_BYTES:
+        return REALTIME
+    word = data.split(None, 1)[0].decode(errors='ignore').lower() if data.strip() else ''
+    return BULK if word in BULK_COMMANDS else INTERACTIVE
+
+
+# ------------------------------------------------------------------------------
+# True for lines that may pass queued bulk commands: G-code and settings.
+# Word commands (rm, mv, upload...) act on what a queued ls, cat or md5sum
+# reads, they keep their order behind it
+# ------------------------------------------------------------------------------
+def overtakes(data):
+    return GCODE_LINE.match(data) is not None
+
+
+# ==============================================================================
+# Time from queueing to the write, counted in fixed buckets
+# ==============================================================================
+class LatencyHistogram:
+
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.reset()
+
+    # ----------------------------------------------------------------------
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # ----------------------------------------------------------------------
+    def add(self, seconds):
+        i = 0
+        while i < len(self.bounds) and seconds > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # ----------------------------------------------------------------------
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, s"""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    # ----------------------------------------------------------------------
+    def summary(self):
+        if self.count == 0:
+            return 'no samples'
+        return 'n=%d, avg %.1fms, p50 %.0fms, p99 %.0fms, max %.1fms' % (
+            self.count, self.total / self.count * 1000, self.percentile(50) * 1000,
+            self.percentile(99) * 1000, self.max * 1000)
+
+
+# ==============================================================================
+# Send scheduler with strict priority lanes in front of the stream.
+#
+# Realtime bytes are written by the caller at once, they only wait for a
+# write in progress. Interactive and bulk commands are queued and written
+# by a sender thread in order, interactive first; bulk commands only go when
+# no interactive one waits and the token bucket allows, so a listing or a
+# file read cannot hold up a jog. An interactive word command sent while
+# bulk ones wait is queued behind them instead (without using a token), so
+# an rm never overtakes the md5sum sent before it. All writes go through
+# one lock so lines from different lanes never interleave on the wire.
+# ==============================================================================
+class SendScheduler:
+
+    def __init__(self, write, error=None, held=None):
+        self.write = write  # write(bytes), raises when the link is down
+        self.error = error  # error(exception) for failed queued writes
+        self.held = held  # held() is True while only realtime bytes may go out
+        self.write_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.lanes = (None, deque(), deque())  # (data, queued time, lane)
+        self.busy = False  # a queued command is being written
+        self.histograms = [LatencyHistogram() for _ in LANE_NAMES]
+        self.dropped = [0] * len(LANE_NAMES)
+        self.tokens = float(BULK_BURST)
+        self.token_time = time.time()
+        self.thread = None
+
+    # ----------------------------------------------------------------------
+    def send(self, data, lane=None):
+        """Write or queue data, returns False when the lane is full or held"""
+        if lane is None:
+            lane = lane_of(data)
+        now = time.time()
+        if lane == REALTIME:
+            with self.write_lock:
+                self.write(data)
+            self.histograms[REALTIME].add(time.time() - now)
+            return True
+        with self.cond:
+            if self.held is not None and self.held():
+                self.dropped[lane] += 1
+                return False
+            queue = self.lanes[lane]
+            if lane == INTERACTIVE:
+                if len(queue) >= INTERACTIVE_LIMIT:
+                    self.dropped[lane] += 1
+                    return False
+                if self.lanes[BULK] and not overtakes(data):
+                    queue = self.lanes[BULK]
+            queue.append((data, now, lane))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return True
+
+    # ----------------------------------------------------------------------
+    def direct(self, data):
+        """Write outside the lanes, for senders with their own flow control"""
+        with self.write_lock:
+            self.write(data)
+
+    # ----------------------------------------------------------------------
+    def pending(self):
+        with self.cond:
+            return sum(len(queue) for queue in self.lanes[1:]) + self.busy
+
+    # ----------------------------------------------------------------------
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """Wait until every queued command is written, e.g. before a transfer
+        takes over the stream"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while any(self.lanes[1:]) or self.busy:
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self.cond.wait(left)
+        return True
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        """Forget queued commands, the link they were meant for is gone"""
+        with self.cond:
+            for lane, queue in enumerate(self.lanes[1:], 1):
+                self.dropped[lane] += len(queue)
+                queue.clear()
+            self.cond.notify_all()
+
+    # ----------------------------------------------------------------------
+    def stats(self):
+        with self.cond:
+            return {name: {'histogram': self.histograms[lane], 'dropped': self.dropped[lane],
+                           'queued': len(self.lanes[lane]) if lane else 0}
+                    for lane, name in enumerate(LANE_NAMES)}
+
+    # ----------------------------------------------------------------------
+    def reset_stats(self):
+        with self.cond:
+            for histogram in self.histograms:
+                histogram.reset()
+            self.dropped = [0] * len(LANE_NAMES)
+
+    # ----------------------------------------------------------------------
+    # Next queued command by priority, None with the seconds to wait when
+    # only rate limited bulk commands are left
+    # ----------------------------------------------------------------------
+    def next(self, now):
+        if self.lanes[INTERACTIVE]:
+            return INTERACTIVE, self.lanes[INTERACTIVE].popleft(), 0
+        if self.lanes[BULK]:
+            self.tokens = min(BULK_BURST, self.tokens + (now - self.token_time) * BULK_RATE)
+            self.token_time = now
+            if self.lanes[BULK][0][2] == INTERACTIVE:
+                return INTERACTIVE, self.lanes[BULK].popleft(), 0
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return BULK, self.lanes[BULK].popleft(), 0
+            return None, None, (1.0 - self.tokens) / BULK_RATE
+        return None, None, None
+
+    # ----------------------------------------------------------------------
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    lane, item, wait = self.next(time.time())
+                    if lane is not None:
+                        break
+                    self.cond.wait(wait)
+                self.busy = True
+            data, queued, lane = item
+            try:
+                with self.write_lock:
+                    self.write(data)
+                self.histograms[lane].add(time.time() - queued)
+            except Exception as e:
+                if self.error is not None:
+                    self.error(e)
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
@@ -0,0 +1,149 @@
+import math
+
+# fields published to CNC.vars, in report order
+STATUS_FIELDS = (
+    "state", "rotation_angle", "active_coord_system",
+    "mx", "my", "mz", "ma", "wx", "wy", "wz", "wa",
+    "wcox", "wcoy", "wcoz", "wcoa",
+    "curfeed", "tarfeed", "OvFeed",
+    "curspindle", "tarspindle", "OvSpindle", "vacuummode", "spindletemp",
+    "tool", "tlo", "target_tool", "wpvoltage",
+    "lasermode", "laserstate", "lasertesting", "laserpower", "laserscale",
+    "playedlines", "playedpercent", "playedseconds",
+    "atc_state", "max_delta", "halt_reason",
+)
+
+STATUS_DEFAULTS = {
+    "state": "", "rotation_angle": 0.0, "active_coord_system": 0,
+    "mx": 0.0, "my": 0.0, "mz": 0.0, "ma": 0.0,
+    "wx": 0.0, "wy": 0.0, "wz": 0.0, "wa": 0.0,
+    "wcox": 0.0, "wcoy": 0.0, "wcoz": 0.0, "wcoa": 0.0,
+    "curfeed": 0.0, "tarfeed": 0.0, "OvFeed": 100,
+    "curspindle": 0.0, "tarspindle": 0.0, "OvSpindle": 100, "vacuummode": 0, "spindletemp": 0.0,
+    "tool": -1, "tlo": 0.0, "target_tool": -1, "wpvoltage": 0.0,
+    "lasermode": 0, "laserstate": 0, "lasertesting": 0, "laserpower": 0.0, "laserscale": 0.0,
+    "playedlines": -1, "playedpercent": 0, "playedseconds": 0,
+    "atc_state": 0, "max_delta": 0.0, "halt_reason": 1,
+}
+
+# inputs of the rotated work offset, wcox/wcoy are only recomputed when one of them moves
+WCO_INPUTS = ("rotation_angle", "mx", "my", "wx", "wy")
+
+
+# =============================================================================
+# One parsed <...> status report
+# =============================================================================
+class StatusReport:
+    __slots__ = STATUS_FIELDS
+
+    def __init__(self, values=None):
+        for name in STATUS_FIELDS:
+            setattr(self, name, STATUS_DEFAULTS[name] if values is None
+                    else values.get(name, STATUS_DEFAULTS[name]))
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def parse(cls, line, prev=None):
+        """Parse a status line. Fields the firmware only sends sometimes keep
+        the value of the previous report, exactly as CNC.vars used to"""
+        # <Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000,5.3|R:0.0|G:0|F:12345.12,100.0|S:1.2,100.0|T:1|L:0>
+        if prev is None:
+            prev = cls()
+        r = cls.__new__(cls)
+        for name in STATUS_FIELDS:
+            setattr(r, name, getattr(prev, name))
+
+        l = line[1:-1].split('|')
+        r.state = l[0]
+        d = {}
+        for x in l[1:]:
+            a, _, b = x.partition(':')
+            d[a] = b.split(',')
+
+        v = d.get('R')
+        r.rotation_angle = float(v[0]) if v else 0.0
+        v = d.get('G')
+        r.active_coord_system = int(float(v[0])) if v else 0
+
+        v = d['MPos']
+        r.mx = float(v[0])
+        r.my = float(v[1])
+        r.mz = float(v[2])
+        r.ma = float(v[3]) if len(v) > 3 else 0.0
+        v = d['WPos']
+        r.wx = float(v[0])
+        r.wy = float(v[1])
+        r.wz = float(v[2])
+        r.wa = 0.0
+
+        if r.rotation_angle != prev.rotation_angle or r.mx != prev.mx or r.my != prev.my \
+                or r.wx != prev.wx or r.wy != prev.wy or prev.state == "":
+            angle = r.rotation_angle * math.pi / 180
+            c = math.cos(angle)
+            s = math.sin(angle)
+            r.wcox = round(r.mx - (c * r.wx - s * r.wy), 3)
+            r.wcoy = round(r.my - (s * r.wx + c * r.wy), 3)
+        r.wcoz = round(r.mz - r.wz, 3)
+        r.wcoa = r.wcoz
+
+        v = d.get('F')
+        if v:
+            r.curfeed = float(v[0])
+            r.tarfeed = float(v[1])
+            r.OvFeed = int(float(v[2]))
+        v = d.get('S')
+        if v:
+            r.curspindle = float(v[0])
+            r.tarspindle = float(v[1])
+            r.OvSpindle = float(v[2])
+            if len(v) > 3:
+                r.vacuummode = int(float(v[3]))
+            if len(v) > 4:
+                r.spindletemp = float(v[4])
+        v = d.get('T')
+        if v:
+            r.tool = int(float(v[0]))
+            r.tlo = float(v[1])
+            r.target_tool = int(float(v[2])) if len(v) > 2 else -1
+        else:
+            r.tool = -1
+            r.tlo = 0.0
+            r.target_tool = -1
+        v = d.get('W')
+        if v:
+            r.wpvoltage = float(v[0])
+        v = d.get('L')
+        if v:
+            r.lasermode = int(float(v[0]))
+            r.laserstate = int(float(v[1]))
+            r.lasertesting = int(float(v[2]))
+            r.laserpower = float(v[3])
+            r.laserscale = float(v[4])
+        v = d.get('P')
+        if v:
+            r.playedlines = int(float(v[0]))
+            r.playedpercent = int(float(v[1]))
+            r.playedseconds = int(float(v[2]))
+        else:
+            # not playing file
+            r.playedlines = -1
+        v = d.get('A')
+        r.atc_state = int(float(v[0])) if v else 0
+        v = d.get('O')
+        r.max_delta = float(v[0]) if v else 0.0
+        v = d.get('H')
+        if v:
+            r.halt_reason = int(float(v[0]))
+        return r
+
+    # ----------------------------------------------------------------------
+    def diff(self, prev):
+        """Return the set of field names that differ from prev"""
+        if prev is None:
+            return set(STATUS_FIELDS)
+        return {name for name in STATUS_FIELDS if getattr(self, name) != getattr(prev, name)}
+
+    # ----------------------------------------------------------------------
+    def apply(self, vars, fields=STATUS_FIELDS):
+        for name in fields:
+            vars[name] = getattr(self, name)
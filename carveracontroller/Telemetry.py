@@ -0,0 +1,211 @@
+import os
+import mmap
+import time
+import struct
+import threading
+from array import array
+
+TELEMETRY_MAGIC = b'CTLM'
+TELEMETRY_VERSION = 1
+SEGMENT_RECORDS = 18000         # one hour of reports at 5 per second
+MAX_SEGMENTS = 48               # segments kept on disk, oldest are deleted
+
+# file header: magic, version, record size, capacity, records written
+HEADER = struct.Struct('<4sHHII')
+HEADER_SIZE = 64
+
+# one record per status report, 80 bytes (about 1.4 MB per hour)
+#   time, mx, my, mz, ma, wx, wy, wz, curfeed, tarfeed, curspindle,
+#   spindletemp, wpvoltage, laserpower, playedlines, tool,
+#   OvFeed, OvSpindle, state, lasermode, atc_state
+RECORD = struct.Struct('<d13fiihhBBB5x')
+RECORD_FIELDS = ('time', 'mx', 'my', 'mz', 'ma', 'wx', 'wy', 'wz',
+                 'curfeed', 'tarfeed', 'curspindle', 'spindletemp', 'wpvoltage', 'laserpower',
+                 'playedlines', 'tool', 'OvFeed', 'OvSpindle', 'state', 'lasermode', 'atc_state')
+
+STATE_CODES = ['', 'Idle', 'Run', 'Hold', 'Home', 'Alarm', 'Sleep', 'Tool', 'Wait', 'Pause', 'Disable', 'N/A']
+
+
+# ------------------------------------------------------------------------------
+# Record names for a rotating segment
+# ------------------------------------------------------------------------------
+def segment_name(start):
+    return 'telemetry-%s.bin' % time.strftime('%Y%m%d-%H%M%S', time.localtime(start))
+
+
+# ==============================================================================
+# Always-on recorder, appends one fixed size record per status report to a
+# memory mapped segment file and rolls over to a new file when it is full
+# ==============================================================================
+class TelemetryRecorder:
+
+    def __init__(self, directory, segment_records=SEGMENT_RECORDS, max_segments=MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.file = None
+        self.map = None
+        self.count = 0
+        self.path = None
+        os.makedirs(directory, exist_ok=True)
+
+    # ----------------------------------------------------------------------
+    def _open_segment(self):
+        self.close()
+        now = time.time()
+        path = os.path.join(self.directory, segment_name(now))
+        n = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, segment_name(now)[:-4] + '-%d.bin' % n)
+            n += 1
+        size = HEADER_SIZE + self.segment_records * RECORD.size
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.count = 0
+        self.path = path
+        HEADER.pack_into(self.map, 0, TELEMETRY_MAGIC, TELEMETRY_VERSION, RECORD.size,
+                         self.segment_records, 0)
+        self._remove_old_segments()
+
+    # ----------------------------------------------------------------------
+    def _remove_old_segments(self):
+        segments = list_segments(self.directory)
+        for path in segments[:-self.max_segments]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # ----------------------------------------------------------------------
+    def record(self, status, now=None):
+        """Append a StatusReport (or anything with the same attributes)"""
+        with self.lock:
+            if self.map is None or self.count >= self.segment_records:
+                self._open_segment()
+            try:
+                state = STATE_CODES.index(status.state)
+            except ValueError:
+                state = 0
+            RECORD.pack_into(self.map, HEADER_SIZE + self.count * RECORD.size,
+                             time.time() if now is None else now,
+                             status.mx, status.my, status.mz, status.ma,
+                             status.wx, status.wy, status.wz,
+                             status.curfeed, status.tarfeed, status.curspindle,
+                             status.spindletemp, status.wpvoltage, status.laserpower,
+                             status.playedlines, status.tool,
+                             int(status.OvFeed), int(status.OvSpindle),
+                             state, status.lasermode & 0xff, status.atc_state & 0xff)
+            self.count += 1
+            # the header count is what readers trust, bump it after the record is in place
+            struct.pack_into('<I', self.map, HEADER.size - 4, self.count)
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        if self.map is not None:
+            try:
+                self.map.flush()
+                self.map.close()
+            except:
+                pass
+            self.map = None
+        if self.file is not None:
+            try:
+                self.file.close()
+            except:
+                pass
+            self.file = None
+
+
+# ------------------------------------------------------------------------------
+# Return segment files in a telemetry directory, oldest first
+# ------------------------------------------------------------------------------
+def list_segments(directory):
+    try:
+        names = [x for x in os.listdir(directory) if x.startswith('telemetry-') and x.endswith('.bin')]
+    except OSError:
+        return []
+    return [os.path.join(directory, x) for x in sorted(names)]
+
+
+# ==============================================================================
+# Reader for one or more recorded segments
+# ==============================================================================
+class TelemetryReader:
+
+    def __init__(self, paths):
+        if isinstance(paths, str):
+            paths = list_segments(paths) if os.path.isdir(paths) else [paths]
+        self.paths = paths
+
+    # ----------------------------------------------------------------------
+    def _segment_records(self, path):
+        with open(path, 'rb') as f:
+            head = f.read(HEADER_SIZE)
+            if len(head) < HEADER.size:
+                return
+            magic, version, record_size, capacity, count = HEADER.unpack_from(head)
+            if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION or record_size != RECORD.size:
+                return
+            data = f.read(min(count, capacity) * RECORD.size)
+        for values in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+            yield values
+
+    # ----------------------------------------------------------------------
+    def records(self, start=None, end=None):
+        """Yield raw record tuples (RECORD_FIELDS order) between start and end times"""
+        for path in self.paths:
+            for values in self._segment_records(path):
+                t = values[0]
+                if start is not None and t < start:
+                    continue
+                if end is not None and t > end:
+                    return
+                yield values
+
+    # ----------------------------------------------------------------------
+    def columns(self, names=RECORD_FIELDS, start=None, end=None):
+        """Return {name: array} for the requested fields"""
+        idx = [RECORD_FIELDS.index(name) for name in names]
+        cols = {name: array('d') for name in names}
+        outs = [cols[name] for name in names]
+        for values in self.records(start, end):
+            for i, out in zip(idx, outs):
+                out.append(values[i])
+        return cols
+
+    # ----------------------------------------------------------------------
+    def export_csv(self, filename, names=RECORD_FIELDS, start=None, end=None):
+        idx = [RECORD_FIELDS.index(name) for name in names]
+        state = RECORD_FIELDS.index('state')
+        with open(filename, 'w') as f:
+            f.write(','.join(names) + '\n')
+            for values in self.records(start, end):
+                f.write(','.join(STATE_CODES[values[i]] if i == state and values[i] < len(STATE_CODES)
+                                 else str(values[i]) for i in idx) + '\n')
+
+    # ----------------------------------------------------------------------
+    def viewer_array(self, start=None, end=None):
+        """Return recorded work positions in the [x, y, z, a, color, line, tool]
+        format GCodeViewer.load_array expects; color marks spindle on"""
+        points = []
+        last = None
+        for values in self.records(start, end):
+            xyz = (values[5], values[6], values[7], values[4])
+            if xyz == last:
+                continue
+            last = xyz
+            points.append([xyz[0], xyz[1], xyz[2], xyz[3],
+                           1 if values[10] > 0.0 else 0, max(values[14], 0), values[15]])
+        return points
+
+
+# ------------------------------------------------------------------------------
+# Replay a recorded session into the 3D viewer, call from the UI thread
+# ------------------------------------------------------------------------------
+def replay_into_viewer(viewer, source, start=None, end=None):
+    reader = source if isinstance(source, TelemetryReader) else TelemetryReader(source)
+    points = reader.viewer_array(start, end)
+    viewer.load_array(points, True)
+    return len(points)
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+
+JOURNAL_SUFFIX = '.journal'
+CHUNK_SIZE = 64 * 8192  # 512 KB, a whole number of packets for every XMODEM mode
+
+
+# ==============================================================================
+# Progress record of one file transfer, kept next to the local file so an
+# interrupted transfer can continue from the last verified chunk.
+#
+# Confirmed bytes (acknowledged when sending, written when receiving) are
+# hashed per CHUNK_SIZE chunk. Only complete chunks count for resuming, so
+# the resume offset is always a packet boundary and every byte before it is
+# covered by a hash.
+# ==============================================================================
+class TransferJournal:
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.chunk_size = chunk_size
+        self.md5 = ''
+        self.chunks = []
+        self.confirmed = 0
+        self.hash = hashlib.md5()
+        self.load()
+
+    # ----------------------------------------------------------------------
+    def load(self):
+        try:
+            with open(self.journal_path, 'r') as f:
+                state = json.load(f)
+            if state.get('chunk_size') != self.chunk_size:
+                return
+            self.md5 = state.get('md5', '')
+            self.chunks = list(state.get('chunks', []))
+        except (OSError, ValueError):
+            self.md5 = ''
+            self.chunks = []
+        self.confirmed = len(self.chunks) * self.chunk_size
+        self.hash = hashlib.md5()
+
+    # ----------------------------------------------------------------------
+    def save(self):
+        tmp = self.journal_path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'md5': self.md5, 'chunk_size': self.chunk_size,
+                           'offset': len(self.chunks) * self.chunk_size, 'chunks': self.chunks}, f)
+            os.replace(tmp, self.journal_path)
+        except OSError:
+            pass
+
+    # ----------------------------------------------------------------------
+    def begin(self, md5):
+        """Start recording a transfer of md5 from byte 0"""
+        self.md5 = md5
+        self.chunks = []
+        self.confirmed = 0
+        self.hash = hashlib.md5()
+        self.save()
+
+    # ----------------------------------------------------------------------
+    def resume(self, md5, offset):
+        """Continue recording at offset, a chunk boundary returned by resume_offset"""
+        if md5 != self.md5 or offset % self.chunk_size or offset > len(self.chunks) * self.chunk_size:
+            self.begin(md5)
+            return False
+        del self.chunks[offset // self.chunk_size:]
+        self.confirmed = offset
+        self.hash = hashlib.md5()
+        self.save()
+        return True
+
+    # ----------------------------------------------------------------------
+    def confirm(self, data):
+        """Account for the next confirmed bytes of the transfer"""
+        view = memoryview(data)
+        while len(view):
+            room = self.chunk_size - self.confirmed % self.chunk_size
+            part = view[:room]
+            self.hash.update(part)
+            self.confirmed += len(part)
+            view = view[len(part):]
+            if self.confirmed % self.chunk_size == 0:
+                self.chunks.append(self.hash.hexdigest())
+                self.hash = hashlib.md5()
+                self.save()
+
+    # ----------------------------------------------------------------------
+    def resume_offset(self, md5, stream=None):
+        """Offset a transfer of md5 can continue from. With a stream (the
+        partly received file) only chunks whose content still matches count"""
+        if not md5 or md5 != self.md5 or not self.chunks:
+            return 0
+        if stream is None:
+            return len(self.chunks) * self.chunk_size
+        good = 0
+        try:
+            position = stream.tell()
+            stream.seek(0)
+            for digest in self.chunks:
+                data = stream.read(self.chunk_size)
+                if len(data) < self.chunk_size or hashlib.md5(data).hexdigest() != digest:
+                    break
+                good += 1
+            stream.seek(position)
+        except (OSError, ValueError):
+            return 0
+        return good * self.chunk_size
+
+    # ----------------------------------------------------------------------
+    def finish(self):
+        """Transfer done (or abandoned), forget it"""
+        self.md5 = ''
+        self.chunks = []
+        self.confirmed = 0
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
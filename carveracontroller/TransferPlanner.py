@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from .LzCodec import BLOCK_SIZE, compress_block
+
+# Block sizes the firmware can decode; it unpacks fixed 4 KB blocks, so
+# this is the only candidate until firmware reports others
+LZ_BLOCK_SIZES = (BLOCK_SIZE,)
+
+# starting points until transfers have been measured, bytes/s
+DEFAULT_LINK_RATE = {'usb': 80 * 1024, 'wifi': 150 * 1024}
+DEFAULT_DECOMPRESS_RATE = 300 * 1024    # source bytes the machine unpacks per second
+DEFAULT_COMPRESS_RATE = 20 * 1024 * 1024
+LZ_FIXED_COST = 1.0                     # s, starting and polling the decompression
+
+SAMPLE_BLOCKS = 16                      # blocks compressed to estimate the ratio
+MIN_SAMPLE_BYTES = 64 * 1024            # smaller transfers say little about a rate
+MIN_SAMPLE_TIME = 0.5
+EWMA_WEIGHT = 0.3
+AUDIT_MAX_BYTES = 1024 * 1024
+
+
+# ------------------------------------------------------------------------------
+# Estimate the compression ratio of a file from a few blocks spread over it
+# ------------------------------------------------------------------------------
+def sample_ratio(filename, block_size=BLOCK_SIZE, blocks=SAMPLE_BLOCKS):
+    size = os.path.getsize(filename)
+    if size == 0:
+        return 1.0
+    count = min(blocks, (size + block_size - 1) // block_size)
+    step = max(size // count, block_size)
+    raw = packed = 0
+    with open(filename, 'rb') as f:
+        for i in range(count):
+            f.seek(min(i * step, max(size - block_size, 0)))
+            block = f.read(block_size)
+            if not block:
+                break
+            raw += len(block)
+            packed += len(compress_block(block))
+    return packed / raw if raw else 1.0
+
+
+# ==============================================================================
+# Decide per upload whether compressing pays off. Link throughput (per
+# connection type), local compression speed and the machine's decompression
+# speed are learned from past transfers (moving averages, kept in a json
+# file); every decision and the measured outcome are appended to an audit
+# log next to it.
+# ==============================================================================
+class TransferPlanner:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats_path = os.path.join(directory, 'transfer_stats.json')
+        self.audit_path = os.path.join(directory, 'transfer_audit.jsonl')
+        self.log = logging.getLogger('Transfer.Plan')
+        self.lock = threading.Lock()
+        self.stats = {'link': {}, 'decompress': DEFAULT_DECOMPRESS_RATE, 'compress': DEFAULT_COMPRESS_RATE}
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    # ----------------------------------------------------------------------
+    def load(self):
+        try:
+            with open(self.stats_path, 'r') as f:
+                self.stats.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    # ----------------------------------------------------------------------
+    def save(self):
+        tmp = self.stats_path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.stats, f)
+            os.replace(tmp, self.stats_path)
+        except OSError:
+            pass
+
+    # ----------------------------------------------------------------------
+    def link_rate(self, link):
+        return self.stats['link'].get(link, DEFAULT_LINK_RATE.get(link, DEFAULT_LINK_RATE['usb']))
+
+    # ----------------------------------------------------------------------
+    def _update(self, old, size, seconds):
+        if size < MIN_SAMPLE_BYTES or seconds < MIN_SAMPLE_TIME:
+            return old
+        return old + (size / seconds - old) * EWMA_WEIGHT
+
+    # ----------------------------------------------------------------------
+    def add_link(self, link, size, seconds):
+        with self.lock:
+            self.stats['link'][link] = self._update(self.link_rate(link), size, seconds)
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def add_compress(self, size, seconds):
+        with self.lock:
+            self.stats['compress'] = self._update(self.stats['compress'], size, seconds)
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def add_decompress(self, size, seconds):
+        with self.lock:
+            self.stats['decompress'] = self._update(self.stats['decompress'], size, seconds)
+            self.save()
+
+    # ----------------------------------------------------------------------
+    def plan(self, filename, link, cached=False):
+        """Return the decision for uploading filename over link ('usb' or
+        'wifi'); cached means a compressed copy is already at hand"""
+        size = os.path.getsize(filename)
+        link_rate = self.link_rate(link)
+        raw_time = size / link_rate
+        decision = {'time': time.time(), 'file': os.path.basename(filename), 'size': size, 'link': link,
+                    'link_rate': round(link_rate), 'raw_time': round(raw_time, 3),
+                    'compress': False, 'block_size': 0, 'ratio': 1.0, 'predicted': round(raw_time, 3)}
+        for block_size in LZ_BLOCK_SIZES:
+            ratio = sample_ratio(filename, block_size)
+            # compression runs while the data is sent, the slower of the two counts
+            send_time = size * ratio / link_rate
+            if not cached:
+                send_time = max(send_time, size / self.stats['compress'])
+            lz_time = send_time + size / self.stats['decompress'] + LZ_FIXED_COST
+            decision['lz_time_%d' % block_size] = round(lz_time, 3)
+            if lz_time < decision['predicted']:
+                decision.update(compress=True, block_size=block_size, ratio=round(ratio, 3),
+                                predicted=round(lz_time, 3))
+        decision['cached'] = cached
+        self.audit(decision)
+        self.log.info('%s: %s, %d bytes over %s, predicted %.1f s (raw %.1f s)', decision['file'],
+                      'compress %d' % decision['block_size'] if decision['compress'] else 'send raw',
+                      size, link, decision['predicted'], raw_time)
+        return decision
+
+    # ----------------------------------------------------------------------
+    def outcome(self, decision, seconds, ok):
+        """Record how long the upload (and decompression) really took"""
+        entry = {'time': time.time(), 'file': decision['file'], 'compress': decision['compress'],
+                 'predicted': decision['predicted'], 'actual': round(seconds, 3), 'ok': ok}
+        self.audit(entry)
+        self.log.info('%s: took %.1f s, predicted %.1f s', entry['file'], seconds, decision['predicted'])
+
+    # ----------------------------------------------------------------------
+    def audit(self, entry):
+        with self.lock:
+            try:
+                if os.path.exists(self.audit_path) and os.path.getsize(self.audit_path) > AUDIT_MAX_BYTES:
+                    os.replace(self.audit_path, self.audit_path + '.1')
+                with open(self.audit_path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError:
+                pass
@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELED = 'canceled'
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+MAX_ATTEMPTS = 3
+RETRY_DELAYS = (5, 30, 120)     # s to wait before the 1st, 2nd, 3rd retry
+IDLE_POLL = 1.0                 # s between checks while the machine is busy
+RATE_WEIGHT = 0.3
+
+
+# ------------------------------------------------------------------------------
+# One file to move, kept as a plain dict so the queue file stays readable
+# ------------------------------------------------------------------------------
+def new_job(kind, local, remote, size, priority, machine=None):
+    return {'id': '%x' % int(time.time() * 1000000), 'kind': kind, 'machine': machine, 'local': local, 'remote': remote,
+            'size': size, 'priority': priority, 'state': QUEUED, 'attempts': 0, 'error': '',
+            'done': 0, 'added': time.time(), 'not_before': 0, 'started': 0, 'finished': 0}
+
+
+# ==============================================================================
+# Persistent queue of uploads and downloads worked off one at a time by a
+# background thread (the machine has a single file channel). Jobs run in
+# priority order, then in the order they were added; a failed job goes back
+# into the queue after a growing delay until MAX_ATTEMPTS is used up.
+#
+# Each job belongs to the machine it was queued for; machine() returns the
+# key of the connected one and only its jobs are picked (jobs without a
+# machine run on any). run(job) does the transfer and returns True, False
+# (failed) or None (canceled), ready(job) tells whether the machine may be
+# used right now for job and changed() is called from the worker after
+# every state change.
+# ==============================================================================
+class TransferQueue:
+
+    def __init__(self, path=None, run=None, ready=None, changed=None, cancel=None, machine=None):
+        self.path = path        # json file the queue is kept in, None for memory only
+        self.run = run
+        self.ready = ready
+        self.machine = machine
+        self.changed = changed
+        self.cancel_running = cancel
+        self.log = logging.getLogger('Transfer.Queue')
+        self.lock = threading.Condition()
+        self.jobs = []
+        self.current = None
+        self.cancel_current = False
+        self.rate = 0.0         # bytes/s, moving average over finished jobs
+        self.thread = None
+        self.stopped = False
+        self.load()
+
+    # ----------------------------------------------------------------------
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.jobs = data.get('jobs', [])
+            self.rate = data.get('rate', 0.0)
+        except (OSError, ValueError, AttributeError):
+            self.jobs = []
+        # a job that was running when the program stopped starts again
+        # (its TransferJournal lets the transfer resume where it was)
+        for job in self.jobs:
+            if job['state'] == RUNNING:
+                job['state'] = QUEUED
+
+    # ----------------------------------------------------------------------
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'jobs': self.jobs, 'rate': self.rate}, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    # ----------------------------------------------------------------------
+    def _notify(self):
+        self.save()
+        self.lock.notify_all()
+        if self.changed:
+            try:
+                self.changed()
+            except:
+                pass
+
+    # ----------------------------------------------------------------------
+    def add(self, kind, local, remote, size=0, priority=PRIORITY_NORMAL, machine=None):
+        job = new_job(kind, local, remote, size, priority, machine)
+        with self.lock:
+            # the same transfer queued twice only runs once
+            for other in self.jobs:
+                if other['state'] == QUEUED and other['kind'] == kind and other.get('machine') == machine and \
+                        other['local'] == local and other['remote'] == remote:
+                    other['priority'] = min(other['priority'], priority)
+                    self._notify()
+                    return other
+            while any(other['id'] == job['id'] for other in self.jobs):
+                job['id'] = '%x' % (int(job['id'], 16) + 1)
+            self.jobs.append(job)
+            self._notify()
+        return job
+
+    # ----------------------------------------------------------------------
+    def add_upload(self, local, remote_dir, priority=PRIORITY_NORMAL, machine=None):
+        remote = remote_dir.rstrip('/\\') + '/' + os.path.basename(os.path.normpath(local))
+        return self.add(UPLOAD, local, remote, os.path.getsize(local), priority, machine)
+
+    # ----------------------------------------------------------------------
+    def add_folder(self, local_dir, remote_dir, priority=PRIORITY_NORMAL, machine=None):
+        """Queue every visible file of local_dir for remote_dir"""
+        jobs = []
+        for name in sorted(os.listdir(local_dir)):
+            path = os.path.join(local_dir, name)
+            if not name.startswith('.') and os.path.isfile(path):
+                jobs.append(self.add_upload(path, remote_dir, priority, machine))
+        return jobs
+
+    # ----------------------------------------------------------------------
+    def add_download(self, remote, local, size, priority=PRIORITY_NORMAL, machine=None):
+        return self.add(DOWNLOAD, local, remote, size, priority, machine)
+
+    # ----------------------------------------------------------------------
+    def cancel(self, job_id=None):
+        """Cancel one job, or every unfinished job when job_id is None"""
+        with self.lock:
+            for job in self.jobs:
+                if (job_id is None or job['id'] == job_id) and job['state'] == QUEUED:
+                    job['state'] = CANCELED
+                    job['finished'] = time.time()
+            running = self.current is not None and (job_id is None or self.current['id'] == job_id)
+            if running:
+                self.cancel_current = True
+            self._notify()
+        if running and self.cancel_running:
+            self.cancel_running()
+
+    # ----------------------------------------------------------------------
+    def retry(self, job_id=None):
+        """Queue failed or canceled jobs again"""
+        with self.lock:
+            for job in self.jobs:
+                if (job_id is None or job['id'] == job_id) and job['state'] in (FAILED, CANCELED):
+                    job.update(state=QUEUED, attempts=0, error='', done=0, not_before=0)
+            self._notify()
+
+    # ----------------------------------------------------------------------
+    def clear_finished(self):
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job['state'] in (QUEUED, RUNNING)]
+            self._notify()
+
+    # ----------------------------------------------------------------------
+    def progress(self, done):
+        """Bytes moved so far by the running job"""
+        with self.lock:
+            if self.current:
+                self.current['done'] = done
+        if self.changed:
+            self.changed()
+
+    # ----------------------------------------------------------------------
+    def pending(self):
+        with self.lock:
+            return [job for job in self.jobs if job['state'] in (QUEUED, RUNNING)]
+
+    # ----------------------------------------------------------------------
+    def stats(self):
+        """Aggregate view of the queue for the status display"""
+        with self.lock:
+            count = dict((state, 0) for state in (QUEUED, RUNNING, DONE, FAILED, CANCELED))
+            total = done = 0
+            for job in self.jobs:
+                count[job['state']] += 1
+                if job['state'] in (QUEUED, RUNNING, DONE):
+                    total += job['size']
+                    done += job['size'] if job['state'] == DONE else job['done']
+            rate = self.rate
+            if self.current and self.current['started']:
+                elapsed = time.time() - self.current['started']
+                if elapsed > 1 and self.current['done']:
+                    rate = self.current['done'] / elapsed
+            return {'count': count, 'bytes_total': total, 'bytes_done': done, 'rate': rate,
+                    'eta': (total - done) / rate if rate > 0 else None,
+                    'current': dict(self.current) if self.current else None}
+
+    # ----------------------------------------------------------------------
+    def _next(self):
+        now = time.time()
+        machine = self.machine() if self.machine else None
+        waiting = [job for job in self.jobs if job['state'] == QUEUED and job['not_before'] <= now
+                   and (machine is None or job.get('machine') in (None, machine))]
+        if not waiting:
+            return None
+        return min(waiting, key=lambda job: (job['priority'], job['added']))
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopped = False
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+
+    # ----------------------------------------------------------------------
+    def worker(self):
+        while True:
+            with self.lock:
+                job = None
+                while not self.stopped:
+                    job = self._next()
+                    if job and (self.ready is None or self.ready(job)):
+                        break
+                    job = None
+                    self.lock.wait(IDLE_POLL)
+                if self.stopped:
+                    return
+                job.update(state=RUNNING, started=time.time(), done=0)
+                job['attempts'] += 1
+                self.current = job
+                self.cancel_current = False
+                self._notify()
+
+            try:
+                result = self.run(job)
+            except:
+                self.log.exception('%s %s', job['kind'], job['local'])
+                job['error'] = str(sys.exc_info()[1])
+                result = False
+
+            with self.lock:
+                self.current = None
+                job['finished'] = time.time()
+                if result:
+                    job.update(state=DONE, done=job['size'], error='')
+                    elapsed = job['finished'] - job['started']
+                    if elapsed > 0 and job['size']:
+                        rate = job['size'] / elapsed
+                        self.rate = rate if not self.rate else self.rate + (rate - self.rate) * RATE_WEIGHT
+                elif result is None or self.cancel_current:
+                    job['state'] = CANCELED
+                elif job['attempts'] < MAX_ATTEMPTS:
+                    delay = RETRY_DELAYS[min(job['attempts'], len(RETRY_DELAYS)) - 1]
+                    job.update(state=QUEUED, not_before=time.time() + delay)
+                    self.log.info('%s %s failed, retry in %d s', job['kind'], job['local'], delay)
+                else:
+                    job['state'] = FAILED
+                    self.log.warning('%s %s failed after %d attempts', job['kind'], job['local'], job['attempts'])
+                # once a batch is through only the failures are kept, for retry()
+                if not any(other['state'] == QUEUED for other in self.jobs):
+                    self.jobs = [other for other in self.jobs if other['state'] == FAILED]
+                self._notify()
@@ -1,4 +1,5 @@
 
+import os
 import time
 import serial
 import sys
@@ -34,7 +35,7 @@ class USBStream:
         return self.serial.read()
 
     # ----------------------------------------------------------------------
-    def open(self, address):
+    def open(self, address, reset=True):
         self.serial = serial.serial_for_url(
             address.replace('\\', '\\\\'),  # Escape for windows
             115200,
@@ -45,6 +46,9 @@ class USBStream:
             write_timeout=SERIAL_TIMEOUT,
             xonxoff=False,
             rtscts=False)
+        if not reset:
+            self.serial.flushInput()
+            return True
         # Toggle DTR to reset Arduino
         try:
             self.serial.setDTR(0)
@@ -61,6 +65,18 @@ class USBStream:
 
         return True
 
+    # ----------------------------------------------------------------------
+    # Open the port again after the link broke, without the DTR reset so a
+    # running machine keeps its session
+    # ----------------------------------------------------------------------
+    def reopen(self, address):
+        try:
+            self.serial.close()
+        except:
+            pass
+        self.serial = None
+        return self.open(address, reset=False)
+
     # ----------------------------------------------------------------------
     def close(self):
         if self.serial is None: return
@@ -88,16 +104,19 @@ class USBStream:
     def putc(self, data, timeout=1):
         return self.serial.write(data) or None
 
-    def upload(self, filename, local_md5, callback):
-        # do upload
-        stream = open(filename, 'rb')
-        result = self.modem.send(stream, md5 = local_md5, retry = 10, callback = callback)
-        stream.close()
+    def upload(self, filename, local_md5, callback, journal = None, source = None):
+        # do upload, from source instead of the file when given (e.g. a CompressingReader)
+        stream = open(filename, 'rb') if source is None else source
+        result = self.modem.send(stream, md5 = local_md5, retry = 10, callback = callback, journal = journal)
+        if source is None:
+            stream.close()
         return result
 
-    def download(self, filename, local_md5, callback):
-        stream = open(filename, 'wb')
-        result = self.modem.recv(stream, md5 = local_md5, retry = 10, callback = callback)
+    def download(self, filename, local_md5, callback, journal = None):
+        # keep a partly downloaded file the journal can resume
+        resumable = journal is not None and journal.chunks and os.path.exists(filename)
+        stream = open(filename, 'r+b' if resumable else 'wb')
+        result = self.modem.recv(stream, md5 = local_md5, retry = 10, callback = callback, journal = journal)
         stream.close()
         return result
 
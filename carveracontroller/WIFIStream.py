@@ -1,10 +1,15 @@
 
+import os
 import sys
 import time
 import socket
 import select
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from .XMODEM import XMODEM
+from .MachineRegistry import MachineRegistry
 import logging
 
 
@@ -12,60 +17,141 @@ TCP_PORT = 2222
 UDP_PORT = 3333
 BUFFER_SIZE = 1024
 SOCKET_TIMEOUT = 0.3  # s
+GETC_BUFFER_SIZE = 8192 + 16    # an xmodem8k packet with header and crc
+# packets in flight offered to the machine for downloads. Stock firmware only
+# speaks classic XMODEM and each refused offer costs a timeout, so it is off;
+# uploads use a window whenever the firmware offers one.
+DOWNLOAD_WINDOW = 0
+DISCOVERY_TIME = 3.0    # s to listen for machine broadcasts
+PROBE_TIMEOUT = 0.5     # s for the TCP connect telling whether a machine is free
+PROBE_WORKERS = 16
 
 # ==============================================================================
 # Machine Detector class
+#
+# Machines announce themselves with UDP broadcasts on UDP_PORT. discover()
+# reports the machines of the registry at once, probes them all in parallel
+# with a short TCP connect and listens for broadcasts in the background,
+# calling on_update(machines, done) whenever the list changed.
 # ==============================================================================
 class MachineDetector:
-    def __init__(self):
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else MachineRegistry()
         self.machine_list = []
-        self.machine_name_list = []
-        self.sock = None
-        self.t = None
-        self.tr = None
+        self.lock = threading.Lock()
+        self.stop_event = None
 
-    def is_machine_busy(self, addr):
-        """Tries to connect to the machine, if machine is available returns true else false"""
+    # ----------------------------------------------------------------------
+    def probe_machine(self, addr, timeout=PROBE_TIMEOUT):
+        """False if the machine takes a connection, True if it refuses one
+        (busy with another client), None if it does not answer"""
+        ip_port = addr.split(':')
         try:
-            with socket.create_connection((addr, "2222"), timeout=1):
+            with socket.create_connection((ip_port[0], int(ip_port[1]) if len(ip_port) > 1 else TCP_PORT), timeout=timeout):
                 return False
-        except (socket.timeout, socket.error) as e:
+        except ConnectionRefusedError:
             return True
+        except (socket.timeout, socket.error, ValueError):
+            return None
 
-    def query_for_machines(self):
-        UDP_IP = "0.0.0.0"
-        # test
-        # self.machine_list.append({'machine': 'Dummy machine', 'ip': '127.0.0.1', 'port': 7777, 'busy': False})
-        try:
-            self.machine_list = []
-            self.machine_name_list = []
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.sock.settimeout(1)
-            self.sock.bind((UDP_IP, UDP_PORT))
-            self.t = self.tr = time.time()
-        except:
-            print(sys.exc_info()[1])
+    def is_machine_busy(self, addr, timeout=PROBE_TIMEOUT):
+        """Tries to connect to the machine, if machine is available returns true else false"""
+        return self.probe_machine(addr, timeout) is not False
+
+    # ----------------------------------------------------------------------
+    def probe(self, addrs, timeout=PROBE_TIMEOUT):
+        """probe_machine() for all addresses at once"""
+        if not addrs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(addrs), PROBE_WORKERS)) as pool:
+            return list(pool.map(lambda addr: self.probe_machine(addr, timeout), addrs))
+
+    # ----------------------------------------------------------------------
+    def discover(self, on_update, duration=DISCOVERY_TIME):
+        self.stop()
+        stop_event = self.stop_event = threading.Event()
+        with self.lock:
+            self.machine_list = self.registry.known()
+            machines = [dict(machine) for machine in self.machine_list]
+        on_update(machines, False)
+        threading.Thread(target=self._discover, args=(on_update, duration, stop_event), daemon=True).start()
 
-    def check_for_responses(self):
+    # ----------------------------------------------------------------------
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    # ----------------------------------------------------------------------
+    def _changed(self, on_update, done=False):
+        with self.lock:
+            machines = [dict(machine) for machine in self.machine_list]
+        on_update(machines, done)
+
+    # ----------------------------------------------------------------------
+    def _probed(self, machine, future, on_update, stop_event):
+        busy = future.result()
+        if busy is None or stop_event.is_set():
+            return
+        with self.lock:
+            # a broadcast tells more than a probe, keep what it said
+            if machine['seen']:
+                return
+            machine['seen'] = True
+            machine['busy'] = busy
+        self._changed(on_update)
+
+    # ----------------------------------------------------------------------
+    def _discover(self, on_update, duration, stop_event):
+        sock = None
+        pool = None
         try:
-            if self.t - self.tr < 3:
-                fields = []
+            with self.lock:
+                known = list(self.machine_list)
+            if known:
+                pool = ThreadPoolExecutor(max_workers=min(len(known), PROBE_WORKERS))
+                for machine in known:
+                    future = pool.submit(self.probe_machine, '%s:%d' % (machine['ip'], machine['port']))
+                    future.add_done_callback(partial(self._probed, machine, on_update=on_update, stop_event=stop_event))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("0.0.0.0", UDP_PORT))
+            deadline = time.time() + duration
+            while not stop_event.is_set():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                sock.settimeout(min(remaining, 0.5))
                 try:
-                    data, addr = self.sock.recvfrom(128)  # buffer size is 1024 bytes
+                    data, addr = sock.recvfrom(128)
                     fields = data.decode('utf-8').split(',')
-                except:
-                    pass
-                if len(fields) > 3 and fields[0] not in self.machine_name_list:
-                    self.machine_name_list.append(fields[0])
-                    self.machine_list.append({'machine': fields[0], 'ip': fields[1], 'port': int(fields[2]), 'busy': True if fields[3] == '1' else False})
-                    print(self.machine_list[-1])
-                self.t = time.time()
-                return None
-            else:
-                self.sock.close()
-                return self.machine_list
+                except socket.timeout:
+                    continue
+                except (OSError, UnicodeDecodeError):
+                    continue
+                if len(fields) > 3:
+                    self._heard(fields)
+                    self._changed(on_update)
         except:
             print(sys.exc_info()[1])
+        finally:
+            if sock is not None:
+                sock.close()
+            if pool is not None:
+                pool.shutdown(wait=True)
+        if not stop_event.is_set():
+            self._changed(on_update, True)
+
+    # ----------------------------------------------------------------------
+    def _heard(self, fields):
+        name, ip, port, busy = fields[0], fields[1], int(fields[2]), fields[3] == '1'
+        with self.lock:
+            for machine in self.machine_list:
+                if machine['machine'] == name:
+                    machine.update(ip=ip, port=port, busy=busy, seen=True)
+                    break
+            else:
+                self.machine_list.append({'machine': name, 'ip': ip, 'port': port, 'busy': busy, 'seen': True})
+        self.registry.seen(name, ip, port)
 
 
 
@@ -76,11 +162,15 @@ class WIFIStream:
 
     socket = None
     modem = None
+    timeout = None
 
     # ----------------------------------------------------------------------
     def __init__(self):
 
         self.modem = XMODEM(self.getc, self.putc, 'xmodem8k')
+        self.buffer = bytearray(GETC_BUFFER_SIZE)
+        self.counters = {}
+        self.reset_counters()
 
         handler = logging.StreamHandler(sys.stdout)
         handler.setLevel(logging.WARNING)
@@ -90,11 +180,15 @@ class WIFIStream:
 
     # ----------------------------------------------------------------------
     def send(self, data):
-        self.socket.send(data)
+        self.socket.sendall(data)
 
     # ----------------------------------------------------------------------
     def recv(self):
-        return self.socket.recv(BUFFER_SIZE)
+        data = self.socket.recv(BUFFER_SIZE)
+        if not data:
+            # readable but empty: the machine closed the connection
+            raise ConnectionResetError('Connection closed by machine')
+        return data
 
     # ----------------------------------------------------------------------
     def open(self, address):
@@ -103,9 +197,21 @@ class WIFIStream:
         self.socket.settimeout(2)
         self.socket.connect((address.split(':')[0], (int)(address.split(':')[1]) if len(ip_port) > 1 else TCP_PORT))
         self.socket.settimeout(SOCKET_TIMEOUT)
+        self.timeout = SOCKET_TIMEOUT
 
         return True
 
+    # ----------------------------------------------------------------------
+    # Connect again after the link broke
+    # ----------------------------------------------------------------------
+    def reopen(self, address):
+        try:
+            self.socket.close()
+        except:
+            pass
+        self.socket = None
+        return self.open(address)
+
     # ----------------------------------------------------------------------
     def close(self):
         if self.socket is None: return
@@ -140,38 +246,92 @@ class WIFIStream:
                 return True
         return False
 
+    # ----------------------------------------------------------------------
+    def set_timeout(self, timeout):
+        if timeout != self.timeout:
+            self.socket.settimeout(timeout)
+            self.timeout = timeout
+
+    # ----------------------------------------------------------------------
+    # Socket calls and bytes moved by the current transfer
+    # ----------------------------------------------------------------------
+    def reset_counters(self):
+        self.counters = {'recv_calls': 0, 'send_calls': 0, 'timeouts': 0, 'bytes_in': 0, 'bytes_out': 0}
+
     # ----------------------------------------------------------------------
     def getc(self, size, timeout = 0.5):
-        t1 = time.time()
-        data = bytearray()
-        while len(data) < size and time.time() - t1 <= timeout:
-            if self.waiting_for_recv():
-                try:
-                    data.extend(self.socket.recv(size - len(data)))
-                except:
-                    print(sys.exc_info()[1])
-            else:
-                time.sleep(0.0001)
+        # block in recv_into for whatever is left of the deadline instead of polling
+        deadline = time.time() + timeout
+        if size > len(self.buffer):
+            self.buffer = bytearray(size)
+        view = memoryview(self.buffer)
+        n = 0
+        while n < size:
+            self.set_timeout(max(deadline - time.time(), 0.0))
+            self.counters['recv_calls'] += 1
+            try:
+                got = self.socket.recv_into(view[n:size])
+            except (socket.timeout, BlockingIOError):
+                self.counters['timeouts'] += 1
+                break
+            except:
+                print(sys.exc_info()[1])
+                break
+            if not got:
+                # connection closed by the machine
+                break
+            n += got
+            if time.time() >= deadline and n < size:
+                break
+        self.counters['bytes_in'] += n
 
-        if len(data) == size:
-            return data
+        if n == size:
+            return bytes(view[:n])
 
         return None
 
     def putc(self, data, timeout = 0.5):
-        return self.socket.send(data) or None
+        self.set_timeout(max(timeout, SOCKET_TIMEOUT))
+        self.counters['send_calls'] += 1
+        self.socket.sendall(data)
+        self.counters['bytes_out'] += len(data)
+        return len(data) or None
 
-    def upload(self, filename, local_md5, callback):
-        # do upload
-        stream = open(filename, 'rb')
-        result = self.modem.send(stream, md5 = local_md5, retry = 10, callback = callback)
-        stream.close()
+    # ----------------------------------------------------------------------
+    # Transfers change the socket timeout, give the normal one back after
+    # ----------------------------------------------------------------------
+    def end_transfer(self, started):
+        if self.socket is not None:
+            self.set_timeout(SOCKET_TIMEOUT)
+        c = self.counters
+        self.modem.log.info('transfer: %.2f s, %d bytes in / %d out, %d recv (%d timed out), %d send',
+                            time.time() - started, c['bytes_in'], c['bytes_out'],
+                            c['recv_calls'], c['timeouts'], c['send_calls'])
+
+    def upload(self, filename, local_md5, callback, journal = None, source = None):
+        # do upload, from source instead of the file when given (e.g. a CompressingReader)
+        stream = open(filename, 'rb') if source is None else source
+        self.reset_counters()
+        started = time.time()
+        try:
+            result = self.modem.send(stream, md5 = local_md5, retry = 10, callback = callback, journal = journal)
+        finally:
+            self.end_transfer(started)
+            if source is None:
+                stream.close()
         return result
 
-    def download(self, filename, local_md5, callback):
-        stream = open(filename, 'wb')
-        result = self.modem.recv(stream, md5 = local_md5, retry = 10, callback = callback)
-        stream.close()
+    def download(self, filename, local_md5, callback, journal = None):
+        # keep a partly downloaded file the journal can resume
+        resumable = journal is not None and journal.chunks and os.path.exists(filename)
+        stream = open(filename, 'r+b' if resumable else 'wb')
+        self.reset_counters()
+        started = time.time()
+        try:
+            result = self.modem.recv(stream, md5 = local_md5, retry = 10, callback = callback, window = DOWNLOAD_WINDOW, journal = journal)
+        finally:
+            self.end_transfer(started)
+            stream.close()
         return result
 
     def cancel_process(self):
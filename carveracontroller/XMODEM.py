@@ -84,6 +84,53 @@ YMODEM Batch Transmission Session (1 file)
     SOH 00 FF NUL[128] CRC CRC              -->
                                             <-- ACK
 
+Windowed 8k blocks (Carvera extension)
+--------------------------------------
+
+The receiver offers a window instead of ``C``. The sender keeps up to N
+packets in flight, each one is acknowledged with its sequence number and
+only NAKed (or timed out) packets are sent again. A classic sender does
+not recognise ``W`` and the receiver falls back to ``C`` after a few tries.
+
+::
+
+    SENDER                                      RECEIVER
+
+                                            <-- W N
+    STX 00 FF Len[2] MD5 PAD CRC CRC        -->
+                                            <-- ACK 00
+    STX 01 FE Len[2] Data[8192] CRC CRC     -->
+    STX 02 FD Len[2] Data[8192] CRC CRC     -->
+                                            <-- NAK 01
+    STX 03 FC Len[2] Data[8192] CRC CRC     -->
+                                            <-- ACK 02
+    STX 01 FE Len[2] Data[8192] CRC CRC     -->
+                                            <-- ACK 03
+                                            <-- ACK 01
+    EOT                                     -->
+                                            <-- EOT
+
+Resuming (Carvera extension)
+----------------------------
+
+A sender that can resume marks its md5 packet with DLE as the first pad
+byte after the md5. A receiver that kept part of an interrupted transfer
+of the same md5 (see :class:`TransferJournal`) answers such a packet with
+DLE and the byte offset it holds, big endian; an unmarked md5 packet (a
+classic sender, which could read the offset bytes as ACK, NAK or CAN) is
+never answered with an offer. The sender continues with the packet after
+that offset; a sender that does not resume sends the md5 packet again and
+the receiver starts over from byte 0. Works in classic and windowed mode.
+
+::
+
+    SENDER                                      RECEIVER
+
+    STX 00 FF Len[2] MD5 DLE PAD CRC CRC    -->
+                                            <-- DLE 00 10 00 00
+    STX 81 7E Len[2] Data[8192] CRC CRC     -->
+                                            <-- ACK
+
 
 """
 from __future__ import division, print_function
@@ -94,10 +141,10 @@ __copyright__ = ['Copyright (c) 2010 Wijnand Modderman',
 __license__ = 'MIT'
 __version__ = '0.4.5'
 
-import platform
 import logging
 import time
 import sys
+import binascii
 from functools import partial
 
 # Protocol bytes
@@ -109,6 +156,10 @@ DLE = b'\x10'
 NAK = b'\x15'
 CAN = b'\x16'
 CRC = b'C'
+WIN = b'W'
+
+MAX_WINDOW = 64     # well below 256 so sequence numbers stay unambiguous
+WINDOW_OFFERS = 3   # window offers before falling back to classic CRC mode
 
 
 class XMODEM(object):
@@ -207,7 +258,7 @@ class XMODEM(object):
         for _ in range(count):
             self.putc(CAN, timeout)
 
-    def send(self, stream, md5, retry=16, timeout=5, quiet=False, callback=None):
+    def send(self, stream, md5, retry=16, timeout=5, quiet=False, callback=None, journal=None):
         '''
         Send a stream via the XMODEM protocol.
 
@@ -235,6 +286,12 @@ class XMODEM(object):
                          Expected callback signature:
                          def callback(total_packets, success_count, error_count)
         :type callback: callable
+        :param journal: Optional :class:`TransferJournal` recording the
+                        acknowledged data. A receiver holding part of the
+                        file may answer the md5 packet with ``DLE`` and a
+                        4 byte offset; the transfer then continues from
+                        there, as long as the journal confirms that much.
+        :type journal: TransferJournal
         '''
 
         # initialize protocol
@@ -247,16 +304,21 @@ class XMODEM(object):
             raise ValueError("Invalid mode specified: {self.mode!r}"
                              .format(self=self))
 
-        is_stx = 1 if packet_size > 255 else 0
-
         self.log.debug('Begin start sequence, packet_size=%d', packet_size)
         error_count = 0
         crc_mode = 0
         cancel = 0
+        window = 0
         while True:
             char = self.getc(1)
             if char:
-                if char == NAK:
+                if char == WIN:
+                    window = self.getc(1, timeout)
+                    window = min(ord(window), MAX_WINDOW) if window else 0
+                    self.log.debug('windowed transfer requested (W %d).', window)
+                    crc_mode = 1
+                    break
+                elif char == NAK:
                     self.log.debug('standard checksum requested (NAK).')
                     crc_mode = 0
                     break
@@ -289,6 +351,9 @@ class XMODEM(object):
                 self.abort(timeout=timeout)
                 return False
 
+        if window > 1:
+            return self._send_windowed(stream, md5, packet_size, window, retry, timeout, callback, journal)
+
         # send data
         error_count = 0
         success_count = 0
@@ -296,6 +361,10 @@ class XMODEM(object):
         sequence = 0 # 0 for md5 upload
         md5_sent = False
 
+        # one packet buffer for the whole transfer, filled in place
+        packet = self._make_packet_buffer(packet_size, crc_mode)
+        pad = self.pad * packet_size
+
         while True:
             if self.canceled:
                 self.putc(CAN)
@@ -307,36 +376,45 @@ class XMODEM(object):
                 self.canceled = False
                 return None
 
-            data = []
-            if not md5_sent and sequence == 0:
-                data = md5.encode()
+            md5_packet = not md5_sent and sequence == 0
+            if md5_packet:
+                length = self._fill_packet(packet, packet_size, crc_mode, sequence, DLE + pad, data=md5.encode())
                 md5_sent = True
             else:
-                data = stream.read(packet_size)
+                length = self._fill_packet(packet, packet_size, crc_mode, sequence, pad, stream=stream)
                 total_packets += 1
-            if not data:
+            if not length:
                 # end of stream
                 self.log.debug('send: at EOF')
                 break
 
-            header = self._make_send_header(packet_size, sequence)
-            if is_stx == 0:
-                data = b''.join([bytes([len(data) & 0xff]), data.ljust(packet_size, self.pad)])
-            else:
-                data = b''.join([bytes([len(data) >> 8, len(data) & 0xff]), data.ljust(packet_size, self.pad)])
-            checksum = self._make_send_checksum(crc_mode, data)
-
             # emit packet
             while True:
                 self.log.debug('send: block %d', sequence)
-                self.putc(header + data + checksum)
+                self.putc(packet)
                 char = self.getc(1, timeout)
                 if char == ACK:
                     success_count += 1
+                    if journal is not None:
+                        if md5_packet:
+                            journal.begin(md5)
+                        else:
+                            journal.confirm(self._packet_payload(packet, packet_size, length))
                     if callable(callback):
                         callback(packet_size, total_packets, success_count, error_count)
                     error_count = 0
                     break
+                elif char == DLE and md5_packet:
+                    offset = self._accept_resume(stream, md5, packet_size, journal, timeout)
+                    if offset is not None:
+                        skipped = offset // packet_size
+                        total_packets += skipped
+                        success_count += 1 + skipped
+                        sequence = skipped % 0x100
+                        if callable(callback):
+                            callback(packet_size, total_packets, success_count, error_count)
+                        error_count = 0
+                        break
                 elif char == CAN:
                     if cancel:
                         self.log.info('Transmission canceled: received 2xCAN.')
@@ -381,6 +459,275 @@ class XMODEM(object):
         self.log.info('Transmission successful (ACK received).')
         return True
 
+    def _accept_resume(self, stream, md5, packet_size, journal, timeout):
+        '''
+        Read the resume offset following ``DLE`` and move the stream there.
+        Returns the offset, or None when it can not be honoured, in which
+        case the md5 packet is sent again and the receiver starts over.
+        '''
+        data = self.getc(4, timeout)
+        if data is None or len(data) != 4:
+            return None
+        offset = int.from_bytes(data, 'big')
+        if offset % packet_size:
+            self.log.info('send: resume offset %d is not a packet boundary', offset)
+            return None
+        if journal is not None and offset > journal.resume_offset(md5):
+            self.log.info('send: resume offset %d was never confirmed', offset)
+            return None
+        try:
+            stream.seek(0, 2)
+            if offset > stream.tell():
+                return None
+            stream.seek(offset)
+        except (OSError, ValueError, AttributeError):
+            return None
+        if journal is not None:
+            journal.resume(md5, offset)
+        self.log.info('send: resuming at byte %d', offset)
+        return offset
+
+    def _offer_resume(self, stream, remote_md5, journal, marked=True):
+        '''
+        Receiving side: return the offset a transfer of ``remote_md5`` can
+        continue from in ``stream``, 0 to start over. Only a sender that
+        ``marked`` its md5 packet takes an offer.
+        '''
+        if journal is None:
+            return 0
+        offset = journal.resume_offset(remote_md5, stream) if marked else 0
+        try:
+            stream.seek(offset)
+            stream.truncate()
+        except (OSError, ValueError):
+            offset = 0
+        if offset:
+            journal.resume(remote_md5, offset)
+        else:
+            journal.begin(remote_md5)
+        return offset
+
+    def _resume_marked(self, data, is_stx):
+        '''
+        True if the md5 packet ``data`` (length prefix and payload) comes
+        from a sender that takes resume offers.
+        '''
+        return data[33 + is_stx:34 + is_stx] == DLE
+
+    def _packet_payload(self, packet, packet_size, length):
+        start = 5 if packet_size > 255 else 4
+        return memoryview(packet)[start:start + length]
+
+    def _cancel_transfer(self, timeout):
+        self.putc(CAN)
+        self.putc(CAN)
+        self.putc(CAN)
+        while self.getc(1, timeout):
+            pass
+        self.log.info('Transmission canceled by user.')
+        self.canceled = False
+
+    def _send_windowed(self, stream, md5, packet_size, window, retry, timeout, callback, journal=None):
+        '''
+        Sliding window variant of :meth:`send`, used when the receiver
+        offered a window. Packet ``n`` (0 carries the md5) is sent with
+        sequence ``n % 256`` from buffer slot ``n % window``; it stays in
+        its slot until acknowledged, so only the packets the receiver NAKs
+        or never acknowledges are sent again. The oldest packet is resent once
+        it is overdue by a few measured round trips, without waiting for the
+        full timeout. Data packets only follow once the md5 packet is
+        answered, as the answer may be a resume offset.
+        '''
+        slots = [self._make_packet_buffer(packet_size, 1) for _ in range(window)]
+        lengths = [0] * window
+        sent_at = [0.0] * window
+        resent = set()
+        srtt = None
+        pad = self.pad * packet_size
+        acked = set()
+        base = 0            # oldest packet not acknowledged
+        next_packet = 0     # next packet to read from the stream
+        eof = False
+        total_packets = 0
+        success_count = 0
+        error_count = 0
+        cancel = 0
+
+        while True:
+            if self.canceled:
+                self._cancel_transfer(timeout)
+                return None
+
+            # fill the window
+            while not eof and next_packet < base + window and (base or not next_packet):
+                slot = slots[next_packet % window]
+                if next_packet == 0:
+                    length = self._fill_packet(slot, packet_size, 1, 0, DLE + pad, data=md5.encode())
+                else:
+                    length = self._fill_packet(slot, packet_size, 1, next_packet % 0x100, pad, stream=stream)
+                if not length:
+                    eof = True
+                    break
+                lengths[next_packet % window] = length
+                if next_packet:
+                    total_packets += 1
+                self.log.debug('send: block %d', next_packet)
+                self.putc(slot)
+                sent_at[next_packet % window] = time.time()
+                next_packet += 1
+
+            if eof and base == next_packet:
+                break
+
+            wait = timeout
+            if srtt is not None:
+                wait = min(timeout, max(sent_at[base % window] + max(4 * srtt, 0.05) - time.time(), 0.001))
+            char = self.getc(1, wait)
+            if char == ACK or char == NAK:
+                seq = self.getc(1, timeout)
+                if seq is None:
+                    continue
+                # map the sequence byte back onto the packets in flight
+                n = base + ((ord(seq) - base) % 0x100)
+                if n >= next_packet:
+                    self.log.debug('send: stale %r for sequence %d', char, ord(seq))
+                    continue
+                if char == ACK:
+                    if n not in acked:
+                        if n not in resent:
+                            sample = time.time() - sent_at[n % window]
+                            srtt = sample if srtt is None else srtt + (sample - srtt) / 8
+                        resent.discard(n)
+                        acked.add(n)
+                        if n:
+                            success_count += 1
+                        error_count = 0
+                        while base in acked:
+                            acked.discard(base)
+                            if journal is not None:
+                                if base:
+                                    journal.confirm(self._packet_payload(slots[base % window], packet_size,
+                                                                         lengths[base % window]))
+                                else:
+                                    journal.begin(md5)
+                            base += 1
+                        if callable(callback):
+                            callback(packet_size, total_packets, success_count, error_count)
+                    continue
+                self.log.info('send error: NAK for block %d, resending', n)
+                if n not in acked:
+                    self.putc(slots[n % window])
+                    sent_at[n % window] = time.time()
+                    resent.add(n)
+            elif char == DLE and base == 0 and next_packet == 1:
+                offset = self._accept_resume(stream, md5, packet_size, journal, timeout)
+                if offset is not None:
+                    skipped = offset // packet_size
+                    base = next_packet = skipped + 1
+                    total_packets += skipped
+                    success_count += skipped
+                    error_count = 0
+                    if callable(callback):
+                        callback(packet_size, total_packets, success_count, error_count)
+                    continue
+                self.putc(slots[0])
+                sent_at[0] = time.time()
+                resent.add(0)
+            elif char == CAN:
+                if cancel:
+                    self.log.info('Transmission canceled: received 2xCAN.')
+                    return False
+                cancel = 1
+                continue
+            else:
+                # nothing came back in time, resend the oldest packet
+                self.log.info('send error: expected ACK; got %r for block %d', char, base)
+                if base < next_packet:
+                    self.putc(slots[base % window])
+                    sent_at[base % window] = time.time()
+                    resent.add(base)
+            error_count += 1
+            if callable(callback):
+                callback(packet_size, total_packets, success_count, error_count)
+            if error_count > retry:
+                self.log.error('send error: %d errors in a row, aborting.', error_count)
+                self.abort(timeout=timeout)
+                return False
+
+        # the receiver confirms EOT by echoing it, so late acknowledgements
+        # of resent packets can not be mistaken for it
+        error_count = 0
+        self.log.debug('sending EOT, awaiting EOT')
+        self.putc(EOT)
+        while True:
+            char = self.getc(1, timeout)
+            if char == EOT:
+                break
+            if char == ACK or char == NAK:
+                self.getc(1, timeout)
+                continue
+            self.log.error('send error: expected EOT; got %r', char)
+            error_count += 1
+            if error_count > retry:
+                self.log.warn('EOT was not confirmed, aborting transfer')
+                self.abort(timeout=timeout)
+                return False
+            self.putc(EOT)
+
+        self.log.info('Transmission successful (EOT confirmed).')
+        return True
+
+    def _make_packet_buffer(self, packet_size, crc_mode):
+        '''
+        Allocate a buffer holding one complete packet: header, length
+        prefix, payload and checksum.
+        '''
+        is_stx = 1 if packet_size > 255 else 0
+        return bytearray(3 + 1 + is_stx + packet_size + (2 if crc_mode else 1))
+
+    def _fill_packet(self, packet, packet_size, crc_mode, sequence, pad, stream=None, data=None):
+        '''
+        Assemble a packet in place in a buffer from :meth:`_make_packet_buffer`,
+        reading the payload straight from ``stream`` (``readinto`` when the
+        stream has it) or copying ``data``. Returns the payload length, 0 at
+        end of stream.
+        '''
+        is_stx = 1 if packet_size > 255 else 0
+        view = memoryview(packet)
+        start = 4 + is_stx
+        end = start + packet_size
+        payload = view[start:end]
+        if data is None:
+            if hasattr(stream, 'readinto'):
+                length = stream.readinto(payload) or 0
+            else:
+                data = stream.read(packet_size)
+        if data is not None:
+            length = len(data)
+            payload[:length] = data
+        if not length:
+            return 0
+        if length < packet_size:
+            payload[length:] = pad[:packet_size - length]
+
+        packet[0] = 2 if is_stx else 1
+        packet[1] = sequence
+        packet[2] = 0xff - sequence
+        if is_stx:
+            packet[3] = length >> 8
+            packet[4] = length & 0xff
+        else:
+            packet[3] = length & 0xff
+
+        body = view[3:end]
+        if crc_mode:
+            crc = self.calc_crc(body)
+            packet[end] = crc >> 8
+            packet[end + 1] = crc & 0xff
+        else:
+            packet[end] = self.calc_checksum(body)
+        return length
+
     def _make_send_header(self, packet_size, sequence):
         assert packet_size in (128, 8192), packet_size
         _bytes = []
@@ -401,7 +748,8 @@ class XMODEM(object):
             _bytes.append(crc)
         return bytearray(_bytes)
 
-    def recv(self, stream, md5 = '', crc_mode=1, retry=16, timeout=1, delay=0.1, quiet=0, callback=None):
+    def recv(self, stream, md5 = '', crc_mode=1, retry=16, timeout=1, delay=0.1, quiet=0, callback=None, window=0,
+             journal=None):
         '''
         Receive a stream via the XMODEM protocol.
 
@@ -433,6 +781,15 @@ class XMODEM(object):
                          Expected callback signature:
                          def callback(success_count, error_count)
         :type callback: callable
+        :param window: Offer a sliding window of this many packets first,
+                       0 for classic XMODEM only.
+        :type window: int
+        :param journal: Optional :class:`TransferJournal` of an earlier,
+                        interrupted transfer into ``stream`` (opened for
+                        reading and writing). If it matches the sender's
+                        md5, the md5 packet is answered with ``DLE`` and the
+                        verified offset instead of ``ACK``.
+        :type journal: TransferJournal
 
         '''
 
@@ -441,14 +798,22 @@ class XMODEM(object):
         error_count = 0
         char = 0
         cancel = 0
+        window = min(window, MAX_WINDOW)
+        offered = False
         while True:
-            # first try CRC mode, if this fails,
+            # first try a window, then CRC mode, if this fails,
             # fall back to checksum mode
             if error_count >= retry:
                 self.log.info('error_count reached %d, aborting.', retry)
                 self.abort(timeout=timeout)
                 return None
+            elif window > 1 and error_count < WINDOW_OFFERS:
+                offered = bool(self.putc(WIN + bytes([window])))
+                if not offered:
+                    time.sleep(0.1)
+                    error_count += 1
             elif crc_mode and error_count < (retry // 2):
+                offered = False
                 if not self.putc(CRC):
                     self.log.debug('recv error: putc failed, '
                                    'sleeping for %d', delay)
@@ -456,6 +821,7 @@ class XMODEM(object):
                     error_count += 1
             else:
                 crc_mode = 0
+                offered = False
                 if not self.putc(NAK):
                     self.log.debug('recv error: putc failed, '
                                    'sleeping for %d', delay)
@@ -490,6 +856,9 @@ class XMODEM(object):
             else:
                 error_count += 1
 
+        if offered:
+            return self._recv_windowed(stream, md5, char, window, retry, timeout, callback, journal)
+
         # read data
         error_count = 0
         income_size = 0
@@ -510,6 +879,8 @@ class XMODEM(object):
         cancel = 0
         retrans = retry + 1
         md5_received = False
+        resumed = False
+        declined = False
 
         while True:
             if self.canceled:
@@ -587,6 +958,20 @@ class XMODEM(object):
                     # second byte is the same as first as 1's complement
                     seq2 = 0xff - ord(seq2)
 
+            if resumed and seq1 == seq2 == 0 and sequence != 0:
+                # the sender did not take the resume offer and sent the md5
+                # packet again, start over (a resumed sequence is never 0,
+                # resume offsets are whole chunks of 64 packets)
+                self.log.info('recv: resume declined, restarting at byte 0')
+                resumed = False
+                declined = True
+                md5_received = False
+                sequence = 0
+                income_size = 0
+                success_count = 0
+                stream.seek(0)
+                stream.truncate()
+
             if not (seq1 == seq2 == sequence):
                 # consume data anyway ... even though we will discard it,
                 # it is not the sequence we expected!
@@ -619,10 +1004,27 @@ class XMODEM(object):
                             while self.getc(1, timeout):
                                 pass
                             return 0
+                        if journal is not None:
+                            remote_md5 = bytes(data[1 + is_stx: 33 + is_stx]).decode(errors='ignore')
+                            offset = 0 if declined else self._offer_resume(stream, remote_md5, journal,
+                                                                           self._resume_marked(data, is_stx))
+                            if offset:
+                                self.log.info('recv: offering to resume at byte %d', offset)
+                                resumed = True
+                                income_size = offset
+                                success_count = offset // packet_size
+                                self.putc(DLE + offset.to_bytes(4, 'big'))
+                                sequence = (success_count + 1) % 0x100
+                                char = self.getc(1, timeout)
+                                continue
+                            if declined:
+                                journal.begin(remote_md5)
                     else:
                         income_size += len(data) - 1 - is_stx
                         data_len = data[0] << 8 | data[1] if is_stx else data[0]
                         stream.write(data[1 + is_stx: (data_len + 1 + is_stx)])
+                        if journal is not None:
+                            journal.confirm(data[1 + is_stx: (data_len + 1 + is_stx)])
                         success_count = success_count + 1
                         if callable(callback):
                             callback(packet_size, success_count, error_count)
@@ -647,10 +1049,138 @@ class XMODEM(object):
             char = self.getc(1, timeout)
             continue
 
+    def _recv_windowed(self, stream, md5, char, window, retry, timeout, callback, journal=None):
+        '''
+        Receiving side of the windowed transfer. Every good packet is
+        acknowledged with its sequence number right away; packets that arrive
+        ahead of a gap are held until the gap is filled, then written in order.
+        With a matching journal the md5 packet is answered with a resume
+        offset instead; if the md5 packet comes again the sender missed or
+        declined it and the transfer starts over.
+        '''
+        packet_size = 128 if char == SOH else 8192
+        is_stx = 1 if packet_size > 255 else 0
+        body_size = 1 + is_stx + packet_size + 2
+        expected = 0        # next packet to write, 0 carries the md5
+        pending = {}
+        gap_nak = -1
+        income_size = 0
+        success_count = 0
+        error_count = 0
+        cancel = 0
+        resumed = 0         # first packet after the resume offset
+        declined = False
+        remote_md5 = None
+
+        while True:
+            if self.canceled:
+                self._cancel_transfer(timeout)
+                return -1
+            if char is None:
+                error_count += 1
+                if error_count > retry:
+                    self.log.error('error_count reached %d, aborting.', retry)
+                    self.abort()
+                    return None
+                # nudge the sender about the packet we are waiting for
+                self.putc(NAK + bytes([expected % 0x100]))
+                char = self.getc(1, timeout)
+                continue
+            if char == EOT:
+                self.putc(EOT)
+                self.log.info("Transmission complete, %d bytes", income_size)
+                return income_size
+            if char == CAN:
+                if cancel:
+                    self.log.info('Transmission canceled: received 2xCAN '
+                                  'at block %d', expected)
+                    return None
+                cancel = 1
+                char = self.getc(1, timeout)
+                continue
+            if char != SOH and char != STX:
+                # out of sync, skip until the next header byte
+                char = self.getc(1, timeout)
+                continue
+
+            cancel = 0
+            head = self.getc(2, timeout)
+            data = self.getc(body_size, timeout) if head is not None else None
+            if data is None or head[0] != 0xff - head[1]:
+                self.log.warn('recv error: broken header or short block')
+                error_count += 1
+                char = self.getc(1, timeout)
+                continue
+
+            seq = head[0]
+            offset = (seq - expected) % 0x100
+            valid, data = self._verify_recv_checksum(1, data)
+            if not valid:
+                error_count += 1
+                if offset < window:
+                    self.putc(NAK + bytes([seq]))
+                char = self.getc(1, timeout)
+                continue
+
+            if resumed and seq == 0 and expected == resumed and data[1 + is_stx: 33 + is_stx] == remote_md5:
+                self.log.info('recv: resume declined, restarting at byte 0')
+                stream.seek(0)
+                stream.truncate()
+                pending.clear()
+                expected = offset = 0
+                income_size = success_count = resumed = 0
+                declined = True
+
+            if expected == 0 and offset == 0 and journal is not None:
+                remote_md5 = bytes(data[1 + is_stx: 33 + is_stx])
+                if not (md5 and md5.encode() == remote_md5):
+                    start = 0 if declined else self._offer_resume(stream, remote_md5.decode(errors='ignore'), journal,
+                                                                  self._resume_marked(data, is_stx))
+                    if start:
+                        self.log.info('recv: offering to resume at byte %d', start)
+                        self.putc(DLE + start.to_bytes(4, 'big'))
+                        expected = resumed = start // packet_size + 1
+                        income_size = start
+                        success_count = start // packet_size
+                        char = self.getc(1, timeout)
+                        continue
+                    if declined:
+                        journal.begin(remote_md5.decode(errors='ignore'))
+
+            self.putc(ACK + bytes([seq]))
+            error_count = 0
+            if offset < window:
+                pending[expected + offset] = data
+                if offset > 0 and gap_nak != expected:
+                    # something before this one went missing, ask for it now
+                    gap_nak = expected
+                    self.putc(NAK + bytes([expected % 0x100]))
+            # offset >= window is a resent packet we already have
+
+            while expected in pending:
+                data = pending.pop(expected)
+                if expected == 0:
+                    if md5 and md5.encode() == data[1 + is_stx: 33 + is_stx]:
+                        self._cancel_transfer(timeout)
+                        return 0
+                else:
+                    data_len = data[0] << 8 | data[1] if is_stx else data[0]
+                    stream.write(data[1 + is_stx: data_len + 1 + is_stx])
+                    if journal is not None:
+                        journal.confirm(data[1 + is_stx: data_len + 1 + is_stx])
+                    income_size += packet_size
+                    success_count += 1
+                    if callable(callback):
+                        callback(packet_size, success_count, error_count)
+                expected += 1
+
+            char = self.getc(1, timeout)
+
     def _verify_recv_checksum(self, crc_mode, data):
+        # work on a view so stripping the checksum does not copy the block
+        data = memoryview(data)
         if crc_mode:
-            _checksum = bytearray(data[-2:])
-            their_sum = (_checksum[0] << 8) + _checksum[1]
+            their_sum = (data[-2] << 8) + data[-1]
             data = data[:-2]
 
             our_sum = self.calc_crc(data)
@@ -660,8 +1190,7 @@ class XMODEM(object):
                               '(theirs=%04x, ours=%04x), ',
                               their_sum, our_sum)
         else:
-            _checksum = bytearray([data[-1]])
-            their_sum = _checksum[0]
+            their_sum = data[-1]
             data = data[:-1]
 
             our_sum = self.calc_checksum(data)
@@ -683,8 +1212,9 @@ class XMODEM(object):
             '0x3c'
 
         '''
-        if platform.python_version_tuple() >= ('3', '0', '0'):
-            return (sum(data) + checksum) % 256
+        if sys.version_info[0] >= 3:
+            # summing bytes is much faster than iterating a memoryview
+            return (sum(bytes(data)) + checksum) % 256
         else:
             return (sum(map(ord, data)) + checksum) % 256
 
@@ -699,10 +1229,9 @@ class XMODEM(object):
             '0x4ab3'
 
         '''
-        for char in bytearray(data):
-            crctbl_idx = ((crc >> 8) ^ char) & 0xff
-            crc = ((crc << 8) ^ self.crctable[crctbl_idx]) & 0xffff
-        return crc & 0xffff
+        # binascii.crc_hqx is CRC-16/CCITT (poly 0x1021), the same CRC as the
+        # crctable above, computed in C
+        return binascii.crc_hqx(data, crc & 0xffff)
 
 def _send(mode='xmodem', filename=None, timeout=30):
     '''Send a file (or stdin) using the selected mode.'''
@@ -1,3 +1,11 @@
+import sys
+
+# headless commands start without importing Kivy
+if __name__ == "__main__" and len(sys.argv) > 1:
+    from carveracontroller.cli import COMMANDS, main as cli_main
+    if sys.argv[1] in COMMANDS:
+        sys.exit(cli_main())
+
 from carveracontroller.main import main, init_lang, Lang
 
 # tr is used throughout the kivvy .kv definition files
@@ -0,0 +1,208 @@
+"""
+Headless access to a machine, without Kivy:
+
+    python -m carveracontroller status   ADDRESS [--watch]
+    python -m carveracontroller connect  ADDRESS
+    python -m carveracontroller upload   ADDRESS FILE [REMOTE_DIR] [--lz]
+    python -m carveracontroller download ADDRESS REMOTE [FILE]
+    python -m carveracontroller play     ADDRESS REMOTE [--watch]
+    python -m carveracontroller stream   ADDRESS FILE
+    python -m carveracontroller config   ADDRESS [FILE]
+
+ADDRESS is ip[:port] of the WiFi module, or the serial port with --usb.
+Only argparse is imported up front, the controller stack is imported by
+the command that needs it.
+"""
+import os
+import sys
+import time
+import argparse
+
+COMMANDS = ('status', 'connect', 'upload', 'download', 'play', 'stream', 'config')
+CONNECT_TIMEOUT = 5     # s to wait for the first status report
+WATCH_INTERVAL = 0.5    # s between status lines with --watch
+REMOTE_DIR = '/sd/gcodes'
+
+
+# ------------------------------------------------------------------------------
+# Open a session and wait until the machine reported its state
+# ------------------------------------------------------------------------------
+def connect(options):
+    from .Controller import CONN_USB, CONN_WIFI, CONNECTED
+    from .MachineSession import MachineSession
+
+    session = MachineSession(options.address, options.address, CONN_USB if options.usb else CONN_WIFI)
+    try:
+        if not session.controller.open(session.conn_type, session.address):
+            print('%s: connection failed' % options.address, file=sys.stderr)
+            return None
+        # ask at once instead of waiting for the first poll
+        session.controller.viewStatusReport(True)
+    except Exception as e:
+        print('%s: %s' % (options.address, e), file=sys.stderr)
+        return None
+    deadline = time.time() + options.timeout
+    while session.state == CONNECTED and time.time() < deadline:
+        time.sleep(0.05)
+    if session.state == CONNECTED:
+        print('%s: no status report' % options.address, file=sys.stderr)
+        session.close()
+        return None
+    return session
+
+
+def status_line(status):
+    line = '%-6s MPos %.3f,%.3f,%.3f,%.3f  WPos %.3f,%.3f,%.3f,%.3f' % (
+        status.state, status.mx, status.my, status.mz, status.ma, status.wx, status.wy, status.wz, status.wa)
+    if status.playedlines >= 0 and status.state not in ('Idle', 'Alarm'):
+        line += '  played %d lines %d%% %ds' % (status.playedlines, status.playedpercent, status.playedseconds)
+    return line
+
+
+def watch(session, until_idle=False):
+    """Print each changed status until Ctrl-C, or until the job is over"""
+    last = None
+    busy = False
+    try:
+        while session.connected:
+            status = session.status()
+            if status is not None:
+                line = status_line(status)
+                if line != last:
+                    print(line)
+                    sys.stdout.flush()
+                    last = line
+                busy = busy or status.state not in ('Idle', 'Wait')
+                if until_idle and busy and status.state == 'Idle':
+                    return True
+                if until_idle and status.state == 'Alarm':
+                    return False
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    return True
+
+
+# ------------------------------------------------------------------------------
+# Commands, return the exit status
+# ------------------------------------------------------------------------------
+def cmd_connect(session, options):
+    print('%s: connected, %s' % (options.address, session.state))
+    return 0
+
+
+def cmd_status(session, options):
+    if options.watch:
+        watch(session)
+    else:
+        print(status_line(session.status()))
+    return 0
+
+
+def cmd_upload(session, options):
+    remote = options.remote_dir.rstrip('/') + '/' + os.path.basename(options.file)
+    started = time.time()
+    result = session.upload(options.file, remote, options.lz)
+    if not result:
+        print('%s: upload %s' % (options.file, 'canceled' if result is None else 'failed'), file=sys.stderr)
+        return 1
+    print('%s -> %s%s, %.1f s' % (options.file, remote, '.lz' if options.lz else '', time.time() - started))
+    return 0
+
+
+def cmd_download(session, options):
+    local = options.file or os.path.basename(options.remote)
+    started = time.time()
+    if not session.download(options.remote, local):
+        print('%s: download failed' % options.remote, file=sys.stderr)
+        return 1
+    print('%s -> %s, %.1f s' % (options.remote, local, time.time() - started))
+    return 0
+
+
+def cmd_play(session, options):
+    session.controller.playCommand(options.remote)
+    if options.watch:
+        return 0 if watch(session, until_idle=True) else 1
+    return 0
+
+
+def cmd_stream(session, options):
+    streamer = session.controller.streamGcode(options.file)
+    if streamer is None:
+        print('%s: machine busy streaming' % options.file, file=sys.stderr)
+        return 1
+    try:
+        while streamer.is_active():
+            streamer.join(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        session.controller.abortStreamGcode()
+    metrics = streamer.metrics()
+    if metrics['error']:
+        print('%s: %s' % (options.file, metrics['error']), file=sys.stderr)
+    print('%s: %s, %d lines, %.1f s, %.0f lines/s' % (options.file, metrics['state'], metrics['lines_acked'],
+                                                      metrics['elapsed'], metrics['lines_per_second']))
+    return 0 if metrics['state'] == streamer.DONE else 1
+
+
+def cmd_config(session, options):
+    import tempfile
+    local = options.file or os.path.join(tempfile.mkdtemp(), 'config.txt')
+    if not session.download('/sd/config.txt', local):
+        print('config.txt: download failed', file=sys.stderr)
+        return 1
+    if not options.file:
+        with open(local, 'r', errors='ignore') as f:
+            sys.stdout.write(f.read())
+    return 0
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='carveracontroller', description='Headless Carvera client')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def command(name, help):
+        sub = commands.add_parser(name, help=help)
+        sub.add_argument('address', help='ip[:port], or the serial port with --usb')
+        sub.add_argument('--usb', action='store_true', help='connect over USB serial')
+        sub.add_argument('--timeout', type=float, default=CONNECT_TIMEOUT, help='s to wait for the machine')
+        return sub
+
+    command('connect', 'check the machine answers')
+    sub = command('status', 'print the machine status')
+    sub.add_argument('--watch', action='store_true', help='keep printing until Ctrl-C')
+    sub = command('upload', 'send a file')
+    sub.add_argument('file')
+    sub.add_argument('remote_dir', nargs='?', default=REMOTE_DIR)
+    sub.add_argument('--lz', action='store_true', help='send compressed, for firmware with ftype lz')
+    sub = command('download', 'fetch a file')
+    sub.add_argument('remote')
+    sub.add_argument('file', nargs='?')
+    sub = command('play', 'run a file on the machine')
+    sub.add_argument('remote')
+    sub.add_argument('--watch', action='store_true', help='print progress until the job is over')
+    sub = command('stream', 'send a local G-code file line by line, without uploading it')
+    sub.add_argument('file')
+    sub = command('config', 'dump config.txt to FILE or stdout')
+    sub.add_argument('file', nargs='?')
+    return parser
+
+
+def main(argv=None):
+    options = parser().parse_args(argv)
+    session = connect(options)
+    if session is None:
+        return 2
+    try:
+        status = globals()['cmd_' + options.command](session, options)
+        # close() forgets queued commands, let a play and the like go out first
+        if not session.controller.sender.drain():
+            print('%s: queued commands not sent' % options.address, file=sys.stderr)
+            status = status or 1
+        return status
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
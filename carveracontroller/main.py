@@ -1,6 +1,4 @@
 import os
-import quicklz
-import struct
 
 # import os
 # os.environ["KIVY_METRICS_DENSITY"] = '1'
@@ -159,6 +157,7 @@ except ImportError:
 
 from functools import partial
 from .WIFIStream import MachineDetector
+from .MachineRegistry import MachineRegistry
 from kivy.core.window import Window
 from kivy.core.text import LabelBase
 from kivy.resources import resource_add_path
@@ -197,8 +196,17 @@ from . import Utils
 from kivy.config import ConfigParser
 from .CNC import CNC
 from .GcodeViewer import GCodeViewer
+from .ConsoleBuffer import ConsoleBuffer
+from .Telemetry import TelemetryRecorder
+from .TransferJournal import TransferJournal
+from . import LzCodec
+from .LzCache import LzCache
+from .TransferPlanner import TransferPlanner
+from .TransferQueue import TransferQueue, UPLOAD, QUEUED, RUNNING, DONE, FAILED
+from .Fingerprint import FingerprintService
+from .RemoteIndex import RemoteIndex, parse_md5_reply
 from .Controller import Controller, NOT_CONNECTED, STATECOLOR, STATECOLORDEF,\
-    LOAD_DIR, LOAD_MV, LOAD_RM, LOAD_MKDIR, LOAD_WIFI, LOAD_CONN_WIFI, CONN_USB, CONN_WIFI, SEND_FILE
+    LOAD_DIR, LOAD_MV, LOAD_RM, LOAD_MKDIR, LOAD_WIFI, LOAD_CONN_WIFI, LOAD_MD5, CONN_USB, CONN_WIFI, SEND_FILE
 from .__version__ import __version__
 
 from kivy.lang import Builder
@@ -878,6 +886,9 @@ class CNCWorkspace(Widget):
             self.bg_rect = Rectangle(pos=self.pos, size=self.size, source = self.bg_image)
 
             app = App.get_running_app()
+            # machine reported fields from one report, CNC.vars until the controller exists
+            controller = getattr(app.root, 'controller', None)
+            snap = controller.snapshot if controller is not None else CNC.vars
             if self.bg_image == "" or self.bg_image == "None":
                 Color(50 / 255, 50 / 255, 50 / 255, 1)
                 if not app.has_4axis:
@@ -930,20 +941,20 @@ class CNCWorkspace(Widget):
                     #              self.x + (CNC.vars['rotation_offset_x'] + CNC.vars['anchor_width']) * zoom, self.y + (CNC.vars['rotation_offset_y'] + CNC.vars['anchor_width'] + 5) * zoom], width=1)
 
 
-            laser_x = CNC.vars['laser_module_offset_x'] if CNC.vars['lasermode'] else 0.0
-            laser_y = CNC.vars['laser_module_offset_y'] if CNC.vars['lasermode'] else 0.0
+            laser_x = CNC.vars['laser_module_offset_x'] if snap['lasermode'] else 0.0
+            laser_y = CNC.vars['laser_module_offset_y'] if snap['lasermode'] else 0.0
 
             # origin
             Color(52/255, 152/255, 219/255, 1)
-            origin_x = CNC.vars['wcox'] - CNC.vars['anchor1_x'] + CNC.vars['anchor_width'] + laser_x
-            origin_y = CNC.vars['wcoy'] - CNC.vars['anchor1_y'] + CNC.vars['anchor_width'] + laser_y
+            origin_x = snap['wcox'] - CNC.vars['anchor1_x'] + CNC.vars['anchor_width'] + laser_x
+            origin_y = snap['wcoy'] - CNC.vars['anchor1_y'] + CNC.vars['anchor_width'] + laser_y
             Ellipse(pos=(self.x + origin_x * zoom - 10, self.y + origin_y * zoom - 10), size=(20, 20))
 
             # work area
             Color(0, 0.8, 0, 1)
             PushMatrix()
             Translate(self.x + origin_x * zoom, self.y + origin_y * zoom)
-            Rotate(angle=CNC.vars['rotation_angle'])  # Use degrees directly
+            Rotate(angle=snap['rotation_angle'])  # Use degrees directly
             Line(width=(2 if self.config['margin']['active'] else 1), 
                  rectangle=(CNC.vars['xmin'] * zoom, CNC.vars['ymin'] * zoom,
                            (CNC.vars['xmax'] - CNC.vars['xmin']) * zoom, 
@@ -962,7 +973,7 @@ class CNCWorkspace(Widget):
                 
                 PushMatrix()
                 Translate(self.x + origin_x * zoom, self.y + origin_y * zoom)
-                Rotate(angle=CNC.vars['rotation_angle'])
+                Rotate(angle=snap['rotation_angle'])
                 Ellipse(pos=(zprobe_x * zoom - 7.5, zprobe_y * zoom - 7.5), size=(15, 15))
                 PopMatrix()
 
@@ -971,7 +982,7 @@ class CNCWorkspace(Widget):
                 Color(244/255, 208/255, 63/255, 1)
                 PushMatrix()
                 Translate(self.x + origin_x * zoom, self.y + origin_y * zoom)
-                Rotate(angle=CNC.vars['rotation_angle'])
+                Rotate(angle=snap['rotation_angle'])
                 for x in Utils.xfrange(self.config['leveling']['xn_offset'], CNC.vars['xmax'] - CNC.vars['xmin'] - self.config['leveling']['xp_offset'], self.config['leveling']['x_points']):
                     for y in Utils.xfrange(self.config['leveling']['yn_offset'], CNC.vars['ymax'] - CNC.vars['ymin']-self.config['leveling']['yp_offset'], self.config['leveling']['y_points']):
                         Ellipse(pos=((CNC.vars['xmin'] + x) * zoom - 5, (CNC.vars['ymin'] + y) * zoom - 5), size=(10, 10))
@@ -1361,6 +1372,63 @@ class ManualRV(RecycleView):
 
     def __init__(self, **kwargs):
         super(ManualRV, self).__init__(**kwargs)
+        self.console = ConsoleBuffer()
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.searching = False
+        self.flush_trigger = Clock.create_trigger(self.flush_lines)
+
+    def set_spill_dir(self, spill_dir):
+        self.console.close()
+        self.console = ConsoleBuffer(spill_dir)
+
+    # can be called from any thread, the view is refreshed once per frame
+    def append_line(self, text, color):
+        self.console.append(text, color)
+        with self.pending_lock:
+            self.pending.append({'text': text, 'color': color})
+        self.flush_trigger()
+
+    def flush_lines(self, *args):
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = []
+        if not pending or self.searching:
+            return
+        overflow = len(self.data) + len(pending) - self.console.capacity
+        if overflow >= len(self.data):
+            self.data = pending[-self.console.capacity:]
+        else:
+            if overflow > 0:
+                del self.data[:overflow]
+            self.data.extend(pending)
+
+    def clear_lines(self):
+        with self.pending_lock:
+            self.pending = []
+        self.console.clear()
+        self.searching = False
+        self.data = []
+
+    def search_lines(self, needle):
+        if not needle:
+            self.searching = False
+            self.data = [{'text': text, 'color': color} for text, color in self.console.visible()]
+            return
+        self.searching = True
+        threading.Thread(target=self.do_search, args=(needle,), daemon=True).start()
+
+    def do_search(self, needle):
+        found = self.console.search(needle)
+        Clock.schedule_once(partial(self.show_search, needle, found), 0)
+
+    def show_search(self, needle, found, *args):
+        if not self.searching:
+            return
+        data = [{'text': text, 'color': color} for text, color in found]
+        data.append({'text': tr._('%d lines match "%s", type "search" to return') % (len(found), needle),
+                     'color': (200/255, 200/255, 200/255, 1)})
+        self.data = data
 
 
 class TopBar(BoxLayout):
@@ -1445,6 +1513,7 @@ class Makera(RelativeLayout):
     coord_config = {}
 
     progress_info = StringProperty()
+    transfer_status = StringProperty('')
     selected_file_line_count = NumericProperty(0)
 
     test_line = NumericProperty(1)
@@ -1455,13 +1524,24 @@ class Makera(RelativeLayout):
     uploading = False
     uploading_size = 0
     uploading_file = ''
+    uploading_origin = ''       # the file picked for upload, uploading_file may be its .lz version
+    uploading_stream = None     # CompressingReader while a .lz file is compressed during upload
+    upload_plan = None          # TransferPlanner decision for the current upload
+    md5_query = None            # (remote path, callback(md5)) of a pending md5sum
+    loading_dir_complete = False
+    upload_started = 0
+    decomp_started = 0
 
     downloading = False
     downloading_size = 0
     downloading_file = ''
     downloading_config = False
 
+    transfer_job = None         # TransferQueue job being worked on
+    transfer_lock = threading.Lock()
+
     setting_list = {}
+    machine_name = ''           # wifi.machine_name of the connected machine, see machine_key()
     setting_type_list = {}
     setting_default_list = {}
     setting_change_list = {}
@@ -1526,6 +1606,9 @@ class Makera(RelativeLayout):
     }
 
     status_index = 0
+    shown_status_index = -1
+    shown_lasering = None
+    shown_snapshot = None  # MachineSnapshot last shown by updateStatus
     past_machine_addr = None
     allow_mdi_while_machine_running = "0"
 
@@ -1533,14 +1616,50 @@ class Makera(RelativeLayout):
         super(Makera, self).__init__()
 
         self.temp_dir = tempfile.mkdtemp()
+        self.manual_rv.set_spill_dir(os.path.join(self.temp_dir, 'console'))
         self.ctl_version_old = ctl_version
         self.file_popup = FilePopup()
 
         self.cnc = CNC()
         self.controller = Controller(self.cnc, self.execCallback)
+        try:
+            self.controller.recorder = TelemetryRecorder(os.path.join(App.get_running_app().user_data_dir, 'telemetry'))
+        except:
+            print(sys.exc_info()[1])
+        try:
+            self.lz_cache = LzCache(os.path.join(App.get_running_app().user_data_dir, 'lzcache'))
+        except:
+            self.lz_cache = None
+            print(sys.exc_info()[1])
+        try:
+            self.fingerprints = FingerprintService(os.path.join(App.get_running_app().user_data_dir, 'fingerprints.json'))
+        except:
+            self.fingerprints = FingerprintService()
+            print(sys.exc_info()[1])
+        try:
+            self.remote_index = RemoteIndex(os.path.join(App.get_running_app().user_data_dir, 'remote_index.json'))
+        except:
+            self.remote_index = RemoteIndex()
+            print(sys.exc_info()[1])
+        try:
+            self.transfer_planner = TransferPlanner(os.path.join(App.get_running_app().user_data_dir, 'transfers'))
+        except:
+            self.transfer_planner = None
+            print(sys.exc_info()[1])
+        try:
+            self.machine_detector = MachineDetector(MachineRegistry(os.path.join(App.get_running_app().user_data_dir, 'machines.json')))
+        except:
+            print(sys.exc_info()[1])
+        queue_args = dict(run=self.runTransfer, ready=self.transferReady, cancel=self.cancelProcessingFile, machine=self.machine_key,
+                          changed=lambda: Clock.schedule_once(self.updateTransferStatus, 0))
+        try:
+            self.transfer_queue = TransferQueue(os.path.join(App.get_running_app().user_data_dir, 'transfer_queue.json'), **queue_args)
+        except:
+            self.transfer_queue = TransferQueue(**queue_args)
+            print(sys.exc_info()[1])
+        self.transfer_queue.start()
         # Fill basic global variables
-        CNC.vars["state"] = NOT_CONNECTED
-        CNC.vars["color"] = STATECOLOR[NOT_CONNECTED]
+        self.controller.setState(NOT_CONNECTED)
 
         self.coord_config = {
             'origin': {
@@ -1636,6 +1755,7 @@ class Makera(RelativeLayout):
         self.wifi_event = lambda instance, x: self.openWIFI(x)
 
         self.heartbeat_time = 0
+        self.jog_keys_down = set()  # keyboard jog keys held
         self.file_just_loaded = False
 
         self.show_update = (Config.get('carvera', 'show_update') == '1')
@@ -1654,6 +1774,12 @@ class Makera(RelativeLayout):
         # status switch timer
         Clock.schedule_interval(self.switch_status, 8)
 
+        Window.bind(on_minimize=self.on_window_minimize, on_restore=self.on_window_restore)
+        # a key up can get lost with the focus, stop keyboard jogging then
+        Window.bind(focus=self.on_window_focus)
+        for popup in self._popups():
+            popup.bind(on_open=self.stop_keyboard_jog)
+
         self.has_onscreen_keyboard = False
         if sys.platform == "ios":
             self.has_onscreen_keyboard = True
@@ -1664,6 +1790,9 @@ class Makera(RelativeLayout):
     def __del__(self):
         # Cleanup the temporary directory when the app is closed
         try:
+            self.manual_rv.console.close()
+            if self.controller.recorder:
+                self.controller.recorder.close()
             shutil.rmtree(self.temp_dir)
         except Exception as e:
             print(f"Error cleaning up temporary directory: {e}")
@@ -1806,6 +1935,7 @@ class Makera(RelativeLayout):
     # -----------------------------------------------------------------------
     def apply(self, buffer = False):
         app = App.get_running_app()
+        snap = self.controller.snapshot
 
         goto_origin = False
         apply_margin = self.coord_config['margin']['active']
@@ -1815,8 +1945,8 @@ class Makera(RelativeLayout):
         if app.has_4axis:
             goto_origin = True
         elif not apply_margin and not apply_zprobe and not apply_leveling:
-            if CNC.vars['wx'] < CNC.vars['xmin'] or CNC.vars['wx'] > CNC.vars['xmax'] or CNC.vars['wy'] < CNC.vars['ymin'] \
-                    or CNC.vars['wy'] > CNC.vars['ymax']:
+            if snap['wx'] < CNC.vars['xmin'] or snap['wx'] > CNC.vars['xmax'] or snap['wy'] < CNC.vars['ymin'] \
+                    or snap['wy'] > CNC.vars['ymax']:
                 goto_origin = True
 
         zprobe_abs = False
@@ -1837,7 +1967,7 @@ class Makera(RelativeLayout):
 
         # change back to last tool if needed
         if buffer and self.upcoming_tool == 0 and (apply_margin or apply_zprobe or apply_leveling):
-            self.controller.bufferChangeToolCommand(CNC.vars["tool"])
+            self.controller.bufferChangeToolCommand(snap["tool"])
 
 
     # -----------------------------------------------------------------------
@@ -1845,6 +1975,7 @@ class Makera(RelativeLayout):
         origin_x = self.coord_config['origin']['x_offset']
         origin_y = self.coord_config['origin']['y_offset']
         app = App.get_running_app()
+        snap = self.controller.snapshot
         if not app.has_4axis:
             if self.coord_config['origin']['anchor'] == 1:
                 origin_x += CNC.vars['anchor1_x']
@@ -1853,8 +1984,8 @@ class Makera(RelativeLayout):
                 origin_x += CNC.vars['anchor1_x'] + CNC.vars['anchor2_offset_x']
                 origin_y += CNC.vars['anchor1_y'] + CNC.vars['anchor2_offset_y']
             else:
-                origin_x += CNC.vars['mx']
-                origin_y += CNC.vars['my']
+                origin_x += snap['mx']
+                origin_y += snap['my']
         else:
             origin_x += CNC.vars['anchor1_x'] + CNC.vars['rotation_offset_x']
             origin_y += CNC.vars['anchor1_y'] + CNC.vars['rotation_offset_y']
@@ -1912,6 +2043,11 @@ class Makera(RelativeLayout):
             self.file_just_loaded = False
             return
 
+        # the controller is relinking itself, don't drop the connection
+        if self.controller.reconnecting:
+            self.heartbeat_time = time.time()
+            return
+
         if time.time() - self.heartbeat_time > HEARTBEAT_TIMEOUT and self.controller.stream:
             self.controller.close()
             self.controller.log.put((Controller.MSG_ERROR, 'ALARM: ' + tr._('Timeout, Connection lost!')))
@@ -1922,6 +2058,27 @@ class Makera(RelativeLayout):
         self.status_index = self.status_index + 1
         if self.status_index >= 6:
             self.status_index = 0
+        if self.controller.stream and CNC.vars["state"] != NOT_CONNECTED:
+            self.status_data_view.minr_text = self.connection_text()
+
+    # -----------------------------------------------------------------------
+    def connection_text(self):
+        text = 'WiFi' if self.controller.connection_type == CONN_WIFI else 'USB'
+        if self.controller.poller.rtt_avg is not None:
+            text += ' {:.0f}ms'.format(self.controller.poller.rtt_avg * 1000)
+        return text
+
+    # -----------------------------------------------------------------------
+    def on_window_minimize(self, *args):
+        self.controller.poller.visible = False
+        self.stop_keyboard_jog()
+
+    def on_window_focus(self, instance, focused):
+        if not focused:
+            self.stop_keyboard_jog()
+
+    def on_window_restore(self, *args):
+        self.controller.poller.visible = True
 
     # -----------------------------------------------------------------------
     def open_comports_drop_down(self, button):
@@ -2069,42 +2226,46 @@ class Makera(RelativeLayout):
     # -----------------------------------------------------------------------
     def reconnect_wifi_conn(self, button):
         if self.past_machine_addr:
-            if not self.machine_detector.is_machine_busy(self.past_machine_addr):
-                self.openWIFI(self.past_machine_addr)
-            else: 
-                Clock.schedule_once(partial(self.show_message_popup, tr._("Cannot connect, machine is busy or not availiable."), False), 0)
+            threading.Thread(target=self.doReconnectWIFI, args=(self.past_machine_addr,)).start()
         else:
             Clock.schedule_once(partial(self.show_message_popup, tr._("No previous machine network address stored."), False), 0)
             self.manually_input_ip()
 
+    def doReconnectWIFI(self, address):
+        if not self.machine_detector.is_machine_busy(address):
+            Clock.schedule_once(lambda dt: self.openWIFI(address), 0)
+        else:
+            Clock.schedule_once(partial(self.show_message_popup, tr._("Cannot connect, machine is busy or not availiable."), False), 0)
+
     def open_wifi_conn_drop_down(self, button):
         self.wifi_conn_drop_down.clear_widgets()
-        btn = MachineButton(text=tr._('Searching for nearby machines...'), size_hint_y=None, height='35dp',
-                            color=(180 / 255, 180 / 255, 180 / 255, 1))
-        self.wifi_conn_drop_down.add_widget(btn)
         self.wifi_conn_drop_down.open(button)
-        self.machine_detector.query_for_machines()
-        Clock.schedule_interval(self.load_machine_list, 0.1)
+        self.wifi_conn_drop_down.unbind(on_select=self.wifi_event)
+        self.wifi_conn_drop_down.bind(on_select=self.wifi_event)
+        # known machines show at once, discovery updates the list as machines answer
+        self.machine_detector.discover(lambda machines, done: Clock.schedule_once(partial(self.load_machine_list, machines, done), 0))
 
-    def load_machine_list(self, *args):
-        machines = self.machine_detector.check_for_responses()
-        if machines is None:
-            # the MachineDetector is still waiting for responses from machines
-            return
-        Clock.unschedule(self.load_machine_list)
+    def load_machine_list(self, machines, done, *args):
         self.wifi_conn_drop_down.clear_widgets()
-        if len(machines) == 0:
+        for machine in machines:
+            if machine['seen']:
+                text = machine['machine'] + ('(Busy)' if machine['busy'] else '')
+            else:
+                text = machine['machine'] + ('(Offline)' if done else '(?)')
+            btn = MachineButton(text=text, ip=machine['ip'], port=machine['port'], busy=machine['busy'], size_hint_y=None, height='35dp')
+            if not machine['seen']:
+                btn.color = (180 / 255, 180 / 255, 180 / 255, 1)
+            btn.bind(on_release=lambda btn: self.wifi_conn_drop_down.select(btn.ip + ':' + str(btn.port)))
+            self.wifi_conn_drop_down.add_widget(btn)
+        if not done:
+            btn = MachineButton(text=tr._('Searching for nearby machines...'), size_hint_y=None, height='35dp',
+                                color=(180 / 255, 180 / 255, 180 / 255, 1))
+            self.wifi_conn_drop_down.add_widget(btn)
+        elif len(machines) == 0 or not any(machine['seen'] for machine in machines):
             btn = MachineButton(text=tr._('None found, enter address manually...'), size_hint_y=None, height='35dp',
                                 color=(225 / 255, 225 / 255, 225 / 255, 1))
             btn.bind(on_release=lambda btn: self.manually_input_ip())
             self.wifi_conn_drop_down.add_widget(btn)
-        else:
-            for machine in machines:
-                btn = MachineButton(text=machine['machine']+('(Busy)' if machine['busy'] else ''), ip=machine['ip'], port=machine['port'], size_hint_y=None, height='35dp')
-                btn.bind(on_release=lambda btn: self.wifi_conn_drop_down.select(btn.ip + ':' + str(btn.port)))
-                self.wifi_conn_drop_down.add_widget(btn)
-                self.wifi_conn_drop_down.unbind(on_select=self.wifi_event)
-                self.wifi_conn_drop_down.bind(on_select=self.wifi_event)
 
     # -----------------------------------------------------------------------
     def manually_input_ip(self):
@@ -2179,9 +2340,9 @@ class Makera(RelativeLayout):
                         self.pairing_popup.pairing_success = True
 
                     if msg == Controller.MSG_NORMAL:
-                        self.manual_rv.data.append({'text': line, 'color': (103/255, 150/255, 186/255, 1)})
+                        self.manual_rv.append_line(line, (103/255, 150/255, 186/255, 1))
                     elif msg == Controller.MSG_ERROR:
-                        self.manual_rv.data.append({'text': line, 'color': (250/255, 105/255, 102/255, 1)})
+                        self.manual_rv.append_line(line, (250/255, 105/255, 102/255, 1))
                 except:
                     print(sys.exc_info()[1])
                     break
@@ -2194,12 +2355,12 @@ class Makera(RelativeLayout):
                 else:
                     t = time.time()
                     if t - self.decomptime > 8:
-                        self.updateCompressProgress(self.fileCompressionBlocks)
+                        self.updateCompressProgress(self.fileCompressionBlocks, timed_out=True)
 
             # Update position if needed
             if self.controller.posUpdate:
-                Clock.schedule_once(self.updateStatus, 0)
                 self.controller.posUpdate = False
+                Clock.schedule_once(partial(self.updateStatus, changed=self.controller.takeStatusChanges()), 0)
 
             # change diagnose status
             self.controller.diagnosing = self.diagnose_popup.showing
@@ -2214,6 +2375,7 @@ class Makera(RelativeLayout):
                         Clock.schedule_once(partial(self.loadError, tr._('Error loading dir') + ' \'%s\'!' % (self.loading_dir)), 0)
                     elif t - self.short_load_time > SHORT_LOAD_TIMEOUT:
                         Clock.schedule_once(partial(self.loadError, tr._('Timeout loading dir') + ' \'%s\'!' % (self.loading_dir)), 0)
+                    self.loading_dir_complete = self.controller.loadEOF and not self.controller.loadERR
                     self.controller.loadNUM = 0
                     self.controller.loadEOF = False
                     self.controller.loadERR = False
@@ -2248,6 +2410,21 @@ class Makera(RelativeLayout):
                     self.controller.loadEOF = False
                     self.controller.loadERR = False
                     Clock.schedule_once(self.file_popup.remote_rv.current_dir, 0)
+            if self.controller.loadNUM == LOAD_MD5:
+                if self.controller.loadEOF or self.controller.loadERR or t - self.short_load_time > MD5_LOAD_TIMEOUT:
+                    lines = []
+                    while self.controller.load_buffer.qsize() > 0:
+                        lines.append(self.controller.load_buffer.get_nowait())
+                    md5 = parse_md5_reply(lines) if self.controller.loadEOF else None
+                    self.controller.loadNUM = 0
+                    self.controller.loadEOF = False
+                    self.controller.loadERR = False
+                    if self.md5_query:
+                        path, then = self.md5_query
+                        self.md5_query = None
+                        if md5:
+                            self.remote_index.set_md5(self.machine_key(), path, md5)
+                        Clock.schedule_once(partial(then, md5), 0)
             if self.controller.loadNUM == LOAD_WIFI:
                 if self.controller.loadEOF or self.controller.loadERR or t - self.wifi_load_time > WIFI_LOAD_TIMEOUT:
                     if self.controller.loadERR:
@@ -2389,25 +2566,86 @@ class Makera(RelativeLayout):
     # -----------------------------------------------------------------------
     def check_and_upload(self):
         filepath = self.file_popup.local_rv.curr_selected_file
+        self.check_remote_copy(filepath, partial(self.confirm_upload, filepath, None), self.upload_not_needed)
+
+    # -----------------------------------------------------------------------
+    def confirm_upload(self, filepath, callback, exists):
         filename = os.path.basename(os.path.normpath(filepath))
-        if len(list(filter(lambda person: person['filename'] == filename, self.file_popup.remote_rv.data))) > 0:
+        if exists:
             # show message popup
             self.confirm_popup.lb_title.text = tr._('File Already Exists')
             self.confirm_popup.lb_content.text = tr._('Confirm to overwrite file:') + ' \n \'%s\'?' % (filename)
             self.confirm_popup.cancel = None
-            self.confirm_popup.confirm = partial(self.uploadLocalFile, filepath)
+            self.confirm_popup.confirm = partial(self.uploadLocalFile, filepath, callback)
+            self.confirm_popup.open(self)
+        elif self.file_popup.firmware_mode and not callback:
+            # show message popup
+            self.confirm_popup.lb_title.text = tr._('Updating Firmware')
+            self.confirm_popup.lb_content.text = tr._('Reset the machine when uploading is complete.')
+            self.confirm_popup.cancel = None
+            self.confirm_popup.confirm = partial(self.uploadLocalFile, filepath, callback)
             self.confirm_popup.open(self)
         else:
-            if self.file_popup.firmware_mode:
-                # show message popup
-                self.confirm_popup.lb_title.text = tr._('Updating Firmware')
-                self.confirm_popup.lb_content.text = tr._('Reset the machine when uploading is complete.')
-                self.confirm_popup.cancel = None
-                self.confirm_popup.confirm = partial(self.uploadLocalFile, filepath)
-                self.confirm_popup.open(self)
+            self.uploadLocalFile(filepath, callback)
+
+    # -----------------------------------------------------------------------
+    # Look the local file up in the remote index before sending it.
+    # upload(exists) is called when it has to be sent, same(filepath,
+    # remote_path) when the machine already holds this content under the
+    # same name. md5sum is only asked for a same named file of the same size
+    # whose md5 the index does not know yet.
+    # -----------------------------------------------------------------------
+    def check_remote_copy(self, filepath, upload, same):
+        filename = os.path.basename(os.path.normpath(filepath))
+        exists = len(list(filter(lambda person: person['filename'] == filename, self.file_popup.remote_rv.data))) > 0
+        fp = self.fingerprints.lookup(filepath)
+        if fp is None or self.file_popup.firmware_mode:
+            upload(exists)
+            return
+        machine = self.machine_key()
+        remote_path = os.path.join(self.file_popup.remote_rv.curr_dir, filename)
+        if exists:
+            entry = self.remote_index.lookup(machine, remote_path)
+            if self.remote_index.same(machine, remote_path, fp.size, fp.md5):
+                same(filepath, remote_path)
+            elif entry and entry[0] == fp.size and entry[2] is None:
+                self.queryRemoteMd5(remote_path, lambda md5, *args: same(filepath, remote_path) if md5 == fp.md5 else upload(True))
             else:
-                self.uploadLocalFile(filepath)
+                upload(True)
+            return
+        copies = self.remote_index.find(machine, fp.md5, fp.size)
+        if copies:
+            self.confirm_popup.lb_title.text = tr._('Identical File Exists')
+            self.confirm_popup.lb_content.text = tr._('The same content is already on the machine as:') + \
+                                                 ' \n \'%s\'\n' % copies[0] + tr._('Upload anyway?')
+            self.confirm_popup.cancel = None
+            self.confirm_popup.confirm = partial(upload, False)
+            self.confirm_popup.open(self)
+        else:
+            upload(False)
 
+    # -----------------------------------------------------------------------
+    # Put a local file where a download of remote_path would be cached
+    # -----------------------------------------------------------------------
+    def cache_local_copy(self, filepath, remote_path):
+        remote_post_path = remote_path.replace('/sd/', '').replace('\\sd\\', '')
+        local_path = os.path.join(self.temp_dir, remote_post_path)
+        if os.path.abspath(filepath) != os.path.abspath(local_path):
+            cached = self.fingerprints.lookup(local_path)
+            if cached is None or cached.md5 != self.fingerprints.md5(filepath):
+                if not os.path.exists(os.path.dirname(local_path)):
+                    os.makedirs(os.path.dirname(local_path))
+                shutil.copyfile(filepath, local_path)
+        return local_path
+
+    # -----------------------------------------------------------------------
+    def upload_not_needed(self, filepath, remote_path):
+        self.cache_local_copy(filepath, remote_path)
+        self.update_recent_local_dir_list(os.path.dirname(filepath))
+        self.controller.log.put((Controller.MSG_NORMAL, tr._('File already on the machine, upload skipped:') + ' %s' % remote_path))
+        self.show_message_popup(tr._('Identical file already on the machine, upload skipped.'), False)
+
+    # -----------------------------------------------------------------------
     def select_file(self, remote_path, local_cached_file_path):
         """Select a file that is already present both locally and remotely"""
         app = App.get_running_app()
@@ -2418,18 +2656,16 @@ class Makera(RelativeLayout):
         Clock.schedule_once(partial(self.progressUpdate, 0, tr._('Loading file') + ' \n%s' % app.selected_local_filename, True), 0)
         self.load_selected_gcode_file()
 
+    # -----------------------------------------------------------------------
     def check_upload_and_select(self):
         filepath = self.file_popup.local_rv.curr_selected_file
-        filename = os.path.basename(os.path.normpath(filepath))
-        if len(list(filter(lambda person: person['filename'] == filename, self.file_popup.remote_rv.data))) > 0:
-            # show message popup
-            self.confirm_popup.lb_title.text = tr._('File Already Exists')
-            self.confirm_popup.lb_content.text = tr._('Confirm to overwrite file:') + ' \n \'%s\'?' % (filename)
-            self.confirm_popup.cancel = None
-            self.confirm_popup.confirm = partial(self.uploadLocalFile, filepath, self.select_file)
-            self.confirm_popup.open(self)
-        else:
-            self.uploadLocalFile(filepath, self.select_file)
+        self.check_remote_copy(filepath, partial(self.confirm_upload, filepath, self.select_file), self.select_remote_copy)
+
+    # -----------------------------------------------------------------------
+    def select_remote_copy(self, filepath, remote_path):
+        local_path = self.cache_local_copy(filepath, remote_path)
+        self.progressStart(tr._('Loading file') + ' \n%s' % local_path, None)
+        threading.Thread(target=self.select_file, args=(remote_path, local_path)).start()
 
     # -----------------------------------------------------------------------
     def view_local_file(self):
@@ -2454,6 +2690,9 @@ class Makera(RelativeLayout):
 
     # -----------------------------------------------------------------------
     def check_and_download(self):
+        if not self.claim_transfer(False):
+            self.show_message_popup(tr._('A queued transfer is running, try again when it is done.'), False)
+            return
         remote_path = self.file_popup.remote_rv.curr_selected_file
         remote_size = self.file_popup.remote_rv.curr_selected_filesize
         remote_post_path = remote_path.replace('/sd/', '').replace('\\sd\\', '')
@@ -2466,16 +2705,56 @@ class Makera(RelativeLayout):
         self.downloading_file = remote_path
         self.downloading_size = remote_size
         self.downloading_config = False
-        threading.Thread(target=self.doDownload).start()
+        if self.find_cached_download(remote_path, remote_size, local_path):
+            self.downloading = False
+            self.progressStart(tr._('Open cached file') + ' \n%s' % local_path, None)
+            threading.Thread(target=self.openCachedFile).start()
+        else:
+            threading.Thread(target=self.doDownload).start()
+
+    # -----------------------------------------------------------------------
+    # True if local_path holds the content the remote index knows for
+    # remote_path, copying it from the cached download of an identical
+    # remote file when needed
+    # -----------------------------------------------------------------------
+    def find_cached_download(self, remote_path, remote_size, local_path):
+        machine = self.machine_key()
+        md5 = self.remote_index.md5(machine, remote_path)
+        if not md5 or not self.remote_index.same(machine, remote_path, remote_size, md5):
+            return False
+        fp = self.fingerprints.lookup(local_path)
+        if fp and fp.md5 == md5:
+            return True
+        for other in self.remote_index.find(machine, md5, remote_size):
+            other_path = os.path.join(self.temp_dir, other.replace('/sd/', ''))
+            other_fp = self.fingerprints.lookup(other_path)
+            if other_fp and other_fp.md5 == md5 and other_path != local_path:
+                try:
+                    if not os.path.exists(os.path.dirname(local_path)):
+                        os.makedirs(os.path.dirname(local_path))
+                    shutil.copyfile(other_path, local_path)
+                except:
+                    print(sys.exc_info()[1])
+                    return False
+                return True
+        return False
+
+    # -----------------------------------------------------------------------
+    def openCachedFile(self):
+        self.load_selected_gcode_file()
+        self.update_recent_remote_dir_list(os.path.dirname(self.downloading_file))
 
     # -----------------------------------------------------------------------
     def download_config_file(self):
+        if not self.claim_transfer(False):
+            return False
         app = App.get_running_app()
         app.selected_local_filename = os.path.join(self.temp_dir, 'config.txt')
         self.downloading_file = '/sd/config.txt'
         self.downloading_size = 1024 * 5
         self.downloading_config = True
         threading.Thread(target=self.doDownload).start()
+        return True
 
     # -----------------------------------------------------------------------
     def finishLoadConfig(self, success, *args):
@@ -2499,6 +2778,7 @@ class Makera(RelativeLayout):
                     except AttributeError:
                         Clock.schedule_once(partial(self.load_error, tr._('Error loading machine config setting. Possibly malformed value.\nSkipping setting key: ') + str(key)), 0)
             
+            self.machine_name = self.setting_list.get('wifi.machine_name') or ''
             self.load_coordinates()
             self.load_laser_offsets()
             self.setting_change_list = {}
@@ -2515,53 +2795,76 @@ class Makera(RelativeLayout):
         self.updateStatus()
 
     # -----------------------------------------------------------------------
-    def doDownload(self):
+    def doDownload(self, job=None):
+        # job: TransferQueue entry when run by the queue, the file is not opened then
         app = App.get_running_app()
-        if not self.downloading_config and not os.path.exists(os.path.dirname(app.selected_local_filename)):
-            #os.mkdir(os.path.dirname(app.selected_local_filename))
-            os.makedirs(os.path.dirname(app.selected_local_filename))
-        if os.path.exists(app.selected_local_filename):
-            shutil.copyfile(app.selected_local_filename, app.selected_local_filename + '.tmp')
-
-        Clock.schedule_once(partial(self.progressStart, tr._('Load config...') if self.downloading_config else (tr._('Checking') + ' \n%s' % app.selected_local_filename), \
-                                    None if self.downloading_config else self.cancelProcessingFile), 0)
+        local_filename = job['local'] if job else app.selected_local_filename
+        if not self.downloading_config and not os.path.exists(os.path.dirname(local_filename)):
+            #os.mkdir(os.path.dirname(local_filename))
+            os.makedirs(os.path.dirname(local_filename))
+        tmp_filename = local_filename + '.tmp'
+        # a .tmp with a journal is an interrupted download, keep it to resume
+        journal = TransferJournal(tmp_filename)
+        if not journal.chunks and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+        if not job:
+            Clock.schedule_once(partial(self.progressStart, tr._('Load config...') if self.downloading_config else (tr._('Checking') + ' \n%s' % local_filename), \
+                                        None if self.downloading_config else self.cancelProcessingFile), 0)
         self.downloading = True
-        download_result = False
-        try:
-            tmp_filename = app.selected_local_filename + '.tmp'
-            md5 = ''
-            if os.path.exists(tmp_filename):
-                md5 = Utils.md5(tmp_filename)
-            self.controller.downloadCommand(self.downloading_file)
-            self.controller.pauseStream(0.2)
-            download_result = self.controller.stream.download(tmp_filename, md5, self.downloadCallback)
-        except:
-            print(sys.exc_info()[1])
+        download_result = None
+        md5 = ''
+        if os.path.exists(local_filename):
+            md5 = self.fingerprints.md5(local_filename)
+        attempt = 0
+        while True:
+            broken = False
+            try:
+                self.controller.downloadCommand(self.downloading_file)
+                self.controller.pauseStream(0.2)
+                download_result = self.controller.stream.download(tmp_filename, md5, self.downloadCallback, journal)
+            except:
+                print(sys.exc_info()[1])
+                download_result = None
+                broken = True
             self.controller.resumeStream()
-            self.downloading = False
+            if download_result is not None or attempt >= TRANSFER_RETRIES or not (broken or journal.chunks):
+                break
+            attempt += 1
+            self.controller.log.put((Controller.MSG_NORMAL, tr._('Download interrupted, reconnecting...')))
+            if not self.controller.reopen():
+                break
 
-        self.controller.resumeStream()
         self.downloading = False
 
         self.heartbeat_time = time.time()
 
         if download_result is None:
-            os.remove(app.selected_local_filename + '.tmp')
+            if not journal.chunks:
+                journal.finish()
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
             # show message popup
             if self.downloading_config:
                 Clock.schedule_once(partial(self.finishLoadConfig, False), 0.1)
                 Clock.schedule_once(partial(self.show_message_popup, tr._("Download config file error!"), False), 0.2)
+            elif job:
+                self.controller.log.put((Controller.MSG_ERROR, tr._("Download file error!") + ' %s' % self.downloading_file))
             else:
                 Clock.schedule_once(partial(self.show_message_popup, tr._("Download file error!"), False), 0)
         elif download_result >= 0:
             if download_result > 0:
                 # download success
-                if os.path.exists(app.selected_local_filename):
-                    os.remove(app.selected_local_filename)
-                os.rename(app.selected_local_filename + '.tmp', app.selected_local_filename)
+                if os.path.exists(local_filename):
+                    os.remove(local_filename)
+                os.rename(local_filename + '.tmp', local_filename)
             else:
                 # MD5 same
-                os.remove(app.selected_local_filename + '.tmp')
+                os.remove(local_filename + '.tmp')
+            journal.finish()
+            self.remote_index.record(self.machine_key(), self.downloading_file,
+                                     os.path.getsize(local_filename),
+                                     self.fingerprints.md5(local_filename))
             if self.downloading_config:
                 Clock.schedule_once(partial(self.progressUpdate, 100, '', True), 0)
                 Clock.schedule_once(partial(self.finishLoadConfig, True), 0.1)
@@ -2572,8 +2875,8 @@ class Makera(RelativeLayout):
                 Clock.schedule_once(self.controller.queryVersion, 0.3)
                 self.filetype = ''
                 Clock.schedule_once(self.controller.queryFtype, 0.4)
-            else:
-                Clock.schedule_once(partial(self.progressUpdate, 0, tr._('Open cached file') + ' \n%s' % app.selected_local_filename, True), 0)
+            elif not job:
+                Clock.schedule_once(partial(self.progressUpdate, 0, tr._('Open cached file') + ' \n%s' % local_filename, True), 0)
                 # Clock.schedule_once(self.load_selected_gcode_file, 0.1)
                 self.load_selected_gcode_file()
 
@@ -2582,12 +2885,18 @@ class Makera(RelativeLayout):
 
 
         elif download_result < 0:
-            os.remove(app.selected_local_filename + '.tmp')
+            journal.finish()
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
             self.controller.log.put((Controller.MSG_NORMAL, tr._('Downloading is canceled manually.')))
             if self.downloading_config:
                 Clock.schedule_once(partial(self.finishLoadConfig, False), 0)
 
-        Clock.schedule_once(self.progressFinish, 0.1)
+        if not job:
+            Clock.schedule_once(self.progressFinish, 0.1)
+        if download_result is None:
+            return False
+        return True if download_result >= 0 else None
 
     # -----------------------------------------------------------------------
     def setUIForModel(self, model, *args):
@@ -2605,6 +2914,9 @@ class Makera(RelativeLayout):
 
     # -----------------------------------------------------------------------
     def downloadCallback(self, packet_size, success_count, error_count):
+        if self.transfer_job:
+            self.transfer_queue.progress(min(success_count * packet_size, self.downloading_size))
+            return
         packets = self.downloading_size / packet_size + (1 if self.downloading_size % packet_size > 0 else 0)
         Clock.schedule_once(partial(self.progressUpdate, success_count * 100.0 / packets, tr._('Downloading') + ' \n%s' % self.downloading_file, False), 0)
 
@@ -2711,6 +3023,27 @@ class Makera(RelativeLayout):
         self.short_load_time = time.time()
         self.controller.lsCommand(os.path.normpath(ls_dir))
 
+    # -----------------------------------------------------------------------
+    # Ask the machine for the md5 of a remote file, then(md5) is called on
+    # the UI thread with None when it could not be had
+    # -----------------------------------------------------------------------
+    def queryRemoteMd5(self, filename, then):
+        self.md5_query = (filename, then)
+        self.controller.sendNUM = 0
+        self.controller.loadNUM = LOAD_MD5
+        self.controller.loadEOF = False
+        self.controller.loadERR = False
+        self.short_load_time = time.time()
+        self.controller.md5Command(os.path.normpath(filename))
+
+    # -----------------------------------------------------------------------
+    # Key of the connected machine in the remote index
+    # -----------------------------------------------------------------------
+    def machine_key(self):
+        # the name the machine gives itself (wifi.machine_name), the same over
+        # USB and WiFi and whatever address it got; '' until the config is read
+        return self.machine_name
+
     # -----------------------------------------------------------------------
     def removeRemoteFile(self, filename):
         self.controller.sendNUM = 0
@@ -2718,6 +3051,7 @@ class Makera(RelativeLayout):
         self.controller.readEOF = False
         self.controller.readERR = False
         self.short_load_time = time.time()
+        self.remote_index.remove(self.machine_key(), filename)
         self.controller.rmCommand(os.path.normpath(filename))
 
     # -----------------------------------------------------------------------
@@ -2732,6 +3066,7 @@ class Makera(RelativeLayout):
         new_name = os.path.join(self.file_popup.remote_rv.curr_dir, self.input_popup.txt_content.text)
         if filename == new_name:
             return False
+        self.remote_index.rename(self.machine_key(), filename, new_name)
         self.controller.mvCommand(os.path.normpath(filename), os.path.normpath(new_name))
         return True
 
@@ -2772,96 +3107,49 @@ class Makera(RelativeLayout):
 
     # -----------------------------------------------------------------------
     def compress_file(self,input_filename):
+        # firmware files are sent as they are
+        if input_filename.find('.bin') != -1:
+            return input_filename
+        names = (input_filename, self.lz_filename(input_filename))
+        try:
+            self.fileCompressionBlocks = LzCodec.compress_file(*names, block_size=BLOCK_SIZE)
+            self.decompercent = 0
+            self.decompercentlast = 0
+            print(f"Compression completed. Compressed file saved as '{names[1]}'.")
+            return names[1]
+        except Exception as e:
+            print(f"Compression failed: {e}")
+            if os.path.exists(names[1]):
+                os.remove(names[1])
+            return None
+
+    # -----------------------------------------------------------------------
+    # Start compressing to .lz in the background, returns a CompressingReader
+    # delivering the compressed data as it is produced
+    # -----------------------------------------------------------------------
+    def start_compress(self,input_filename,output_filename):
         try:
-            # If the uploaded file is a firmware file, return the original filename without compression.
-            if input_filename.find('.bin') != -1:
-                return input_filename
-
-            # Check if the filename.lz is writeable
-            can_write_in_lz = os.access(input_filename + '.lz', os.W_OK)
-            if not can_write_in_lz:
-                print(f"Compression failed: Cannot write to '{input_filename}.lz', using temp dir")
-                # First copy the file to the temp dir
-                shutil.copy(input_filename, self.temp_dir)
-                input_filename = os.path.join(self.temp_dir, os.path.basename(input_filename))
-                # Then compress the file to the temp dir
-                output_filename = os.path.join(self.temp_dir, os.path.basename(input_filename) + '.lz')
-            else:
-                output_filename = input_filename + '.lz'
-            sum = 0
             self.fileCompressionBlocks = 0
             self.decompercent = 0
             self.decompercentlast = 0
-            with open(input_filename, 'rb') as f_in, open(output_filename, 'wb') as f_out:
-                while True:
-                    # Read block data
-                    block = f_in.read(BLOCK_SIZE)
-                    if not block:
-                        break
-                    # Calculate the sum
-                    for byte in block:
-                        sum += byte
-                    # Compress the block data
-                    compressed_block = quicklz.compress(block)
-
-                    # Calculate the size of the compressed data block
-                    cmprs_size = len(compressed_block)
-                    buffer_hdr = struct.pack('>I', cmprs_size)
-                    # Write the length of the compressed data block to the output file
-                    f_out.write(buffer_hdr)
-                    # Write the compressed data block to the output file
-                    f_out.write(compressed_block)
-                    self.fileCompressionBlocks += 1
-                # Write the checksum
-                sumdata = struct.pack('>H', sum & 0xffff)
-                f_out.write(sumdata)
-
-            print(f"Compression completed. Compressed file saved as '{output_filename}'.")
-            return output_filename
+            return LzCodec.CompressingReader(input_filename, output_filename, BLOCK_SIZE)
 
         except Exception as e:
             print(f"Compression failed: {e}")
-            if os.path.exists(output_filename):
-                os.remove(output_filename)
             return None
+
+    # -----------------------------------------------------------------------
+    # Where the .lz version of a file is written; always the temp dir, the
+    # source may be read-only or on a network drive
+    # -----------------------------------------------------------------------
+    def lz_filename(self,input_filename):
+        return os.path.join(self.temp_dir, os.path.basename(input_filename) + '.lz')
+
     # -----------------------------------------------------------------------
     def decompress_file(self,input_filename,output_filename):
         try:
-            # 打开输入文件和输出文件
-            sum = 0
-            read_size = 0
-            with open(input_filename, 'rb') as f_in, open(output_filename, 'wb') as f_out:
-                # 获取文件大小（以字节为单位）
-                file_size = os.path.getsize(input_filename)
-                while True:
-                    if read_size == (file_size-2):
-                        break
-                    # 读取块数据长度
-                    block = f_in.read(BLOCK_HEADER_SIZE)
-                    if not block:
-                        break
-                    blocksize = struct.unpack('>I', block)[0]
-                    read_size += BLOCK_HEADER_SIZE + blocksize
-                    # 读取块数据
-                    block = f_in.read(blocksize)
-                    # 解压缩数据
-                    decompressed_block = quicklz.decompress(block)
-                    # 计算sum和
-                    for byte in decompressed_block:
-                        sum += byte
-                    # 写入解压缩后的块数据的长度到输出文件
-                    f_out.write(decompressed_block)
-            # 判断校验和
-            with open(input_filename, 'rb') as f_in:
-                f_in.seek(-2, 2)  # 从文件末尾向前移动2个字节
-                sumfile = f_in.read(2)
-            sumfile = struct.unpack('>H', sumfile)[0]
-            sumdata = sum & 0xffff
-
-            if(sumfile != sumdata):
-                print(f"deCompress failed: sum checksum mismatch")
-                return False
-
+            # blocks are decompressed in parallel, the checksum is verified at the end
+            LzCodec.decompress_file(input_filename, output_filename)
             print(f"deCompress completed. deCompressed file saved as '{output_filename}'.")
             return True
 
@@ -2872,42 +3160,235 @@ class Makera(RelativeLayout):
             return False
     # -----------------------------------------------------------------------
     def uploadLocalFile(self, filepath, callback=None):
-        self.controller.sendNUM = SEND_FILE
+        if not self.claim_transfer(True):
+            self.show_message_popup(tr._('A queued transfer is running, try again when it is done.'), False)
+            return
         self.uploading_file = filepath
-        if 'lz' in self.filetype:               #如果固件支持的上传文件类型为.lz，则进行压缩
-            qlzfilename = self.compress_file(filepath)
-            if qlzfilename:
-                self.uploading_file = qlzfilename
+        self.uploading_stream = None
         threading.Thread(target=self.doUpload,args=(callback,)).start()
 
     # -----------------------------------------------------------------------
-    def doUpload(self, callback):
-        self.uploading_size = os.path.getsize(self.uploading_file)
-        remotename = os.path.join(self.file_popup.remote_rv.curr_dir, os.path.basename(os.path.normpath(self.uploading_file)))
-        if self.file_popup.firmware_mode:
-            remotename = '/sd/firmware.bin'
-        displayname = self.uploading_file
-        if displayname.endswith(".lz"):
-            # 删除 ".lz" 后缀
-            displayname = displayname[:-3]
-        Clock.schedule_once(partial(self.progressStart, tr._('Uploading') + '\n%s' % displayname, self.cancelProcessingFile), 0)
-        self.uploading = True
-        self.controller.pauseStream(1)
-        upload_result = None
+    # The machine has one file channel and the transfers share the
+    # uploading/downloading state: one started from the UI claims it under
+    # transfer_lock, as transferReady() does for the queue, and is refused
+    # while a queued job holds it
+    # -----------------------------------------------------------------------
+    def claim_transfer(self, upload):
+        with self.transfer_lock:
+            if self.transfer_job is not None:
+                return False
+            if upload:
+                self.controller.sendNUM = SEND_FILE
+            else:
+                self.downloading = True
+            return True
+
+    # -----------------------------------------------------------------------
+    # Background transfers: the TransferQueue worker calls transferReady()
+    # and runTransfer() from its own thread. Jobs carry the machine they
+    # were queued for and only run while that machine is connected
+    # -----------------------------------------------------------------------
+    def queue_local_folder(self):
+        if not self.machine_key():
+            self.show_message_popup(tr._('Machine config not loaded yet, try again later.'), False)
+            return
         try:
-            #md5 = Utils.md5(self.uploading_file)
-            md5 = Utils.md5(displayname)
-            self.controller.uploadCommand(os.path.normpath(remotename))
-            upload_result = self.controller.stream.upload(self.uploading_file, md5, self.uploadCallback)
+            jobs = self.transfer_queue.add_folder(self.file_popup.local_rv.curr_dir, self.file_popup.remote_rv.curr_dir,
+                                                  machine=self.machine_key())
+        except:
+            self.show_message_popup(str(sys.exc_info()[1]), False)
+            return
+        self.controller.log.put((Controller.MSG_NORMAL, tr._('Queued for upload:') + ' %d' % len(jobs)))
+
+    # -----------------------------------------------------------------------
+    def queue_remote_file(self):
+        if not self.machine_key():
+            self.show_message_popup(tr._('Machine config not loaded yet, try again later.'), False)
+            return
+        remote_path = self.file_popup.remote_rv.curr_selected_file
+        remote_post_path = remote_path.replace('/sd/', '').replace('\\sd\\', '')
+        self.transfer_queue.add_download(remote_path, os.path.join(self.temp_dir, remote_post_path),
+                                         self.file_popup.remote_rv.curr_selected_filesize, machine=self.machine_key())
+
+    # -----------------------------------------------------------------------
+    def transferReady(self, job):
+        # claims the file channel for job when it is free, see claim_transfer()
+        with self.transfer_lock:
+            if self.transfer_job is not None or self.controller.stream is None or CNC.vars["state"] != 'Idle' \
+                    or self.uploading or self.downloading or self.decompstatus \
+                    or self.controller.loadNUM != 0 or self.controller.sendNUM != 0:
+                return False
+            self.transfer_job = job
+            return True
+
+    # -----------------------------------------------------------------------
+    def runTransfer(self, job):
+        try:
+            if job['kind'] == UPLOAD:
+                self.controller.sendNUM = SEND_FILE
+                self.uploading_file = job['local']
+                self.uploading_stream = None
+                return self.doUpload(None, job)
+            self.downloading_file = job['remote']
+            self.downloading_size = job['size']
+            self.downloading_config = False
+            return self.doDownload(job)
+        finally:
+            with self.transfer_lock:
+                self.controller.sendNUM = 0
+                self.transfer_job = None
+
+    # -----------------------------------------------------------------------
+    def updateTransferStatus(self, *args):
+        stats = self.transfer_queue.stats()
+        count = stats['count']
+        if count[QUEUED] + count[RUNNING] == 0:
+            self.transfer_status = tr._('Transfers failed:') + ' %d' % count[FAILED] if count[FAILED] else ''
+            return
+        text = '%d/%d %s' % (count[DONE], count[DONE] + count[QUEUED] + count[RUNNING],
+                             Utils.humansize(stats['bytes_done']))
+        if stats['rate']:
+            text += ' %s/s' % Utils.humansize(stats['rate'])
+        if stats['eta'] is not None:
+            text += ' ' + time.strftime('%H:%M:%S', time.gmtime(stats['eta']))
+        self.transfer_status = text
+
+    # -----------------------------------------------------------------------
+    def open_transfer_queue_popup(self):
+        stats = self.transfer_queue.stats()
+        count = stats['count']
+        self.confirm_popup.cancel = None
+        if count[QUEUED] + count[RUNNING]:
+            self.confirm_popup.lb_title.text = tr._('Transfer Queue')
+            self.confirm_popup.lb_content.text = tr._('Cancel all queued transfers?') + \
+                (' \n%s' % os.path.basename(stats['current']['local']) if stats['current'] else '')
+            self.confirm_popup.confirm = partial(self.transfer_queue.cancel, None)
+        elif count[FAILED]:
+            self.confirm_popup.lb_title.text = tr._('Transfer Queue')
+            self.confirm_popup.lb_content.text = tr._('Retry failed transfers?')
+            self.confirm_popup.confirm = partial(self.transfer_queue.retry, None)
+        else:
+            return
+        self.confirm_popup.open(self)
+
+    # -----------------------------------------------------------------------
+    # Switch uploading_file to its .lz version if the planner expects that to
+    # be faster. fp is the cached Fingerprint of the source, or None when
+    # the file is new or changed. Returns the fingerprint and a
+    # CompressingReader when the file is compressed while uploading.
+    # -----------------------------------------------------------------------
+    def prepare_lz(self, fp):
+        source = self.uploading_origin
+        if source.find('.bin') != -1:
+            return fp, None
+        block_size = BLOCK_SIZE
+        if self.transfer_planner:
+            cached = bool(fp and self.lz_cache and self.lz_cache.contains(fp.md5, block_size))
+            link = 'usb' if self.controller.conn_type == CONN_USB else 'wifi'
+            try:
+                self.upload_plan = self.transfer_planner.plan(source, link, cached)
+            except:
+                print(sys.exc_info()[1])
+            if self.upload_plan and not self.upload_plan['compress']:
+                return fp, None
+        output_filename = self.lz_filename(source)
+        self.fileCompressionBlocks = 0
+        self.decompercent = 0
+        self.decompercentlast = 0
+        if fp is None:
+            # new file: only hash it here, md5 is much faster than the
+            # compression, which then overlaps with the sending below
+            try:
+                fp = self.fingerprints.scan(source)
+            except:
+                print(sys.exc_info()[1])
+                return None, None
+        if not (self.lz_cache and self.lz_cache.fetch(fp.md5, block_size, output_filename)):
+            # the sender can start while the file is compressed, doUpload
+            # stores the finished .lz in the cache
+            self.uploading_stream = self.start_compress(source, output_filename)
+            if self.uploading_stream:
+                self.uploading_file = output_filename
+            return fp, self.uploading_stream
+        self.uploading_file = output_filename
+        self.fileCompressionBlocks = (fp.size + block_size - 1) // block_size
+        return fp, None
+
+    # -----------------------------------------------------------------------
+    def doUpload(self, callback, job=None):
+        # job: TransferQueue entry when run by the queue, without progress popups
+        displayname = self.uploading_origin = self.uploading_file
+        firmware = self.file_popup.firmware_mode and not job
+        if not job:
+            Clock.schedule_once(partial(self.progressStart, tr._('Uploading') + '\n%s' % displayname, self.cancelProcessingFile), 0)
+        reader = None
+        self.upload_plan = None
+        self.upload_started = time.time()
+        fp = self.fingerprints.lookup(displayname)
+        if 'lz' in self.filetype:               #如果固件支持的上传文件类型为.lz，则进行压缩
+            fp, reader = self.prepare_lz(fp)
+        md5 = ''
+        try:
+            md5 = (fp or self.fingerprints.scan(displayname)).md5
         except:
             self.controller.log.put((Controller.MSG_ERROR, str(sys.exc_info()[1])))
+        self.uploading_size = reader.size_hint() if reader else os.path.getsize(self.uploading_file)
+        remote_dir = job['remote'].rsplit('/', 1)[0] if job else self.file_popup.remote_rv.curr_dir
+        remotename = os.path.join(remote_dir, os.path.basename(os.path.normpath(self.uploading_file)))
+        if firmware:
+            remotename = '/sd/firmware.bin'
+        self.uploading = True
+        # without an md5 (the file could not be read) there is nothing to send
+        upload_result = None if md5 else False
+        journal = TransferJournal(self.uploading_file)
+        attempt = 0
+        sending_started = time.time()
+        while md5:
+            broken = False
+            self.controller.pauseStream(1)
+            try:
+                self.controller.uploadCommand(os.path.normpath(remotename))
+                upload_result = self.controller.stream.upload(self.uploading_file, md5, self.uploadCallback, journal,
+                                                              source = reader if attempt == 0 else None)
+            except:
+                self.controller.log.put((Controller.MSG_ERROR, str(sys.exc_info()[1])))
+                upload_result = False
+                broken = True
             self.controller.resumeStream()
-            self.uploading = False
+            # retry only when the connection broke or there is confirmed data to continue from
+            if upload_result is not False or attempt >= TRANSFER_RETRIES or not (broken or journal.chunks):
+                break
+            attempt += 1
+            self.controller.log.put((Controller.MSG_NORMAL, tr._('Upload interrupted, reconnecting...')))
+            # retries read the finished .lz file; detach the reader first, the
+            # worker would otherwise wait for room in its queue forever
+            if reader:
+                reader.close()
+                if reader.wait() is None:
+                    break
+            if not self.controller.reopen():
+                break
+        # a failed upload keeps its journal (and its .lz, which is the same
+        # for the same content), so a retry by the queue continues from there
+        if upload_result is not False:
+            journal.finish()
+        sending_time = time.time() - sending_started
+        if reader:
+            if upload_result is None:
+                reader.cancel()
+            else:
+                reader.close()
+            if reader.wait() and self.lz_cache:
+                self.lz_cache.store(md5, reader.block_size, reader.output_filename)
+            self.fileCompressionBlocks = reader.blocks
+            self.uploading_stream = None
+        if upload_result and attempt == 0 and self.transfer_planner:
+            self.learn_upload(reader, sending_time)
 
-        self.controller.resumeStream()
         self.uploading = False
 
-        Clock.schedule_once(self.progressFinish, 0)
+        if not job:
+            Clock.schedule_once(self.progressFinish, 0)
 
         self.heartbeat_time = time.time()
 
@@ -2917,29 +3398,20 @@ class Makera(RelativeLayout):
             if self.uploading_file.endswith('.lz'):
                 os.remove(self.uploading_file)
         elif not upload_result:
-            # 如果为压缩后的'.lz'文件则删除该文件
-            if self.uploading_file.endswith('.lz'):
-                os.remove(self.uploading_file)
             # show message popup
-            Clock.schedule_once(partial(self.show_message_popup, tr._("Upload file error!"), False), 0)
+            if job:
+                self.controller.log.put((Controller.MSG_ERROR, tr._("Upload file error!") + ' %s' % displayname))
+            else:
+                Clock.schedule_once(partial(self.show_message_popup, tr._("Upload file error!"), False), 0)
         else:
             # copy file to application directory if needed
-            remote_path = os.path.join(self.file_popup.remote_rv.curr_dir, os.path.basename(os.path.normpath(self.uploading_file)))
-            remote_post_path = remote_path.replace('/sd/', '').replace('\\sd\\', '')
+            remote_post_path = remotename.replace('/sd/', '').replace('\\sd\\', '')
             local_path = os.path.join(self.temp_dir, remote_post_path)
-            if self.uploading_file != local_path and not self.file_popup.firmware_mode:
+            if self.uploading_file != local_path and not firmware:
                 if self.uploading_file.endswith('.lz'):
-                    #copy lz file to .lz dir
-                    lzpath, filename = os.path.split(local_path)
-                    lzpath = os.path.join(lzpath, ".lz")
-                    lzpath = os.path.join(lzpath, filename)
-                    if not os.path.exists(os.path.dirname(lzpath)):
-                        #os.mkdir(os.path.dirname(lzpath))
-                        os.makedirs(os.path.dirname(lzpath))
-                    shutil.copyfile(self.uploading_file, lzpath)
-
+                    # the .lz file itself is kept in the LzCache
                     #copy the origin file
-                    origin_file = self.uploading_file[0:-3]
+                    origin_file = self.uploading_origin
                     origin_path = local_path[0:-3]
                     if not os.path.exists(os.path.dirname(origin_path)):
                         #os.mkdir(os.path.dirname(origin_path))
@@ -2950,11 +3422,17 @@ class Makera(RelativeLayout):
                         #os.mkdir(os.path.dirname(local_path))
                         os.makedirs(os.path.dirname(local_path))
                     shutil.copyfile(self.uploading_file, local_path)
-            if self.file_popup.firmware_mode:
+            if firmware:
                 Clock.schedule_once(self.confirm_reset, 0)
+            else:
+                # the machine holds the original content under its own name once unpacked
+                if self.uploading_file.endswith('.lz'):
+                    self.remote_index.record(self.machine_key(), remotename[:-3], os.path.getsize(self.uploading_origin), md5)
+                else:
+                    self.remote_index.record(self.machine_key(), remotename, self.uploading_size, md5)
             # update recent folder
-            if not self.file_popup.firmware_mode:
-                self.update_recent_local_dir_list(os.path.dirname(self.uploading_file))
+            if not firmware:
+                self.update_recent_local_dir_list(os.path.dirname(self.uploading_origin))
 
             # If it is a compressed ''.lz' file, wait for the decompression to complete.
             if self.uploading_file.endswith('.lz'):
@@ -2962,7 +3440,9 @@ class Makera(RelativeLayout):
                 self.decompstatus = True
                 os.remove(self.uploading_file)
                 self.decomptime = time.time()
-                Clock.schedule_once(partial(self.progressStart, tr._('Decompressing') + '\n%s' % displayname, False), 0.2)
+                self.decomp_started = self.decomptime
+                if not job:
+                    Clock.schedule_once(partial(self.progressStart, tr._('Decompressing') + '\n%s' % displayname, False), 0.2)
 
         self.controller.sendNUM = 0
         if upload_result and callback:  # Only run callback if upload succeeded
@@ -2971,8 +3451,9 @@ class Makera(RelativeLayout):
             else:
                 callback(remotename, local_path)
         # For iOS we display the file list remotely only so we need to refresh it but on main thread
-        if upload_result and not self.file_popup.firmware_mode and not self.uploading_file.endswith('.lz'):
+        if upload_result and not firmware and not self.uploading_file.endswith('.lz'):
             Clock.schedule_once(self.file_popup.remote_rv.current_dir, 0)
+        return upload_result
 
 
     # -----------------------------------------------------------------------
@@ -2984,6 +3465,11 @@ class Makera(RelativeLayout):
 
     # -----------------------------------------------------------------------
     def uploadCallback(self, packet_size, total_packets, success_count, error_count):
+        if self.uploading_stream:
+            self.uploading_size = self.uploading_stream.size_hint()
+        if self.transfer_job:
+            self.transfer_queue.progress(min(total_packets * packet_size, self.uploading_size))
+            return
         packets = self.uploading_size / packet_size + (1 if self.uploading_size % packet_size > 0 else 0)
         Clock.schedule_once(partial(self.progressUpdate, total_packets * 100.0 / packets, '', False), 0)
 
@@ -2995,6 +3481,7 @@ class Makera(RelativeLayout):
     def fillRemoteDir(self, *args):
         is_dir = False
         self.file_popup.remote_rv.curr_file_list_buff = []
+        listed = []
         while self.controller.load_buffer.qsize() > 0:
             line = self.controller.load_buffer.get_nowait().strip('\r').strip('\n')
             if len(line) > 0 and line[0] != "<":
@@ -3013,6 +3500,11 @@ class Makera(RelativeLayout):
                     self.file_popup.remote_rv.curr_file_list_buff.append({'name': file_infos[0],
                                                      'path': os.path.join(self.file_popup.remote_rv.curr_dir, file_infos[0]),
                                                      'is_dir': is_dir, 'size': int(file_infos[1]), 'date': timestamp})
+                    if not is_dir:
+                        listed.append((file_infos[0], int(file_infos[1]), file_infos[2]))
+        # only a complete listing tells which files are gone
+        if self.loading_dir_complete:
+            self.remote_index.update_dir(self.machine_key(), self.loading_dir, listed)
 
         self.file_popup.remote_rv.fill_dir(switch_reverse = False)
 
@@ -3077,22 +3569,66 @@ class Makera(RelativeLayout):
         self.progress_popup.dismiss()
 
     # --------------------------------------------------------------`---------
-    def updateCompressProgress(self, value):
+    def updateCompressProgress(self, value, timed_out=False):
         Clock.schedule_once(partial(self.progressUpdate, value * 100.0 / self.fileCompressionBlocks, '', True), 0)
         if value == self.fileCompressionBlocks:
             Clock.schedule_once(self.progressFinish, 0)
             # Refresh the remote dir since upload finished
             Clock.schedule_once(self.file_popup.remote_rv.current_dir, 0)
             self.decompstatus = False
+            if self.upload_plan and self.transfer_planner:
+                now = time.time()
+                if not timed_out:
+                    self.transfer_planner.add_decompress(self.fileCompressionBlocks * BLOCK_SIZE,
+                                                         now - self.decomp_started)
+                self.transfer_planner.outcome(self.upload_plan, now - self.upload_started, not timed_out)
+                self.upload_plan = None
 
     # -----------------------------------------------------------------------
-    def updateStatus(self, *args):
+    # Feed the measured speeds of a finished upload back to the planner
+    # -----------------------------------------------------------------------
+    def learn_upload(self, reader, sending_time):
+        link = 'usb' if self.controller.conn_type == CONN_USB else 'wifi'
+        size = os.path.getsize(self.uploading_file)
+        if reader is None:
+            self.transfer_planner.add_link(link, size, sending_time)
+        else:
+            self.transfer_planner.add_compress(reader.read_in, reader.busy)
+            # the link speed only shows when compressing kept ahead of it
+            if reader.busy < sending_time * 0.8:
+                self.transfer_planner.add_link(link, size, sending_time)
+        if self.upload_plan and not self.upload_plan['compress']:
+            self.transfer_planner.outcome(self.upload_plan, time.time() - self.upload_started, True)
+            self.upload_plan = None
+
+    # -----------------------------------------------------------------------
+    def updateStatus(self, *args, changed=None):
+        # changed: None refreshes everything, otherwise only the fields that differ
+        # from the last shown snapshot are redrawn
         try:
             now = time.time()
             self.heartbeat_time = now
             app = App.get_running_app()
-            if app.state != CNC.vars["state"]:
-                app.state = CNC.vars["state"]
+            # one consistent report for the whole update; the same object as
+            # last time means nothing the machine reports has changed
+            snap = self.controller.snapshot
+            shown = self.shown_snapshot
+            self.shown_snapshot = snap
+            full = changed is None or shown is None or self.status_index != self.shown_status_index \
+                   or app.lasering != self.shown_lasering
+            self.shown_status_index = self.status_index
+            self.shown_lasering = app.lasering
+            if not full:
+                # what differs from the snapshot shown last, not the fields
+                # taken from the controller: a report published after they
+                # were taken would otherwise never be drawn
+                changed = set() if snap is shown else {name for name in snap if snap[name] != shown.get(name)}
+
+            def dirty(*names):
+                return full or not changed.isdisjoint(names)
+
+            if app.state != snap["state"]:
+                app.state = snap["state"]
                 CNC.vars["color"] = STATECOLOR[app.state]
                 self.status_data_view.color = CNC.vars["color"]
                 self.holding = 1 if app.state == 'Hold' else 0
@@ -3107,24 +3643,30 @@ class Makera(RelativeLayout):
                     self.status_drop_down.btn_connect_wifi.disabled = False
                     self.status_drop_down.btn_disconnect.disabled = True
                     self.config_loaded = False
+                    self.machine_name = ''
                     self.config_loading = False
                     self.fw_version_checked = False
                 else:
-                    self.status_data_view.minr_text = 'WiFi' if self.controller.connection_type == CONN_WIFI else 'USB'
+                    self.status_data_view.minr_text = self.connection_text()
                     self.status_drop_down.btn_connect_usb.disabled = True
                     self.status_drop_down.btn_connect_wifi.disabled = True
                     self.status_drop_down.btn_disconnect.disabled = False
 
                 self.status_drop_down.btn_unlock.disabled = (app.state != "Alarm" and app.state != "Sleep")
-                if (CNC.vars["halt_reason"] in HALT_REASON and CNC.vars["halt_reason"] > 20) or app.state == "Sleep":
+                if (snap["halt_reason"] in HALT_REASON and snap["halt_reason"] > 20) or app.state == "Sleep":
                     self.status_drop_down.btn_unlock.text = 'Reset'
                 else:
                     self.status_drop_down.btn_unlock.text = 'Unlock'
 
+            # machine restarted while the link was down: its settings may differ
+            if self.controller.session_changed:
+                self.controller.session_changed = False
+                self.config_loaded = False
+                self.fw_version_checked = False
+
             # load config, only one time per connection
             if not app.playing and not self.config_loaded and not self.config_loading and app.state == "Idle":
-                self.config_loading = True
-                self.download_config_file()
+                self.config_loading = self.download_config_file()
 
             # show update
             if not app.playing and self.fw_upd_text != '' and not self.fw_version_checked and app.state == "Idle":
@@ -3149,36 +3691,41 @@ class Makera(RelativeLayout):
                 self.alarm_triggered = False
 
             # update x data
-            self.x_data_view.main_text = "{:.3f}".format(CNC.vars["wx"])
-            self.x_data_view.minr_text = "{:.3f}".format(CNC.vars["mx"])
-            self.x_data_view.scale = 80.0 if app.lasering else 100.0
+            if dirty("wx", "mx"):
+                self.x_data_view.main_text = "{:.3f}".format(snap["wx"])
+                self.x_data_view.minr_text = "{:.3f}".format(snap["mx"])
+                self.x_data_view.scale = 80.0 if app.lasering else 100.0
             # update y data
-            self.y_data_view.main_text = "{:.3f}".format(CNC.vars["wy"])
-            self.y_data_view.minr_text = "{:.3f}".format(CNC.vars["my"])
-            self.y_data_view.scale = 80.0 if app.lasering else 100.0
+            if dirty("wy", "my"):
+                self.y_data_view.main_text = "{:.3f}".format(snap["wy"])
+                self.y_data_view.minr_text = "{:.3f}".format(snap["my"])
+                self.y_data_view.scale = 80.0 if app.lasering else 100.0
             # update z data
-            self.z_data_view.main_text = "{:.3f}".format(CNC.vars["wz"])
-            self.z_data_view.minr_text = "{:.3f}".format(CNC.vars["mz"])
-            self.z_data_view.scale = 80.0 if app.lasering or CNC.vars["max_delta"] != 0.0 else 100.0
-            self.z_drop_down.status_max.value = "{:.3f}".format(CNC.vars["max_delta"])
+            if dirty("wz", "mz", "max_delta"):
+                self.z_data_view.main_text = "{:.3f}".format(snap["wz"])
+                self.z_data_view.minr_text = "{:.3f}".format(snap["mz"])
+                self.z_data_view.scale = 80.0 if app.lasering or snap["max_delta"] != 0.0 else 100.0
+                self.z_drop_down.status_max.value = "{:.3f}".format(snap["max_delta"])
 
             # update a data
-            digi_len = 7 - len(str(int(CNC.vars["ma"])))
-            if digi_len < 0:
-                digi_len = 0
-            if digi_len > 3:
-                digi_len = 3
-            self.a_data_view.main_text = str("{:." + str(digi_len) + "f}").format(CNC.vars["ma"])
-            self.a_data_view.minr_text = "{:.3f}".format(CNC.vars["ma"])
+            if dirty("ma"):
+                digi_len = 7 - len(str(int(snap["ma"])))
+                if digi_len < 0:
+                    digi_len = 0
+                if digi_len > 3:
+                    digi_len = 3
+                self.a_data_view.main_text = str("{:." + str(digi_len) + "f}").format(snap["ma"])
+                self.a_data_view.minr_text = "{:.3f}".format(snap["ma"])
 
             #update feed data
-            self.feed_data_view.main_text = "{:.0f}".format(CNC.vars["curfeed"])
-            self.feed_data_view.scale = CNC.vars["OvFeed"]
-            self.feed_data_view.active = CNC.vars["curfeed"] > 0.0
-            if self.status_index % 2 == 0:
-                self.feed_data_view.minr_text = "{:.0f}".format(CNC.vars["OvFeed"]) + " %"
-            else:
-                self.feed_data_view.minr_text = "{:.0f}".format(CNC.vars["tarfeed"])
+            if dirty("curfeed", "tarfeed", "OvFeed"):
+                self.feed_data_view.main_text = "{:.0f}".format(snap["curfeed"])
+                self.feed_data_view.scale = snap["OvFeed"]
+                self.feed_data_view.active = snap["curfeed"] > 0.0
+                if self.status_index % 2 == 0:
+                    self.feed_data_view.minr_text = "{:.0f}".format(snap["OvFeed"]) + " %"
+                else:
+                    self.feed_data_view.minr_text = "{:.0f}".format(snap["tarfeed"])
 
             elapsed = now - self.control_list['feedrate_scale'][0]
             if elapsed < 2:
@@ -3186,24 +3733,25 @@ class Makera(RelativeLayout):
                     self.controller.setFeedScale(self.control_list['feedrate_scale'][1])
                     self.control_list['feedrate_scale'][0] = now - 2
             elif elapsed > 3 and self.feed_drop_down.opened:
-                self.feed_drop_down.status_scale.value = "{:.0f}".format(CNC.vars["OvFeed"]) + "%"
-                self.feed_drop_down.status_target.value = "{:.0f}".format(CNC.vars["tarfeed"])
-                if self.feed_drop_down.scale_slider.value != CNC.vars["OvFeed"]:
+                self.feed_drop_down.status_scale.value = "{:.0f}".format(snap["OvFeed"]) + "%"
+                self.feed_drop_down.status_target.value = "{:.0f}".format(snap["tarfeed"])
+                if self.feed_drop_down.scale_slider.value != snap["OvFeed"]:
                     self.feed_drop_down.scale_slider.set_flag = True
-                    self.feed_drop_down.scale_slider.value = CNC.vars["OvFeed"]
+                    self.feed_drop_down.scale_slider.value = snap["OvFeed"]
 
             # update spindle data
-            self.spindle_data_view.main_text = "{:.0f}".format(CNC.vars["curspindle"])
-            self.spindle_data_view.scale = CNC.vars["OvSpindle"]
-            self.spindle_data_view.active = CNC.vars["curspindle"] > 0.0
-            if self.status_index % 4 == 0:
-                self.spindle_data_view.minr_text = "{:.0f}".format(CNC.vars["tarspindle"])
-            elif self.status_index % 4 == 1:
-                self.spindle_data_view.minr_text = "{:.0f}".format(CNC.vars["OvSpindle"]) + " %"
-            elif self.status_index % 4 == 2:
-                self.spindle_data_view.minr_text = "{:.1f}".format(CNC.vars["spindletemp"]) + " °C"
-            else:
-                self.spindle_data_view.minr_text = "Vac: {}".format('On' if CNC.vars["vacuummode"] else 'Off')
+            if dirty("curspindle", "tarspindle", "OvSpindle", "spindletemp", "vacuummode"):
+                self.spindle_data_view.main_text = "{:.0f}".format(snap["curspindle"])
+                self.spindle_data_view.scale = snap["OvSpindle"]
+                self.spindle_data_view.active = snap["curspindle"] > 0.0
+                if self.status_index % 4 == 0:
+                    self.spindle_data_view.minr_text = "{:.0f}".format(snap["tarspindle"])
+                elif self.status_index % 4 == 1:
+                    self.spindle_data_view.minr_text = "{:.0f}".format(snap["OvSpindle"]) + " %"
+                elif self.status_index % 4 == 2:
+                    self.spindle_data_view.minr_text = "{:.1f}".format(snap["spindletemp"]) + " °C"
+                else:
+                    self.spindle_data_view.minr_text = "Vac: {}".format('On' if snap["vacuummode"] else 'Off')
 
             elapsed = now - self.control_list['vacuum_mode'][0]
             if elapsed < 2:
@@ -3211,9 +3759,9 @@ class Makera(RelativeLayout):
                     self.controller.setVacuumMode(self.control_list['vacuum_mode'][1])
                     self.control_list['vacuum_mode'][0] = now - 2
             elif elapsed > 3:
-                if self.spindle_drop_down.vacuum_switch.active != CNC.vars["vacuummode"]:
+                if self.spindle_drop_down.vacuum_switch.active != snap["vacuummode"]:
                     self.spindle_drop_down.vacuum_switch.set_flag = True
-                    self.spindle_drop_down.vacuum_switch.active = CNC.vars["vacuummode"]
+                    self.spindle_drop_down.vacuum_switch.active = snap["vacuummode"]
 
 
             elapsed = now - self.control_list['spindle_scale'][0]
@@ -3222,48 +3770,49 @@ class Makera(RelativeLayout):
                     self.controller.setSpindleScale(self.control_list['spindle_scale'][1])
                     self.control_list['spindle_scale'][0] = now - 2
             elif elapsed > 3 and self.spindle_drop_down.opened:
-                self.spindle_drop_down.status_scale.value = "{:.0f}".format(CNC.vars["OvSpindle"]) + "%"
-                self.spindle_drop_down.status_target.value = "{:.0f}".format(CNC.vars["tarspindle"])
-                self.spindle_drop_down.status_temp.value = "{:.1f}".format(CNC.vars["spindletemp"]) + "°C"
-                if self.spindle_drop_down.scale_slider.value != CNC.vars["OvSpindle"]:
+                self.spindle_drop_down.status_scale.value = "{:.0f}".format(snap["OvSpindle"]) + "%"
+                self.spindle_drop_down.status_target.value = "{:.0f}".format(snap["tarspindle"])
+                self.spindle_drop_down.status_temp.value = "{:.1f}".format(snap["spindletemp"]) + "°C"
+                if self.spindle_drop_down.scale_slider.value != snap["OvSpindle"]:
                     self.spindle_drop_down.scale_slider.set_flag = True
-                    self.spindle_drop_down.scale_slider.value = CNC.vars["OvSpindle"]
+                    self.spindle_drop_down.scale_slider.value = snap["OvSpindle"]
 
-            app.tool = CNC.vars["tool"]
+            app.tool = snap["tool"]
 
             # update tool data
-            if CNC.vars["tool"] < 0:
-                if app.lasering or CNC.vars["tool"] == 8888:
-                    self.tool_data_view.main_text = tr._("Laser")
-                    if self.status_index % 2 == 0:
-                        self.tool_data_view.minr_text = "TLO: {:.3f}".format(CNC.vars["tlo"])
+            if dirty("tool", "tlo", "target_tool", "wpvoltage", "atc_state"):
+                if snap["tool"] < 0:
+                    if app.lasering or snap["tool"] == 8888:
+                        self.tool_data_view.main_text = tr._("Laser")
+                        if self.status_index % 2 == 0:
+                            self.tool_data_view.minr_text = "TLO: {:.3f}".format(snap["tlo"])
+                        else:
+                            self.tool_data_view.minr_text = "WP: {:.2f}v".format(snap["wpvoltage"])
+                        self.tool_drop_down.status_tlo.value = "{:.3f}".format(snap["tlo"])
                     else:
-                        self.tool_data_view.minr_text = "WP: {:.2f}v".format(CNC.vars["wpvoltage"])
-                    self.tool_drop_down.status_tlo.value = "{:.3f}".format(CNC.vars["tlo"])
+                        self.tool_data_view.main_text = tr._("None")
+                        self.tool_data_view.minr_text = "WP: {:.2f}v".format(snap["wpvoltage"])
+                        self.tool_drop_down.status_tlo.value = "N/A"
                 else:
-                    self.tool_data_view.main_text = tr._("None")
-                    self.tool_data_view.minr_text = "WP: {:.2f}v".format(CNC.vars["wpvoltage"])
-                    self.tool_drop_down.status_tlo.value = "N/A"
-            else:
-                if self.status_index % 2 == 0:
-                    self.tool_data_view.minr_text = "TLO: {:.3f}".format(CNC.vars["tlo"])
-                else:
-                    self.tool_data_view.minr_text = "WP: {:.2f}v".format(CNC.vars["wpvoltage"])
-                self.tool_drop_down.status_tlo.value = "{:.3f}".format(CNC.vars["tlo"])
-                if CNC.vars["tool"] == 0:
-                    self.tool_data_view.main_text = tr._("Probe")
-                elif CNC.vars["tool"] == 8888:
-                    self.tool_data_view.main_text = tr._("Laser")
-                elif CNC.vars["tool"] == 999990:
-                    self.tool_data_view.main_text = tr._("3DProb")
-                else:
-                    self.tool_data_view.main_text = "{:.0f}".format(CNC.vars["tool"])
-            self.tool_drop_down.status_wpvoltage.value = "{:.2f}v".format(CNC.vars["wpvoltage"])
+                    if self.status_index % 2 == 0:
+                        self.tool_data_view.minr_text = "TLO: {:.3f}".format(snap["tlo"])
+                    else:
+                        self.tool_data_view.minr_text = "WP: {:.2f}v".format(snap["wpvoltage"])
+                    self.tool_drop_down.status_tlo.value = "{:.3f}".format(snap["tlo"])
+                    if snap["tool"] == 0:
+                        self.tool_data_view.main_text = tr._("Probe")
+                    elif snap["tool"] == 8888:
+                        self.tool_data_view.main_text = tr._("Laser")
+                    elif snap["tool"] == 999990:
+                        self.tool_data_view.main_text = tr._("3DProb")
+                    else:
+                        self.tool_data_view.main_text = "{:.0f}".format(snap["tool"])
+                self.tool_drop_down.status_wpvoltage.value = "{:.2f}v".format(snap["wpvoltage"])
 
-            self.tool_data_view.active = CNC.vars["atc_state"] in [1, 2, 3]
+                self.tool_data_view.active = snap["atc_state"] in [1, 2, 3]
 
             # update laser status
-            if CNC.vars["lasermode"]:
+            if snap["lasermode"]:
                 if not app.lasering:
                     self.coord_popup.set_config('margin', 'active', False)
                     self.coord_popup.set_config('zprobe', 'active', False)
@@ -3274,11 +3823,12 @@ class Makera(RelativeLayout):
                 app.lasering = False
 
             # update laser data
-            self.laser_data_view.active = CNC.vars["lasermode"]
-            self.laser_data_view.scale = CNC.vars["laserscale"]
-            self.laser_data_view.main_text = "{:.1f}".format(CNC.vars["laserpower"])
-            self.laser_data_view.minr_text = "{:.0f}".format(CNC.vars["laserscale"]) + " %"
-            self.laser_drop_down.status_scale.value = "{:.0f}".format(CNC.vars["laserscale"]) + "%"
+            if dirty("lasermode", "laserpower", "laserscale"):
+                self.laser_data_view.active = snap["lasermode"]
+                self.laser_data_view.scale = snap["laserscale"]
+                self.laser_data_view.main_text = "{:.1f}".format(snap["laserpower"])
+                self.laser_data_view.minr_text = "{:.0f}".format(snap["laserscale"]) + " %"
+                self.laser_drop_down.status_scale.value = "{:.0f}".format(snap["laserscale"]) + "%"
 
 
             elapsed = now - self.control_list['laser_mode'][0]
@@ -3290,9 +3840,9 @@ class Makera(RelativeLayout):
                         self.controller.setLaserMode(False)
                     self.control_list['laser_mode'][0] = now - 2
             elif elapsed > 3:
-                if self.laser_drop_down.switch.active != CNC.vars["lasermode"]:
+                if self.laser_drop_down.switch.active != snap["lasermode"]:
                     self.laser_drop_down.switch.set_flag = True
-                    self.laser_drop_down.switch.active = CNC.vars["lasermode"]
+                    self.laser_drop_down.switch.active = snap["lasermode"]
 
             elapsed = now - self.control_list['laser_test'][0]
             if elapsed < 2:
@@ -3300,9 +3850,9 @@ class Makera(RelativeLayout):
                     self.controller.setLaserTest(self.control_list['laser_test'][1])
                     self.control_list['laser_test'][0] = now - 2
             elif elapsed > 3:
-                if self.laser_drop_down.test_switch.active != CNC.vars["lasertesting"]:
+                if self.laser_drop_down.test_switch.active != snap["lasertesting"]:
                     self.laser_drop_down.test_switch.set_flag = True
-                    self.laser_drop_down.test_switch.active = CNC.vars["lasertesting"]
+                    self.laser_drop_down.test_switch.active = snap["lasertesting"]
 
             elapsed = now - self.control_list['laser_scale'][0]
             if elapsed < 2:
@@ -3310,12 +3860,12 @@ class Makera(RelativeLayout):
                     self.controller.setLaserScale(self.control_list['laser_scale'][1])
                     self.control_list['laser_scale'][0] = now - 2
             elif elapsed > 3 and self.laser_drop_down.opened:
-                if self.laser_drop_down.scale_slider.value != CNC.vars["laserscale"]:
+                if self.laser_drop_down.scale_slider.value != snap["laserscale"]:
                     self.laser_drop_down.scale_slider.set_flag = True
-                    self.laser_drop_down.scale_slider.value = CNC.vars["laserscale"]
+                    self.laser_drop_down.scale_slider.value = snap["laserscale"]
 
             # update progress bar and set selected
-            if CNC.vars["playedlines"] <= 0:
+            if snap["playedlines"] <= 0:
                 # not playing
                 app.playing = False
                 self.wpb_margin.value = 0
@@ -3325,8 +3875,8 @@ class Makera(RelativeLayout):
                 self.progress_info = ""
 
                 last_job_elapsed = ""
-                if CNC.vars["playedseconds"] > 0:
-                    last_job_elapsed = " ( {} elapsed )".format(Utils.second2hour(CNC.vars["playedseconds"]))
+                if snap["playedseconds"] > 0:
+                    last_job_elapsed = " ( {} elapsed )".format(Utils.second2hour(snap["playedseconds"]))
                 # show file name on progress bar area
                 if app.selected_remote_filename != '':
                     self.progress_info = ' ' + app.selected_remote_filename + last_job_elapsed
@@ -3337,9 +3887,9 @@ class Makera(RelativeLayout):
             else:
                 app.playing = True
                 # playing file remotely
-                if self.played_lines != CNC.vars["playedlines"]:
-                    self.played_lines = CNC.vars["playedlines"]
-                    self.wpb_play.value = CNC.vars["playedpercent"]
+                if self.played_lines != snap["playedlines"]:
+                    self.played_lines = snap["playedlines"]
+                    self.wpb_play.value = snap["playedpercent"]
                     self.progress_info = ''
                     if (app.selected_remote_filename != '' or app.selected_local_filename != '') and self.selected_file_line_count > 0:
                         # update gcode list
@@ -3348,27 +3898,27 @@ class Makera(RelativeLayout):
                         self.gcode_viewer.set_distance_by_lineidx(self.played_lines, 0.5)
                         # update progress info
                         self.progress_info = os.path.basename(app.selected_remote_filename if app.selected_remote_filename != '' else app.selected_local_filename) + ' ( {}/{} - {}%, {} elapsed'.format( \
-                                                     self.played_lines, self.selected_file_line_count, int(self.wpb_play.value), Utils.second2hour(CNC.vars["playedseconds"]))
+                                                     self.played_lines, self.selected_file_line_count, int(self.wpb_play.value), Utils.second2hour(snap["playedseconds"]))
                         if self.wpb_play.value > 0:
-                            self.progress_info = self.progress_info + ', {} to go )'.format(Utils.second2hour((100 - self.wpb_play.value) * CNC.vars["playedseconds"] / self.wpb_play.value))
+                            self.progress_info = self.progress_info + ', {} to go )'.format(Utils.second2hour((100 - self.wpb_play.value) * snap["playedseconds"] / self.wpb_play.value))
                         else:
                             self.progress_info = self.progress_info + ' )'
                 # playing margin
-                if CNC.vars["atc_state"] == 4:
+                if snap["atc_state"] == 4:
                     self.wpb_margin.value += 14
                     if self.wpb_margin.value >= 84:
                         self.wpb_margin.value = 14
                 elif self.wpb_margin.value > 0:
                     self.wpb_margin.value = 84
                 # playing zprobe
-                if CNC.vars["atc_state"] == 5:
+                if snap["atc_state"] == 5:
                     self.wpb_zprobe.value += 14
                     if self.wpb_zprobe.value >= 84:
                         self.wpb_zprobe.value = 14
                 elif self.wpb_zprobe.value > 0:
                     self.wpb_zprobe.value = 84
                 # playing leveling
-                if CNC.vars["atc_state"] == 6:
+                if snap["atc_state"] == 6:
                     self.wpb_leveling.value += 14
                     if self.wpb_leveling.value >= 84:
                         self.wpb_leveling.value = 14
@@ -3384,39 +3934,40 @@ class Makera(RelativeLayout):
             now = time.time()
 
             app = App.get_running_app()
+            snap = self.controller.snapshot
             # control spindle
-            self.diagnose_popup.sw_spindle.disabled = CNC.vars['lasermode']
-            self.diagnose_popup.sl_spindle.disabled = CNC.vars['lasermode']
+            self.diagnose_popup.sw_spindle.disabled = snap['lasermode']
+            self.diagnose_popup.sl_spindle.disabled = snap['lasermode']
             elapsed = now - self.control_list['spindle_switch'][0]
             if elapsed < 2:
                 if elapsed > 0.5:
                     self.controller.setSpindleSwitch(self.control_list['spindle_switch'][1], self.diagnose_popup.sl_spindle.slider.value)
                     self.control_list['spindle_switch'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sw_spindle.switch.active != CNC.vars["sw_spindle"]:
+                if self.diagnose_popup.sw_spindle.switch.active != snap["sw_spindle"]:
                     self.diagnose_popup.sw_spindle.set_flag = True
-                    self.diagnose_popup.sw_spindle.switch.active = CNC.vars["sw_spindle"]
+                    self.diagnose_popup.sw_spindle.switch.active = snap["sw_spindle"]
             elapsed = now - self.control_list['spindle_slider'][0]
             if elapsed < 2:
                 if elapsed > 0.5:
                     self.controller.setSpindleSwitch(self.diagnose_popup.sw_spindle.switch.active, self.control_list['spindle_slider'][1])
                     self.control_list['spindle_slider'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sl_spindle.slider.value != CNC.vars["sl_spindle"]:
+                if self.diagnose_popup.sl_spindle.slider.value != snap["sl_spindle"]:
                     self.diagnose_popup.sl_spindle.set_flag = True
-                    self.diagnose_popup.sl_spindle.slider.value = CNC.vars["sl_spindle"]
+                    self.diagnose_popup.sl_spindle.slider.value = snap["sl_spindle"]
 
             # control spindle fan
-            self.diagnose_popup.sl_spindlefan.disabled = CNC.vars['lasermode']
+            self.diagnose_popup.sl_spindlefan.disabled = snap['lasermode']
             elapsed = now - self.control_list['spindlefan_slider'][0]
             if elapsed < 2:
                 if elapsed > 0.5:
                     self.controller.setSpindlefanPower(self.control_list['spindlefan_slider'][1])
                     self.control_list['spindlefan_slider'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sl_spindlefan.slider.value != CNC.vars["sl_spindlefan"]:
+                if self.diagnose_popup.sl_spindlefan.slider.value != snap["sl_spindlefan"]:
                     self.diagnose_popup.sl_spindlefan.set_flag = True
-                    self.diagnose_popup.sl_spindlefan.slider.value = CNC.vars["sl_spindlefan"]
+                    self.diagnose_popup.sl_spindlefan.slider.value = snap["sl_spindlefan"]
 
             # control vacuum
             elapsed = now - self.control_list['vacuum_slider'][0]
@@ -3425,9 +3976,9 @@ class Makera(RelativeLayout):
                     self.controller.setVacuumPower(self.control_list['vacuum_slider'][1])
                     self.control_list['vacuum_slider'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sl_vacuum.slider.value != CNC.vars["sl_vacuum"]:
+                if self.diagnose_popup.sl_vacuum.slider.value != snap["sl_vacuum"]:
                     self.diagnose_popup.sl_vacuum.set_flag = True
-                    self.diagnose_popup.sl_vacuum.slider.value = CNC.vars["sl_vacuum"]
+                    self.diagnose_popup.sl_vacuum.slider.value = snap["sl_vacuum"]
 
             # control laser mode
             elapsed = now - self.control_list['laser_switch'][0]
@@ -3439,21 +3990,21 @@ class Makera(RelativeLayout):
                         self.controller.setLaserMode(False)
                     self.control_list['laser_switch'][0] = now - 2
             elif elapsed > 3:
-                if self.laser_drop_down.switch.active != CNC.vars["lasermode"]:
+                if self.laser_drop_down.switch.active != snap["lasermode"]:
                     self.laser_drop_down.switch.set_flag = True
-                    self.laser_drop_down.switch.active = CNC.vars["lasermode"]
+                    self.laser_drop_down.switch.active = snap["lasermode"]
 
             # control laser slider
-            self.diagnose_popup.sl_laser.disabled = not CNC.vars['lasermode']
+            self.diagnose_popup.sl_laser.disabled = not snap['lasermode']
             elapsed = now - self.control_list['laser_slider'][0]
             if elapsed < 2:
                 if elapsed > 0.5:
                     self.controller.setLaserPower(self.control_list['laser_slider'][1])
                     self.control_list['laser_slider'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sl_laser.slider.value != CNC.vars["sl_laser"]:
+                if self.diagnose_popup.sl_laser.slider.value != snap["sl_laser"]:
                     self.diagnose_popup.sl_laser.set_flag = True
-                    self.diagnose_popup.sl_laser.slider.value = CNC.vars["sl_laser"]
+                    self.diagnose_popup.sl_laser.slider.value = snap["sl_laser"]
 
             # control light
             elapsed = now - self.control_list['light_switch'][0]
@@ -3462,9 +4013,9 @@ class Makera(RelativeLayout):
                     self.controller.setLightSwitch(self.control_list['light_switch'][1])
                     self.control_list['light_switch'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sw_light.switch.active != CNC.vars["sw_light"]:
+                if self.diagnose_popup.sw_light.switch.active != snap["sw_light"]:
                     self.diagnose_popup.sw_light.set_flag = True
-                    self.diagnose_popup.sw_light.switch.active = CNC.vars["sw_light"]
+                    self.diagnose_popup.sw_light.switch.active = snap["sw_light"]
 
             # control tool sensor power
             elapsed = now - self.control_list['tool_sensor_switch'][0]
@@ -3473,9 +4024,9 @@ class Makera(RelativeLayout):
                     self.controller.setToolSensorSwitch(self.control_list['tool_sensor_switch'][1])
                     self.control_list['tool_sensor_switch'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sw_tool_sensor_pwr.switch.active != CNC.vars["sw_tool_sensor_pwr"]:
+                if self.diagnose_popup.sw_tool_sensor_pwr.switch.active != snap["sw_tool_sensor_pwr"]:
                     self.diagnose_popup.sw_tool_sensor_pwr.set_flag = True
-                    self.diagnose_popup.sw_tool_sensor_pwr.switch.active = CNC.vars["sw_tool_sensor_pwr"]
+                    self.diagnose_popup.sw_tool_sensor_pwr.switch.active = snap["sw_tool_sensor_pwr"]
 
             # control air
             elapsed = now - self.control_list['air_switch'][0]
@@ -3484,9 +4035,9 @@ class Makera(RelativeLayout):
                     self.controller.setAirSwitch(self.control_list['air_switch'][1])
                     self.control_list['air_switch'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sw_air.switch.active != CNC.vars["sw_air"]:
+                if self.diagnose_popup.sw_air.switch.active != snap["sw_air"]:
                     self.diagnose_popup.sw_air.set_flag = True
-                    self.diagnose_popup.sw_air.switch.active = CNC.vars["sw_air"]
+                    self.diagnose_popup.sw_air.switch.active = snap["sw_air"]
 
             # control pw charge power
             elapsed = now - self.control_list['wp_charge_switch'][0]
@@ -3495,22 +4046,22 @@ class Makera(RelativeLayout):
                     self.controller.setPWChargeSwitch(self.control_list['wp_charge_switch'][1])
                     self.control_list['wp_charge_switch'][0] = now - 2
             elif elapsed > 3:
-                if self.diagnose_popup.sw_wp_charge_pwr.switch.active != CNC.vars["sw_wp_charge_pwr"]:
+                if self.diagnose_popup.sw_wp_charge_pwr.switch.active != snap["sw_wp_charge_pwr"]:
                     self.diagnose_popup.sw_wp_charge_pwr.set_flag = True
-                    self.diagnose_popup.sw_wp_charge_pwr.switch.active = CNC.vars["sw_wp_charge_pwr"]
+                    self.diagnose_popup.sw_wp_charge_pwr.switch.active = snap["sw_wp_charge_pwr"]
 
             # update states
-            self.diagnose_popup.st_x_min.state = CNC.vars["st_x_min"]
-            self.diagnose_popup.st_x_max.state = CNC.vars["st_x_max"]
-            self.diagnose_popup.st_y_min.state = CNC.vars["st_y_min"]
-            self.diagnose_popup.st_y_max.state = CNC.vars["st_y_max"]
-            self.diagnose_popup.st_z_max.state = CNC.vars["st_z_max"]
-            self.diagnose_popup.st_cover.state = CNC.vars["st_cover"]
-            self.diagnose_popup.st_probe.state = CNC.vars["st_probe"]
-            self.diagnose_popup.st_calibrate.state = CNC.vars["st_calibrate"]
-            self.diagnose_popup.st_atc_home.state = CNC.vars["st_atc_home"]
-            self.diagnose_popup.st_tool_sensor.state = CNC.vars["st_tool_sensor"]
-            self.diagnose_popup.st_e_stop.state = CNC.vars["st_e_stop"]
+            self.diagnose_popup.st_x_min.state = snap["st_x_min"]
+            self.diagnose_popup.st_x_max.state = snap["st_x_max"]
+            self.diagnose_popup.st_y_min.state = snap["st_y_min"]
+            self.diagnose_popup.st_y_max.state = snap["st_y_max"]
+            self.diagnose_popup.st_z_max.state = snap["st_z_max"]
+            self.diagnose_popup.st_cover.state = snap["st_cover"]
+            self.diagnose_popup.st_probe.state = snap["st_probe"]
+            self.diagnose_popup.st_calibrate.state = snap["st_calibrate"]
+            self.diagnose_popup.st_atc_home.state = snap["st_atc_home"]
+            self.diagnose_popup.st_tool_sensor.state = snap["st_tool_sensor"]
+            self.diagnose_popup.st_e_stop.state = snap["st_e_stop"]
         except:
             print(sys.exc_info()[1])
 
@@ -3529,7 +4080,7 @@ class Makera(RelativeLayout):
         self.gcode_rv.set_selected_line(self.test_line - 1)
 
     def execCallback(self, line):
-        self.manual_rv.data.append({'text': line, 'color': (200/255, 200/255, 200/255, 1)})
+        self.manual_rv.append_line(line, (200/255, 200/255, 200/255, 1))
 
     # -----------------------------------------------------------------------
     def openUSB(self, device):
@@ -3710,6 +4261,8 @@ class Makera(RelativeLayout):
             app.root.keyboard_jog_control = False
             app.root.ids.kb_jog_btn.state = 'normal'
             Window.unbind(on_key_down=self._keyboard_jog_keydown)    
+            Window.unbind(on_key_up=self._keyboard_jog_keyup)
+            self.stop_keyboard_jog()
     
     def toggle_keyboard_jog_control(self):
         app = App.get_running_app()
@@ -3717,19 +4270,26 @@ class Makera(RelativeLayout):
 
         if app.root.keyboard_jog_control:
             Window.bind(on_key_down=self._keyboard_jog_keydown)
+            Window.bind(on_key_up=self._keyboard_jog_keyup)
         else:
             Window.unbind(on_key_down=self._keyboard_jog_keydown)
+            Window.unbind(on_key_up=self._keyboard_jog_keyup)
+            self.stop_keyboard_jog()
     
     def _is_popup_open(self):
         """Checks to see if any of the popups objects are open."""
-        popups_to_check = [self.file_popup._is_open, self.coord_popup._is_open, self.xyz_probe_popup._is_open,
-                           self.pairing_popup._is_open,
-                           self.upgrade_popup._is_open, self.language_popup._is_open, self.diagnose_popup._is_open,
-                           self.confirm_popup._is_open,
-                           self.message_popup._is_open, self.progress_popup._is_open, self.input_popup._is_open,
-                           self.config_popup._is_open, self.probing_popup._is_open]
-
-        return any(popups_to_check)
+        return any(popup._is_open for popup in self._popups())
+
+    def _popups(self):
+        return [self.file_popup, self.coord_popup, self.xyz_probe_popup, self.pairing_popup,
+                self.upgrade_popup, self.language_popup, self.diagnose_popup, self.confirm_popup,
+                self.message_popup, self.progress_popup, self.input_popup,
+                self.config_popup, self.probing_popup]
+
+    def stop_keyboard_jog(self, *args):
+        """Forget held jog keys, their key up may never come"""
+        self.jog_keys_down.clear()
+        self.controller.jogger.release()
     
     def _keyboard_jog_keydown(self, *args):
         app = App.get_running_app()
@@ -3737,18 +4297,36 @@ class Makera(RelativeLayout):
         # Only allow keyboard jogging when machine in a suitable state and has no popups open
         if (app.state in ['Idle', 'Run', 'Pause'] or (app.playing and app.state == 'Pause')) and not self._is_popup_open():
             key = args[1]  # keycode
+            if key in self.jog_keys_down:
+                # key repeat: the held key already jogs continuously, keep it going
+                self.controller.jogger.repeat()
+                return
             if key == 274:  # down button
-                app.root.controller.jog_with_speed("Y{}".format(app.root.step_xy.text), app.root.jog_speed)
+                move = "Y{}".format(app.root.step_xy.text)
             elif key == 273:  # up button
-                app.root.controller.jog_with_speed("Y-{}".format(app.root.step_xy.text), app.root.jog_speed)
+                move = "Y-{}".format(app.root.step_xy.text)
             elif key == 275:  # right button
-                app.root.controller.jog_with_speed("X{}".format(app.root.step_xy.text), app.root.jog_speed)
+                move = "X{}".format(app.root.step_xy.text)
             elif key == 276:  # left button
-                app.root.controller.jog_with_speed("X-{}".format(app.root.step_xy.text), app.root.jog_speed)
+                move = "X-{}".format(app.root.step_xy.text)
             elif key == 280:  # page up
-                app.root.controller.jog_with_speed("Z{}".format(app.root.step_z.text), app.root.jog_speed)
+                move = "Z{}".format(app.root.step_z.text)
             elif key == 281:  # page down
-                app.root.controller.jog_with_speed("Z-{}".format(app.root.step_z.text), app.root.jog_speed)
+                move = "Z-{}".format(app.root.step_z.text)
+            else:
+                return
+            if app.state == 'Run':
+                # single steps only while a job runs, no continuous jog
+                app.root.controller.jogger.step(move, app.root.jog_speed)
+                return
+            self.jog_keys_down.add(key)
+            app.root.controller.jogger.press(move, app.root.jog_speed)
+
+    def _keyboard_jog_keyup(self, *args):
+        key = args[1]  # keycode
+        if key in self.jog_keys_down:
+            self.jog_keys_down.discard(key)
+            self.controller.jogger.release()
 
     def apply_setting_changes(self):
         if self.setting_change_list:
@@ -4085,7 +4663,12 @@ class Makera(RelativeLayout):
         if to_send:
             self.manual_rv.scroll_y = 0
             if to_send.lower() == "clear":
-                self.manual_rv.data = []
+                self.manual_rv.clear_lines()
+            elif to_send.lower() == "search" or to_send.lower().startswith("search "):
+                self.manual_rv.search_lines(to_send[7:].strip())
+            elif to_send.lower() == "lanes":
+                for line in self.controller.laneReport():
+                    self.controller.log.put((Controller.MSG_NORMAL, line))
             else:
                 self.controller.executeCommand(to_send)
         self.manual_cmd.text = ''
@@ -4179,12 +4762,14 @@ def load_constants():
     global SHORT_LOAD_TIMEOUT
     global WIFI_LOAD_TIMEOUT
     global HEARTBEAT_TIMEOUT
+    global MD5_LOAD_TIMEOUT
     global MAX_TOUCH_INTERVAL
     global GCODE_VIEW_SPEED
     global LOAD_INTERVAL
     global MAX_LOAD_LINES
     global BLOCK_SIZE
     global BLOCK_HEADER_SIZE
+    global TRANSFER_RETRIES
 
     global FW_UPD_ADDRESS
     global CTL_UPD_ADDRESS
@@ -4207,6 +4792,8 @@ def load_constants():
     SHORT_LOAD_TIMEOUT = 3  # s
     WIFI_LOAD_TIMEOUT = 30 # s
     HEARTBEAT_TIMEOUT = 10
+    MD5_LOAD_TIMEOUT = 30   # s, the machine reads the whole file to hash it
+    TRANSFER_RETRIES = 3    # reconnects to continue an interrupted upload / download
     MAX_TOUCH_INTERVAL = 0.15
     GCODE_VIEW_SPEED = 1
 